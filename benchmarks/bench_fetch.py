@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks fetching the indicators from a recorded cassette.
+
+Replays a cassette, as recorded with ``quandl_fund_xlsx --record``, through
+fundamentals_frame at each number of fetch workers, and reports the time
+taken and the requests made, including those throttled and retried.
+
+Usage:
+  bench_fetch.py <cassette> (-i <ticker-file> | (-t <ticker>)...)
+                 [-d <sharadar-db>] [--dimension <dimension>] [-y <years>]
+                 [--latency <ms>] [--jitter <ms>] [--rate <rps>]
+                 [--workers <list>]
+
+Options:
+  -i --input <file>        File containing one ticker per line
+  -t --ticker <ticker>     Ticker symbol
+  -d --database <db>       Sharadar database recorded [default: SF0]
+  --dimension <dimension>  Sharadar dimension recorded [default: MRY]
+  -y --years <years>       Years of results recorded [default: 5]
+  --latency <ms>           Delay of each response [default: 100]
+  --jitter <ms>            Most random delay added to each response [default: 0]
+  --rate <rps>             Requests per second answered, by default unlimited
+  --workers <list>         Comma separated fetch workers to time [default: 1,2,4,8]
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import os
+import time
+
+from docopt import docopt
+
+from quandl_fund_xlsx.cassette import ReplayServer
+from quandl_fund_xlsx.fundamentals import fundamentals_frame
+
+
+def run(arguments, tickers, workers):
+    rate = arguments["--rate"]
+    with ReplayServer(
+        arguments["<cassette>"],
+        latency=float(arguments["--latency"]) / 1000,
+        jitter=float(arguments["--jitter"]) / 1000,
+        rate=None if rate is None else float(rate),
+    ) as replay:
+        start = time.perf_counter()
+        frame = fundamentals_frame(
+            tickers,
+            arguments["--database"],
+            arguments["--dimension"],
+            int(arguments["--years"]),
+            workers=workers,
+            bulk_threshold=None,
+        )
+        elapsed = time.perf_counter() - start
+    print(
+        "%3d workers %8.3f s %6d rows %6d requests %6d throttled %6d missing"
+        % (
+            workers,
+            elapsed,
+            len(frame),
+            replay.requests,
+            replay.throttled,
+            replay.missing,
+        )
+    )
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+    if arguments["--input"] is not None:
+        with open(arguments["--input"]) as t_file:
+            tickers = [line.strip() for line in t_file if line.strip()]
+    else:
+        tickers = arguments["--ticker"]
+    # Replayed requests need a key, though it is not checked
+    for database in ("SF0", "SF1"):
+        os.environ.setdefault("QUANDL_API_%s_KEY" % database, "replay")
+
+    for workers in arguments["--workers"].split(","):
+        run(arguments, tickers, int(workers))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks the ratio backends of kernels.py over a large panel.
+
+Evaluates a set of ratios over synthetic indicator arrays with each
+installed backend, and with the plain numpy evaluation of ratios.py, and
+reports the time taken, the rows per second and the peak memory allocated
+beyond the indicators and the results themselves.
+
+Usage:
+  python benchmarks/bench_ratios.py [<rows>] [<ratio>...]
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from quandl_fund_xlsx.kernels import (
+    available_backends,
+    evaluate_ratios_compiled,
+    expression_inputs,
+    inline_expression,
+)
+from quandl_fund_xlsx.ratios import evaluate_ratios
+
+ROWS = 10_000_000
+
+RATIOS = [
+    "net_debt_ebitda_ratio",
+    "net_debt_ebitda_minus_capex_ratio",
+    "debt_ebitda_minus_capex_ratio",
+    "ebitda_minus_capex_interest_coverage",
+    "excess_cash_margin_ratio",
+    "rough_affo_dividend_payout_ratio",
+]
+
+
+def make_indicators(ratios, rows):
+    rng = np.random.default_rng(0)
+    names = set()
+    for ratio in ratios:
+        names.update(expression_inputs(inline_expression(ratio)))
+    return {name: rng.uniform(-1e9, 1e9, rows) for name in sorted(names)}
+
+
+def run(name, evaluate, ratios, rows):
+    # Warm up, compiling any numba kernels, on a small slice
+    evaluate({n: v[:1000] for n, v in indicators.items()})
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = evaluate(indicators)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result_bytes = sum(r.nbytes for r in results.values())
+    print(
+        "%-8s %8.3f s %10.1f M rows/s %10.1f MB temporaries"
+        % (
+            name,
+            elapsed,
+            rows * len(ratios) / elapsed / 1e6,
+            (peak - result_bytes) / 2 ** 20,
+        )
+    )
+    return results
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    ratios = sys.argv[2:] or RATIOS
+    indicators = make_indicators(ratios, rows)
+    print("%d rows, %d ratios, %d indicators" % (rows, len(ratios), len(indicators)))
+
+    expected = run("eval", lambda i: evaluate_ratios(ratios, i), ratios, rows)
+    for backend in available_backends():
+        results = run(
+            backend,
+            lambda i: evaluate_ratios_compiled(ratios, i, backend=backend),
+            ratios,
+            rows,
+        )
+        for ratio in ratios:
+            np.testing.assert_allclose(results[ratio], expected[ratio], rtol=1e-12)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks the cost of tracing and debug logging per ticker.
+
+Logging at INFO level, as the command line does by default, reports:
+
+- the cost of a span with tracing disabled and enabled, and of the debug
+  messages of get_indicators formatted eagerly, as they were, and lazily
+- the time per ticker of writing a workbook of synthetic tickers, with the
+  indicators generated in place of quandl.get_table, with tracing disabled
+  and enabled
+
+Usage:
+  python benchmarks/bench_tracing.py [<tickers>]
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx import tracing
+from synthetic import PERIODS, get_table
+
+TICKERS = 200
+CALLS = 10000
+
+
+def per_call(statement, number=CALLS, **names):
+    """The microseconds per call of statement, the best of 5 runs."""
+    timer = timeit.Timer(statement, globals=names)
+    return min(timer.repeat(5, number)) / number * 1e6
+
+
+def micro(tmp_dir):
+    sf1_df = get_table("SHARADAR/SF1", ticker="AAA", dimension="MRY")
+    logger = fun.logger
+    print(
+        "span, disabled         %10.3f us"
+        % per_call("with span('fetch', 'AAA'): pass", span=tracing.span)
+    )
+    tracing.enable(os.path.join(tmp_dir, "micro.jsonl"))
+    try:
+        print(
+            "span, enabled          %10.3f us"
+            % per_call("with span('fetch', 'AAA'): pass", span=tracing.span)
+        )
+    finally:
+        tracing.disable()
+    # The debug messages of get_indicators
+    print(
+        "debug, eager %%          %10.3f us"
+        % per_call(
+            "logger.debug('columns = %s' % (df.columns.tolist()));"
+            "logger.debug('all_inds_df = %s' % (df.head()))",
+            number=100,
+            logger=logger,
+            df=sf1_df,
+        )
+    )
+    print(
+        "debug, lazy            %10.3f us"
+        % per_call(
+            "if logger.isEnabledFor(DEBUG):"
+            " logger.debug('columns = %s', df.columns.tolist());"
+            " logger.debug('all_inds_df = %s', df.head())",
+            logger=logger,
+            df=sf1_df,
+            DEBUG=logging.DEBUG,
+        )
+    )
+
+
+def run(name, tickers, tmp_dir, trace=None):
+    if trace is not None:
+        tracing.enable(os.path.join(tmp_dir, trace))
+    try:
+        start = time.perf_counter()
+        fun.stock_xlsx(
+            os.path.join(tmp_dir, "%s.xlsx" % name),
+            tickers,
+            "SF0",
+            "MRY",
+            PERIODS,
+            bulk_threshold=None,
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        tracing.disable()
+    print("%-22s %10.3f ms per ticker" % (name, elapsed / len(tickers) * 1000))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else TICKERS
+    os.environ.setdefault("QUANDL_API_SF0_KEY", "benchmark")
+    fun.quandl.get_table = get_table
+    # INFO level, the messages being formatted but discarded
+    package_logger = logging.getLogger("quandl_fund_xlsx")
+    package_logger.addHandler(logging.StreamHandler(open(os.devnull, "w")))
+    package_logger.propagate = False
+    package_logger.setLevel(logging.INFO)
+    tickers = ["T%04d" % i for i in range(count)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        micro(tmp_dir)
+        print("%d tickers" % (count))
+        # The first run warms up the imports and caches
+        run("warm up", tickers[:10], tmp_dir)
+        run("tracing disabled", tickers, tmp_dir)
+        run("tracing enabled", tickers, tmp_dir, trace="build.jsonl")
@@ -0,0 +1,131 @@
+"""Historical statistics of each indicator, quantifying its stability.
+
+For credit analysis the history of a ratio such as debt_cfo_ratio matters as
+much as its latest value. The statistics of each indicator over its periods
+are calculated with numpy over a whole block at once, a 2-d array with a row
+per indicator and a column per period, oldest first:
+
+    mean, std, min, max  over every period
+    zscore               the latest value against the earlier periods
+    slope                the least squares trend, per period
+
+Missing values are ignored. Panel mode calculates the same statistics for
+every ticker of a universe.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import collections
+import logging
+import warnings
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# The statistics and the column headers they are written under
+STATISTICS = [
+    ("mean", "Mean"),
+    ("std", "Std Dev"),
+    ("min", "Min"),
+    ("max", "Max"),
+    ("zscore", "Z-score"),
+    ("slope", "Trend"),
+]
+
+
+def as_float_array(values):
+    """Converts a block of values, which may hold None and inf, to a float
+    array with NaN for the missing values and inf.
+    """
+    frame = pd.DataFrame(values)
+    try:
+        array = frame.to_numpy(dtype=np.float64, na_value=np.nan)
+    except (TypeError, ValueError):
+        array = frame.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+    array[np.isinf(array)] = np.nan
+    return array
+
+
+def row_statistics(values):
+    """Calculates the statistics of each row of a 2-d array.
+
+    Args:
+        values: A float array with a row per indicator and a column per
+            period, oldest first. NaN for missing values.
+    Returns:
+        An ordered dict of statistic name to a float array with one value per
+        row, NaN where there are too few values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=1)
+
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        # All NaN rows warn, their statistics are NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        stats = collections.OrderedDict()
+        stats["mean"] = np.nanmean(values, axis=1)
+        stats["std"] = np.nanstd(values, axis=1, ddof=1)
+        stats["min"] = np.nanmin(values, axis=1)
+        stats["max"] = np.nanmax(values, axis=1)
+
+        history = values[:, :-1]
+        latest = values[:, -1] if values.shape[1] else np.full(len(values), np.nan)
+        history_std = np.nanstd(history, axis=1, ddof=1)
+        history_std[history_std == 0] = np.nan
+        stats["zscore"] = (latest - np.nanmean(history, axis=1)) / history_std
+
+        # Least squares slope against the period number, using only the
+        # periods with a value
+        x = np.where(valid, np.arange(values.shape[1], dtype=np.float64), np.nan)
+        x_dev = x - np.nanmean(x, axis=1)[:, np.newaxis]
+        y_dev = values - stats["mean"][:, np.newaxis]
+        sxy = np.nansum(x_dev * y_dev, axis=1)
+        sxx = np.nansum(x_dev * x_dev, axis=1)
+        stats["slope"] = np.where(count > 1, sxy / sxx, np.nan)
+    return stats
+
+
+def block_statistics(block_df, num_text_cols=2):
+    """Calculates the statistics of each row of a transposed statement block.
+
+    Args:
+        block_df: A block as written by Excel.write_df, num_text_cols of
+            descriptions followed by a column per period, oldest first.
+        num_text_cols: The number of text columns.
+    Returns:
+        A dataframe with the index of block_df and a column per statistic.
+    """
+    values = as_float_array(block_df.iloc[:, num_text_cols:])
+    return pd.DataFrame(row_statistics(values), index=block_df.index)
+
+
+def grouped_statistics(values, group_starts, length):
+    """Calculates the statistics of one indicator for every ticker of a panel.
+
+    The rows of each ticker are laid out as a row of a 2-d array, padded with
+    NaN at the start, so that the statistics are calculated for every ticker
+    at once by row_statistics.
+
+    Args:
+        values: A float array holding the indicator for every row.
+        group_starts: The first row of each ticker.
+        length: The total number of rows.
+    Returns:
+        As row_statistics, with a value per ticker.
+    """
+    starts = np.asarray(group_starts, dtype=np.int64)
+    counts = np.diff(np.append(starts, length))
+    width = int(counts.max()) if len(counts) else 0
+    grid = np.full((len(starts), width), np.nan)
+    rows = np.repeat(np.arange(len(starts)), counts)
+    # Right aligned, so that the latest value of every ticker is in the last
+    # column
+    columns = np.arange(length) - np.repeat(starts, counts) + np.repeat(
+        width - counts, counts
+    )
+    grid[rows, columns] = values
+    return row_statistics(grid)
@@ -0,0 +1,278 @@
+"""Point in time lookups of a panel, for backtests.
+
+A backtest needs the fundamentals as they were known on each of its dates,
+not as get_indicators returns them today. The AsOfIndex answers "what was
+the latest filing of every ticker, as known on date D" over a panel, see
+panel.py, for a whole universe in one vectorized operation:
+
+    Within each ticker the rows are sorted by the date they became known,
+    their datekey, then by lastupdated. Encoding the ticker in the high
+    bits of each key, a single searchsorted over every ticker's key for D
+    finds how many of each ticker's rows were known on D.
+
+    A row may restate a period filed before, e.g. an amended filing has a
+    later datekey but the same calendardate. The row to use is then the one
+    for the latest calendardate amongst the known rows, and of the versions
+    of that period the last to become known. These are precomputed for
+    every prefix of the known rows, with a running maximum, so a lookup is
+    just an index into them. So is the latest version of the period before
+    it, which the ratios using pct_change compare it with.
+
+With strict, a row only becomes known once it was last updated, so values
+Sharadar updated after D, e.g. the restated values of a most recent (MR)
+dimension, are left out rather than looked ahead at.
+
+The ratios are those calculated over the panel's rows, except those using
+pct_change. They compare the row looked up with the latest version, as known
+on the date, of the ticker's period before it, rather than with the panel's
+row before it, which may be another version of the same period.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from .fundamentals import SharadarFundamentals
+from .kernels import inline_expression
+from .ratios import with_dependencies
+
+logger = logging.getLogger(__name__)
+
+# The days of a date are offset to be positive in the low 32 bits of a key,
+# with the ticker's index in the high bits
+_DAY_OFFSET = 1 << 31
+# Rows with a missing known date are never known
+_NEVER = (1 << 31) - 1
+
+
+def _days(dates):
+    """Returns dates as int64 days since the epoch, NaT as _NEVER."""
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    days = dates.astype(np.int64)
+    days[np.isnat(dates)] = _NEVER
+    return days
+
+
+def period_versions(codes, known, updated, calendardates):
+    """Finds the versions of each ticker's periods known as its rows became
+    known.
+
+    Args:
+        codes: The ticker of each row, as an int, the rows of each ticker
+            being contiguous.
+        known: The int64 day each row became known.
+        updated: The int64 day each row was last updated, ordering the rows
+            which became known on the same day.
+        calendardates: The int64 day of each row's period.
+    Returns:
+        A tuple of int64 arrays:
+        order: The rows of each ticker in the order they became known.
+        latest: For each prefix of a ticker's rows in that order, the row
+            of the latest version of its latest period.
+        previous: For each prefix likewise, the row of the latest version of
+            the period before that, -1 if there is none.
+        row_previous: For each row, the row of the latest version, as known
+            when it became known, of the period before its own, -1 if there
+            is none.
+    """
+    order = np.lexsort((updated, known, codes))
+    codes = codes[order]
+    calendardates = calendardates[order]
+    # The first position of each row's ticker
+    first = np.searchsorted(codes, codes, side="left")
+
+    # Ranking the rows by ticker, calendardate and when they became known,
+    # the running maximum of the ranks gives, for each prefix of a ticker's
+    # known rows, its latest version of its latest period. The ticker being
+    # the first key, the maximum never runs on from one ticker to the next.
+    position = np.arange(len(order))
+    by_period = np.lexsort((position, calendardates, codes))
+    ranks = np.empty_like(position)
+    ranks[by_period] = position
+    latest = np.maximum.accumulate(ranks)
+
+    # The period before the latest is the latest before a row opens a later
+    # period, and is unchanged by a row restating the latest. A row restating
+    # an older period may be the latest version of the one before the latest.
+    # A running maximum of these gives the previous period for each prefix,
+    # being from another ticker when it is before the ticker's first rank.
+    before = np.full_like(latest, -1)
+    before[1:] = latest[:-1]
+    restates = (before >= first) & (
+        calendardates == calendardates[by_period[np.maximum(before, 0)]]
+    )
+    opens = (ranks == latest) & ~restates
+    prior = np.where(opens, before, np.where(restates, -1, ranks))
+    prior = np.maximum.accumulate(prior) if len(prior) else prior
+    previous = np.where(prior >= first, order[by_period[np.maximum(prior, 0)]], -1)
+
+    row_previous = np.empty_like(previous)
+    row_previous[order] = previous
+    # A restatement of an older period is compared with the latest version
+    # of the period before its own, of the rows known by then. These are
+    # rare, so are looked up one at a time.
+    period_start = np.zeros_like(position)
+    if len(position):
+        starts = np.ones(len(position), dtype=bool)
+        starts[1:] = (np.diff(calendardates[by_period]) != 0) | (
+            np.diff(codes[by_period]) != 0
+        )
+        period_start = np.maximum.accumulate(np.where(starts, position, 0))
+    for j in np.flatnonzero(ranks != latest).tolist():
+        known_ranks = ranks[first[j] : j + 1]
+        earlier = known_ranks[known_ranks < period_start[ranks[j]]]
+        row_previous[order[j]] = order[by_period[earlier.max()]] if len(earlier) else -1
+
+    return order, order[by_period[latest]], previous, row_previous
+
+
+def _known_days(panel, strict=False):
+    """Returns the days each of a panel's rows became known and was last
+    updated.
+    """
+    known = _days(panel.dates("datekey"))
+    if "lastupdated" in panel.date_columns:
+        updated = _days(panel.dates("lastupdated"))
+        updated = np.where(updated == _NEVER, known, updated)
+    else:
+        updated = known
+    if strict:
+        known = np.maximum(known, updated)
+    return known, updated
+
+
+def previous_periods(panel):
+    """Returns the row_previous of period_versions for a panel's rows."""
+    codes = panel.ticker_codes().astype(np.int64)
+    known, updated = _known_days(panel)
+    calendardates = _days(panel.dates("calendardate"))
+    return period_versions(codes, known, updated, calendardates)[3]
+
+
+class AsOfIndex(object):
+    """Point in time lookups of a panel's rows.
+
+    Args:
+        panel: A Panel.
+        calc_ratios: Ratios previously returned by panel.calc_ratios. The
+            ratios looked up are calculated as needed when not given.
+        strict: A row only becomes known on its lastupdated date, when that
+            is later than its datekey.
+    """
+
+    def __init__(self, panel, calc_ratios=None, strict=False):
+        self.panel = panel
+        self.strict = strict
+        self._calc_ratios = dict(calc_ratios or {})
+
+        codes = panel.ticker_codes().astype(np.int64)
+        known, updated = _known_days(panel, strict)
+        calendardates = _days(panel.dates("calendardate"))
+
+        # The rows of each ticker, still contiguous, in the order they became
+        # known
+        order, self._latest_rows, self._previous_rows, _ = period_versions(
+            codes, known, updated, calendardates
+        )
+        self._keys = (codes[order] << 32) + known[order] + _DAY_OFFSET
+        self._starts = np.asarray(panel.group_starts, dtype=np.int64)
+
+    def rows(self, dates):
+        """Returns the panel row of each ticker's latest filing on each date.
+
+        Args:
+            dates: A date or a sequence of dates.
+        Returns:
+            An int64 array, of shape (len(dates), len(tickers)) for a
+            sequence, (len(tickers),) for a single date. -1 where a ticker
+            had no known filing on the date.
+        """
+        single = np.ndim(dates) == 0
+        rows, _ = self._lookup(dates)
+        return rows[0] if single else rows
+
+    def _lookup(self, dates):
+        """Returns the rows of the latest filings on dates, as rows does for
+        a sequence, and the rows of the latest versions of the periods before
+        them, -1 where there are none.
+        """
+        days = _days(pd.to_datetime(np.atleast_1d(dates)).to_numpy())
+        codes = np.arange(len(self._starts), dtype=np.int64)
+        queries = (codes[None, :] << 32) + days[:, None] + _DAY_OFFSET
+        ends = np.searchsorted(self._keys, queries, side="right")
+        known = ends > self._starts[None, :]
+        last = np.maximum(ends - 1, 0)
+        rows = np.where(known, self._latest_rows[last], -1)
+        previous = np.where(known, self._previous_rows[last], -1)
+        return rows, previous
+
+    def asof(self, date, indicators=None):
+        """Returns each ticker's latest filing as known on a date.
+
+        Args:
+            date: The date.
+            indicators: Indicator codes and ratio names, defaulting to those
+                on the summary sheet.
+        Returns:
+            A dataframe indexed by ticker with the datekey, calendardate and
+            lastupdated of the filing and a column per indicator. Tickers
+            without a known filing are omitted.
+        """
+        rows, previous = self._lookup(date)
+        rows, previous = rows[0], previous[0]
+        known = rows >= 0
+        index = pd.Index(np.asarray(self.panel.tickers)[known], name="ticker")
+        return self._frame(rows[known], previous[known], index, indicators)
+
+    def asof_dates(self, dates, indicators=None):
+        """As asof for many dates at once.
+
+        Returns:
+            A dataframe indexed by date and ticker.
+        """
+        dates = pd.to_datetime(np.atleast_1d(dates))
+        rows, previous = self._lookup(dates)
+        known = rows >= 0
+        date_index, ticker_index = np.nonzero(known)
+        index = pd.MultiIndex.from_arrays(
+            [dates[date_index], np.asarray(self.panel.tickers)[ticker_index]],
+            names=["date", "ticker"],
+        )
+        return self._frame(rows[known], previous[known], index, indicators)
+
+    def _frame(self, rows, previous, index, indicators):
+        if indicators is None:
+            indicators = [ind for ind, _ in SharadarFundamentals.SUMMARIZE_IND]
+        panel = self.panel
+        ratios = [i for i in indicators if i not in panel]
+        # Those using pct_change depend on the versions known on the date
+        changing = [r for r in ratios if inline_expression(r) is None]
+        changes = {}
+        if changing:
+            changes = panel.calc_ratios(
+                with_dependencies(changing), rows=rows, previous=previous
+            )
+        needed = [
+            r for r in ratios if r not in changes and r not in self._calc_ratios
+        ]
+        if needed:
+            self._calc_ratios.update(panel.calc_ratios(with_dependencies(needed)))
+
+        data = {}
+        for name in ("datekey", "calendardate", "lastupdated"):
+            if name in panel.date_columns:
+                data[name] = panel.dates(name)[rows]
+        for indicator in indicators:
+            if indicator in panel:
+                data[indicator] = panel.values(indicator)[rows]
+            elif indicator in changes:
+                data[indicator] = changes[indicator]
+            elif indicator in self._calc_ratios:
+                data[indicator] = self._calc_ratios[indicator][rows]
+            else:
+                raise KeyError("Couln't find indicator %s" % (indicator))
+        return pd.DataFrame(data, index=index)
@@ -0,0 +1,138 @@
+"""An in-memory cache of the indicators fetched from Quandl.
+
+Shared by concurrent workbook builds, e.g. in the serve mode, so that a
+ticker requested by several of them is only fetched and calculated once.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import collections
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def _sizeof(value):
+    if isinstance(value, tuple):
+        return sum(_sizeof(v) for v in value)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    return sys.getsizeof(value)
+
+
+class IndicatorCache(object):
+    """A least recently used cache, coalescing concurrent loads of a key.
+
+    When a key is requested while another thread is already loading it, the
+    second thread waits for and shares the first thread's result rather than
+    loading the key again. Failed loads are not cached.
+
+    Once the cached values take more than max_bytes the least recently used
+    ones are evicted. Dataframes are sized with memory_usage(deep=True).
+    With a ttl a value is loaded again once it was cached more than ttl
+    seconds ago, e.g. so that a long running service picks up new filings.
+    """
+
+    def __init__(self, max_bytes=None, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._values = collections.OrderedDict()
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._values)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._values and not self._expired(key)
+
+    def get(self, key, loader):
+        """Returns the value cached for key, calling loader() on a miss.
+
+        Args:
+            key: A hashable key e.g. (ticker, dimension, periods, database).
+            loader: A callable returning the value for key. Any exception it
+                raises is raised to every thread waiting on the key.
+        """
+        with self._lock:
+            if key in self._values and self._expired(key):
+                self.nbytes -= self._values.pop(key)[1]
+                self.expirations += 1
+            if key in self._values:
+                self.hits += 1
+                self._values.move_to_end(key)
+                return self._values[key][0]
+            future = self._in_flight.get(key)
+            loading = future is None
+            if loading:
+                self.misses += 1
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.coalesced += 1
+
+        if not loading:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as exc:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(exc)
+            raise
+
+        size = _sizeof(value)
+        with self._lock:
+            del self._in_flight[key]
+            self._values[key] = (value, size, time.monotonic())
+            self.nbytes += size
+            self._evict()
+        future.set_result(value)
+        return value
+
+    def put(self, key, value):
+        """Caches value for key, e.g. when prefilling from a bulk export."""
+        size = _sizeof(value)
+        with self._lock:
+            old = self._values.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._values[key] = (value, size, time.monotonic())
+            self.nbytes += size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.nbytes = 0
+
+    def _expired(self, key):
+        if self.ttl is None:
+            return False
+        return time.monotonic() - self._values[key][2] > self.ttl
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        # Always keep the newest value, even when it alone is over the limit.
+        while self.nbytes > self.max_bytes and len(self._values) > 1:
+            key, (value, size, _) = self._values.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+            logger.debug("IndicatorCache: evicted %s", key)
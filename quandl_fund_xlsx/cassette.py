@@ -0,0 +1,299 @@
+"""Recording and replaying the Quandl tables API, for offline benchmarks.
+
+Runs against the live API are slow, throttled and never quite the same
+twice. A Recorder captures every request made through quandl's Connection,
+including each page of a paginated get_table with its cursor, along with the
+raw response, to a gzip compressed cassette of JSON lines. The API key is
+not recorded.
+
+A ReplayServer serves a cassette from a local HTTP stand-in for the API,
+with quandl's api_base pointed at it, so that a build runs unchanged on a
+disconnected machine. Each response can be delayed by a fixed latency, plus
+a seeded random jitter, and requests can be throttled to a rate, beyond
+which the stand-in answers 429 as the API does. The fetch concurrency,
+batching and quandl's retries can then be benchmarked reproducibly.
+
+Requests are matched on their method, path, query and body. When the same
+request was recorded more than once, e.g. the polling of a bulk export, the
+responses are replayed in order, the last one repeating. The export zip
+files themselves are downloaded from their link rather than through the
+API and are not recorded.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import base64
+import collections
+import gzip
+import json
+import logging
+import random
+import socketserver
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import quandl
+import requests
+from quandl.connection import Connection
+from quandl.errors.quandl_error import QuandlError
+
+logger = logging.getLogger(__name__)
+
+# The error codes of the API's responses, see quandl.connection
+THROTTLED_ERROR = {
+    "quandl_error": {"code": "QELx01", "message": "Replay rate limit exceeded."}
+}
+MISSING_ERROR = {
+    "quandl_error": {"code": "QECx02", "message": "The request is not in the cassette."}
+}
+
+
+def request_key(method, path, query, body):
+    """Returns the key matching a request to its recorded response.
+
+    Args:
+        method: The HTTP method.
+        path: The path of the URL, relative to the api_base.
+        query: The query string of the URL.
+        body: The request body, as bytes, or None.
+    """
+    pairs = sorted(urllib.parse.parse_qsl(query, keep_blank_values=True))
+    if body:
+        pairs.append(("", json.dumps(json.loads(body), sort_keys=True)))
+    return json.dumps([method.upper(), path, pairs])
+
+
+def _relative_path(url):
+    path = urllib.parse.urlsplit(url).path
+    base = urllib.parse.urlsplit(quandl.ApiConfig.api_base).path.rstrip("/")
+    if base and path.startswith(base + "/"):
+        path = path[len(base) :]
+    return path
+
+
+class Recorder(object):
+    """Records the requests made through quandl's Connection to a cassette.
+
+    Used as a context manager around a build, e.g.::
+
+        with Recorder("sf1.cassette.gz"):
+            stock_xlsx(...)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.interactions = 0
+        self._file = None
+        self._lock = threading.Lock()
+        self._execute_request = None
+
+    def __enter__(self):
+        self._file = gzip.open(self.path, "wt", encoding="utf-8")
+        self._execute_request = Connection.__dict__["execute_request"]
+        execute_request = Connection.execute_request
+        recorder = self
+
+        def recording_execute_request(cls, http_verb, url, **options):
+            try:
+                response = execute_request(http_verb, url, **options)
+            except QuandlError as e:
+                recorder.record(
+                    http_verb, url, options, e.http_status, e.http_headers, e.http_body
+                )
+                raise
+            recorder.record(
+                http_verb,
+                url,
+                options,
+                response.status_code,
+                response.headers,
+                response.content,
+            )
+            return response
+
+        Connection.execute_request = classmethod(recording_execute_request)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        Connection.execute_request = self._execute_request
+        self._file.close()
+        logger.info("Recorded %d requests to %s", self.interactions, self.path)
+
+    def record(self, http_verb, url, options, status, headers, body):
+        """Appends a request and its response to the cassette."""
+        # Prepared as the requests session prepares it, giving the same query
+        prepared = requests.Request(
+            http_verb.upper(),
+            url,
+            params=options.get("params"),
+            json=options.get("json"),
+            data=options.get("data"),
+        ).prepare()
+        request_body = prepared.body
+        if isinstance(request_body, str):
+            request_body = request_body.encode()
+        if isinstance(body, str):
+            body = body.encode()
+        entry = {
+            "key": request_key(
+                prepared.method,
+                _relative_path(prepared.url),
+                urllib.parse.urlsplit(prepared.url).query,
+                request_body,
+            ),
+            "status": status,
+            "content_type": (headers or {}).get("Content-Type", "application/json"),
+            "body": base64.b64encode(body or b"").decode("ascii"),
+        }
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self.interactions += 1
+
+
+def load_cassette(path):
+    """Returns a dict of request key to the list of its recorded responses."""
+    responses = collections.defaultdict(list)
+    with gzip.open(path, "rt", encoding="utf-8") as c_file:
+        for line in c_file:
+            entry = json.loads(line)
+            responses[entry["key"]].append(entry)
+    return responses
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """http.server.ThreadingHTTPServer, which needs Python 3.7."""
+
+    daemon_threads = True
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.replay.handle(self)
+
+    do_POST = do_GET
+
+
+class ReplayServer(object):
+    """Serves a cassette from a local stand-in for the Quandl API.
+
+    Used as a context manager, pointing quandl's api_base at the stand-in
+    while in the context.
+
+    Args:
+        path: The cassette.
+        latency: The seconds each response is delayed by.
+        jitter: The most seconds added at random to the latency.
+        rate: The requests per second answered, None for no limit. Requests
+            beyond the rate are answered with a 429.
+        burst: The requests which may be answered at once within the rate.
+        seed: The seed of the jitter.
+    """
+
+    def __init__(self, path, latency=0.0, jitter=0.0, rate=None, burst=1, seed=0):
+        self.responses = load_cassette(path)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.burst = burst
+        self.url = None
+        self.requests = 0
+        self.throttled = 0
+        self.missing = 0
+        self._random = random.Random(seed)
+        self._served = collections.Counter()
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+        self._server = None
+        self._api_config = None
+
+    def __enter__(self):
+        self.start()
+        config = quandl.ApiConfig
+        self._api_config = (config.api_base, config.api_protocol)
+        # quandl only mounts its retrying adapter for the api_protocol
+        config.api_base, config.api_protocol = self.url, "http://"
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        quandl.ApiConfig.api_base, quandl.ApiConfig.api_protocol = self._api_config
+        self.stop()
+
+    def start(self):
+        self._server = _ThreadingHTTPServer(("127.0.0.1", 0), _ReplayHandler)
+        self._server.replay = self
+        self.url = "http://127.0.0.1:%d" % self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        logger.info(
+            "Replayed %d requests, %d throttled and %d not in the cassette",
+            self.requests,
+            self.throttled,
+            self.missing,
+        )
+
+    def handle(self, handler):
+        """Answers one request."""
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else None
+        url = urllib.parse.urlsplit(handler.path)
+        key = request_key(handler.command, url.path, url.query, body)
+
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            allowed = self._take_token()
+            entry = None
+            if not allowed:
+                self.throttled += 1
+            elif key not in self.responses:
+                self.missing += 1
+            else:
+                recorded = self.responses[key]
+                entry = recorded[min(self._served[key], len(recorded) - 1)]
+                self._served[key] += 1
+
+        time.sleep(delay)
+        if not allowed:
+            self._reply(handler, 429, "application/json", json.dumps(THROTTLED_ERROR))
+        elif entry is None:
+            self._reply(handler, 404, "application/json", json.dumps(MISSING_ERROR))
+        else:
+            self._reply(
+                handler,
+                entry["status"],
+                entry["content_type"],
+                base64.b64decode(entry["body"]),
+            )
+
+    def _take_token(self):
+        if self.rate is None:
+            return True
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._refilled) * self.rate
+        )
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    @staticmethod
+    def _reply(handler, status, content_type, body):
+        if isinstance(body, str):
+            body = body.encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
@@ -0,0 +1,163 @@
+"""Per-ticker checkpointing of fetched and calculated results.
+
+The workbook is only written to disk once every ticker has been processed,
+so without checkpoints a failure near the end of a long ticker list loses
+all of the work done so far. The CheckpointStore saves each ticker's
+Sharadar indicators and calculated ratios as soon as they are available,
+allowing an interrupted run to be resumed where it left off.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import json
+import logging
+import os
+import pathlib
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore(object):
+    """A directory holding one checkpoint file per processed ticker.
+
+    A small manifest records the database, dimension, number of periods and
+    any profile of the run, so that a resume with different parameters does
+    not mix incompatible results into the same workbook.
+    """
+
+    MANIFEST = "run.json"
+    SUFFIX = ".pkl"
+
+    # Status values recorded for each ticker
+    DONE = "done"
+    NOT_FOUND = "not_found"
+
+    def __init__(self, directory, database, dimension, periods, profile=None):
+        self.path = pathlib.Path(directory)
+        self.params = {
+            "database": database,
+            "dimension": dimension,
+            "periods": int(periods),
+        }
+        if profile is not None and not profile.all_columns:
+            # The indicators saved are only those the profile needs
+            self.params["profile"] = repr(profile)
+
+    def open(self, resume=False):
+        """Prepare the store for a run.
+
+        Args:
+            resume: When True the existing checkpoints are kept and must have
+                been created with the same parameters. When False any existing
+                checkpoints are discarded.
+        Raises:
+            ValueError: When resuming from checkpoints made with different
+                parameters, or when the directory holds files but no
+                checkpoints.
+        """
+        manifest = self.path / self.MANIFEST
+        if resume and manifest.exists():
+            with open(manifest) as m_file:
+                saved = json.load(m_file)
+            if saved != self.params:
+                raise ValueError(
+                    "Checkpoints in %s were made with %s, not %s"
+                    % (self.path, saved, self.params)
+                )
+            logger.info(
+                "Resuming with %d completed tickers from %s",
+                len(self.completed()),
+                self.path,
+            )
+            return
+
+        if manifest.exists():
+            self._remove_files()
+        elif self.path.exists() and any(self.path.iterdir()):
+            # Not a directory the store made, so not the store's to clear
+            raise ValueError(
+                "%s is not empty and doesn't hold checkpoints" % (self.path)
+            )
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._atomic_write(manifest, json.dumps(self.params).encode())
+
+    def completed(self):
+        """Returns the set of tickers which have a checkpoint."""
+        return {
+            p.name[: -len(self.SUFFIX)]
+            for p in self.path.glob("*" + self.SUFFIX)
+        }
+
+    def is_complete(self, ticker):
+        return self._ticker_path(ticker).exists()
+
+    def save(self, ticker, fund):
+        """Checkpoint the indicators, calculated ratios and issues of fund."""
+        entry = {
+            "status": self.DONE,
+            "sf1": fund.all_inds_df,
+            "ratios": fund.calc_ratios_df,
+            "issues": fund.issues_df,
+        }
+        self._save_entry(ticker, entry)
+
+    def save_not_found(self, ticker):
+        """Record that the ticker is not supported so it is not refetched."""
+        self._save_entry(ticker, {"status": self.NOT_FOUND})
+
+    def load(self, ticker):
+        """Load a checkpointed ticker.
+
+        Returns:
+            A tuple of the Sharadar indicators dataframe, the calculated
+            ratios dataframe and the issues dataframe, or None when the ticker
+            was not found. The issues are None for a checkpoint made before
+            they were saved.
+        """
+        entry = pd.read_pickle(self._ticker_path(ticker))
+        if entry["status"] == self.NOT_FOUND:
+            return None
+        return entry["sf1"], entry["ratios"], entry.get("issues")
+
+    def remove(self):
+        """Delete the store, typically once the workbook has been saved.
+
+        Only the files written by the store are deleted, and the directory
+        if that leaves it empty.
+        """
+        if not (self.path / self.MANIFEST).exists():
+            return
+        self._remove_files()
+        try:
+            self.path.rmdir()
+        except OSError:
+            logger.info("Leaving the other files in %s", self.path)
+
+    def _remove_files(self):
+        for pattern in ("*" + self.SUFFIX, "*" + self.SUFFIX + ".tmp"):
+            for path in self.path.glob(pattern):
+                path.unlink()
+        for name in (self.MANIFEST, self.MANIFEST + ".tmp"):
+            path = self.path / name
+            if path.exists():
+                path.unlink()
+
+    def _save_entry(self, ticker, entry):
+        path = self._ticker_path(ticker)
+        tmp_path = path.with_name(path.name + ".tmp")
+        pd.to_pickle(entry, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _atomic_write(self, path, data):
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as t_file:
+            t_file.write(data)
+        os.replace(tmp_path, path)
+
+    def _ticker_path(self, ticker):
+        # Tickers such as BRK.B are fine as file names, path separators are not.
+        safe = ticker.replace(os.sep, "_")
+        return self.path / (safe + self.SUFFIX)
@@ -5,6 +5,31 @@ Usage:
   quandl_fund_xlsx (-i <ticker-file> | -t <ticker>) [-o <output-file>]
                                  [-y <years>] [-d <sharadar-db>]
                                  [--dimension <dimension>]
+                                 [--checkpoint-dir <dir>] [--resume]
+                                 [-w <workers>] [--bulk-threshold <n>]
+                                 [--db <db-file>] [--screen <expr>]
+                                 [--prices <price-file> | --daily]
+                                 [--peer-group <level>] [--tickers-cache <file>]
+                                 [--build-cache <dir>] [--issues <csv-file>]
+                                 [--record <cassette> | --replay <cassette>]
+                                 [--replay-latency <ms>] [--replay-rate <rps>]
+                                 [--profile-set <name>] [--profiles <json-file>]
+                                 [--dead-letters <file>] [--fail-fast]
+                                 [--log-level <level>] [--trace <jsonl-file>]
+  quandl_fund_xlsx serve [-d <sharadar-db>] [--host <host>] [--port <port>]
+                         [-w <workers>] [--cache-mb <mb>] [--cache-ttl <s>]
+  quandl_fund_xlsx query --db <db-file> <sql>
+  quandl_fund_xlsx manifest <manifest-file> [-d <sharadar-db>] [-y <years>]
+                            [--dimension <dimension>] [-w <workers>]
+                            [--render-workers <n>] [--bulk-threshold <n>]
+                            [--dead-letters <file>] [--fail-fast]
+  quandl_fund_xlsx plan <shared-dir> <manifest-file> [-d <sharadar-db>]
+                        [-y <years>] [--dimension <dimension>]
+                        [--batch-size <n>]
+  quandl_fund_xlsx worker <shared-dir> [-w <workers>] [--bulk-threshold <n>]
+                          [--lease <seconds>]
+  quandl_fund_xlsx assemble <shared-dir> [--render-workers <n>]
+                            [--dead-letters <file>] [--fail-fast]
 
 
   quandl_fund_xlsx.py (-h | --help)
@@ -20,6 +45,85 @@ Options:
                               SF1 [default: SF0]
   --dimension <dimension>     Sharadar database dimension, ARY, MRY, ART, MRT, MRQ, ARQ
                               [default: MRY]
+  --checkpoint-dir <dir>      Directory for per ticker checkpoints, removed once
+                              the output is saved. Defaults to <output-file>.ckpt
+  --resume                    Resume an interrupted run, only fetching the
+                              tickers missing from the checkpoint directory
+  -w --workers <workers>      Number of tickers fetched from Quandl concurrently
+                              [default: 1]
+  --bulk-threshold <n>        Fetch the tickers with a single bulk export when
+                              there are at least this many [default: 200]
+  --db <db-file>              SQLite file to which the fetched indicators and
+                              calculated ratios are added, and which the query
+                              mode runs <sql> against
+  --screen <expr>             Only write sheets for the tickers whose latest
+                              values pass the screen, e.g.
+                              "net_debt_ebitda_ratio < 3 and operating_margin > 0.1".
+                              The summary sheet still lists every ticker
+  --prices <price-file>       CSV file of daily prices, with ticker, date and
+                              price (or close) columns, used to value each
+                              filing and the latest filing at the latest price
+  --daily                     As --prices but using SHARADAR/DAILY
+  --peer-group <level>        Rank the summarized indicators within each
+                              sector or industry, from SHARADAR/TICKERS
+  --tickers-cache <file>      Local cache of SHARADAR/TICKERS
+                              [default: ~/.cache/quandl_fund_xlsx/tickers.csv]
+  --build-cache <dir>         Keep each ticker's results in <dir>, only
+                              recalculating the tickers whose data has changed
+                              since the last build using the same <dir>
+  --issues <csv-file>         Also write the data quality issues found, which
+                              are on the Issues sheet, to a CSV file
+  --record <cassette>         Record the Quandl API responses to a cassette file
+  --replay <cassette>         Replay a recorded cassette rather than calling the
+                              Quandl API, e.g. to benchmark a build offline.
+                              With either the tickers are fetched one at a
+                              time, never with a bulk export
+  --replay-latency <ms>       Delay each replayed response by <ms> milliseconds
+                              [default: 0]
+  --replay-rate <rps>         Throttle the replay to <rps> requests per second,
+                              beyond which the requests are answered with a 429
+  --profile-set <name>        Only fetch, calculate and write the blocks and
+                              ratios of a profile: full, kjm, reit, credit or
+                              one from --profiles [default: full]
+  --profiles <json-file>      JSON file of further profiles, see profiles.py
+  --dead-letters <file>       Ticker file to which the tickers whose fetch,
+                              calculation or writing failed are written, with
+                              why, for retrying with -i, removed when none
+                              failed. Defaults to <output-file>.failed,
+                              <manifest-file>.failed or <shared-dir>.failed.
+                              The exit status is 1 when any failed
+  --fail-fast                 Stop at the first ticker which fails rather than
+                              leaving it out of the output
+  --log-level <level>         Level of the messages logged, e.g. DEBUG, INFO,
+                              WARNING [default: INFO]
+  --trace <jsonl-file>        Append a JSON line per ticker per stage of the
+                              build, with its duration, see tracing.py
+
+  --host <host>               Address the serve mode listens on [default: 127.0.0.1]
+  --port <port>               Port the serve mode listens on [default: 8080]
+  --cache-mb <mb>             Memory the serve mode may use to cache fetched
+                              indicators and ratios, in MB [default: 256]
+  --cache-ttl <s>             Seconds after which the serve mode fetches a
+                              cached ticker again [default: 3600]
+
+  <manifest-file>             CSV file with a row per workbook to write, with
+                              tickers (a ticker file), output and optionally
+                              dimension and years columns. Each ticker is
+                              fetched once however many workbooks it is in,
+                              existing workbooks are replaced
+  --render-workers <n>        Number of processes writing the manifest's
+                              workbooks, by default the number of CPUs
+
+  <shared-dir>                Directory, on a filesystem shared by the hosts,
+                              into which plan splits a manifest's tickers into
+                              batches. Any number of workers on any hosts then
+                              claim and fetch the batches, and assemble writes
+                              the workbooks once they are all done
+  --batch-size <n>            Tickers in each batch claimed by a worker
+                              [default: 50]
+  --lease <seconds>           How long a worker may go without saving a ticker
+                              before its batch is taken over by another worker
+                              [default: 300]
 
   --version             Show version.
 
@@ -27,27 +131,154 @@ Options:
 # the imports have to be under the docstring
 # otherwise the docopt module does not work.
 from docopt import docopt
-from .fundamentals import stock_xlsx
+from .cassette import Recorder, ReplayServer
+from .distributed import SharedStore, assemble, run_worker
+from .fundamentals import SharadarFundamentals, normalize_tickers, stock_xlsx
+from .incremental import BuildCache
+from .peers import load_ticker_metadata, peer_groups
+from .portfolios import read_manifest, run_manifest
+from .profiles import get_profile
+from .resilience import CircuitBreaker, DeadLetters
+from .prices import load_daily, read_prices
+from .server import serve
+from .sqlstore import SQLStore
+from . import tracing
+import contextlib
+import logging
+import os
+import pandas as pd
 import pathlib
 import sys
 
 
+def configure_logging(level):
+    """Logs the package's messages of level and above to stderr."""
+    logger = logging.getLogger(__package__)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        formatter = logging.Formatter("%(asctime)s %(levelname)-8s %(message)s")
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    logger.setLevel(level.upper())
+
+
+def get_dead_letters(arguments, default_file):
+    """Returns the DeadLetters of a build, None with --fail-fast, and the
+    file they are written to.
+    """
+    dead_letters = None
+    if not arguments["--fail-fast"]:
+        dead_letters = DeadLetters()
+    dead_letters_file = arguments["--dead-letters"]
+    if dead_letters_file is None:
+        dead_letters_file = default_file
+    return dead_letters, dead_letters_file
+
+
+def exit_if_failed(dead_letters, dead_letters_file):
+    """Exits with status 1 if any tickers failed."""
+    if dead_letters is not None and len(dead_letters) > 0:
+        sys.exit(
+            "{} tickers failed and were left out, see {}".format(
+                len(dead_letters), dead_letters_file
+            )
+        )
+
+
 def main(args=None):
     arguments = docopt(__doc__, version="version='0.4.1'")
     print(arguments)
+    configure_logging(arguments["--log-level"])
+
+    if arguments["serve"]:
+        serve(
+            arguments["--host"],
+            int(arguments["--port"]),
+            arguments["--database"],
+            workers=int(arguments["--workers"]),
+            cache_mb=int(arguments["--cache-mb"]),
+            cache_ttl=float(arguments["--cache-ttl"]),
+        )
+        return
+
+    if arguments["query"]:
+        with SQLStore(arguments["--db"]) as sql_store:
+            print(sql_store.query(arguments["<sql>"]).to_string())
+        return
+
+    if arguments["plan"]:
+        jobs = read_manifest(
+            arguments["<manifest-file>"],
+            arguments["--dimension"],
+            int(arguments["--years"]),
+        )
+        batches = SharedStore(arguments["<shared-dir>"]).plan(
+            jobs, arguments["--database"], int(arguments["--batch-size"])
+        )
+        print("Planned {} batches in {}".format(batches, arguments["<shared-dir>"]))
+        return
+
+    if arguments["worker"]:
+        run_worker(
+            arguments["<shared-dir>"],
+            workers=int(arguments["--workers"]),
+            bulk_threshold=int(arguments["--bulk-threshold"]),
+            lease_seconds=float(arguments["--lease"]),
+        )
+        return
+
+    if arguments["manifest"] or arguments["assemble"]:
+        render_workers = arguments["--render-workers"]
+        if render_workers is not None:
+            render_workers = int(render_workers)
+        if arguments["assemble"]:
+            shared_dir = os.path.normpath(arguments["<shared-dir>"])
+            dead_letters, dead_letters_file = get_dead_letters(
+                arguments, shared_dir + ".failed"
+            )
+        else:
+            dead_letters, dead_letters_file = get_dead_letters(
+                arguments, arguments["<manifest-file>"] + ".failed"
+            )
+        try:
+            if arguments["assemble"]:
+                written = assemble(shared_dir, render_workers, dead_letters)
+            else:
+                jobs = read_manifest(
+                    arguments["<manifest-file>"],
+                    arguments["--dimension"],
+                    int(arguments["--years"]),
+                )
+                written = run_manifest(
+                    jobs,
+                    arguments["--database"],
+                    workers=int(arguments["--workers"]),
+                    render_workers=render_workers,
+                    bulk_threshold=int(arguments["--bulk-threshold"]),
+                    dead_letters=dead_letters,
+                )
+        finally:
+            if dead_letters is not None:
+                dead_letters.write(dead_letters_file)
+        for outfile, stocks in written.items():
+            print("Wrote {} stocks to {}".format(stocks, outfile))
+        exit_if_failed(dead_letters, dead_letters_file)
+        return
 
     file = arguments["--input"]
 
     tickers = []
     if file is None:
-        ticker = arguments["--ticker"]
-        print("Ticker =", ticker)
-        tickers.append(ticker)
+        tickers.append(arguments["--ticker"])
     else:
         with open(file) as t_file:
             for line in t_file:  # Each line contains a ticker
-                tickers.append(line.strip())
-                print("Ticker =", line)
+                tickers.append(line)
+
+    # Drop blank lines and duplicated tickers, keeping the order of the file
+    tickers = normalize_tickers(tickers)
+    for ticker in tickers:
+        print("Ticker =", ticker)
 
     years = arguments["--years"]
     years = int(years)
@@ -55,6 +286,14 @@ def main(args=None):
     outfile = arguments["--output"]
     database = arguments["--database"]
     dimension = arguments["--dimension"]
+    checkpoint_dir = arguments["--checkpoint-dir"]
+    if checkpoint_dir is None:
+        checkpoint_dir = outfile + ".ckpt"
+    resume = arguments["--resume"]
+    workers = int(arguments["--workers"])
+    bulk_threshold = int(arguments["--bulk-threshold"])
+    profile = get_profile(arguments["--profile-set"], arguments["--profiles"])
+    dead_letters, dead_letters_file = get_dead_letters(arguments, outfile + ".failed")
 
     path = pathlib.Path(outfile)
     if path.exists():
@@ -64,9 +303,83 @@ def main(args=None):
             print("You replied {}, Exiting".format(response))
             sys.exit()
 
+    # Recording or replaying every request of the run, from here on
+    cassette = contextlib.ExitStack()
+    if arguments["--record"] is not None or arguments["--replay"] is not None:
+        # A bulk export's file is downloaded from S3, outside of the cassette
+        bulk_threshold = None
+    if arguments["--record"] is not None:
+        cassette.enter_context(Recorder(arguments["--record"]))
+    elif arguments["--replay"] is not None:
+        rate = arguments["--replay-rate"]
+        cassette.enter_context(
+            ReplayServer(
+                arguments["--replay"],
+                latency=float(arguments["--replay-latency"]) / 1000,
+                rate=None if rate is None else float(rate),
+            )
+        )
+
+    prices = None
+    if arguments["--prices"] is not None:
+        prices = read_prices(arguments["--prices"])
+    elif arguments["--daily"]:
+        # Sets the Quandl API key for the database
+        SharadarFundamentals(database)
+        start = pd.Timestamp.today() - pd.DateOffset(years=years + 1)
+        prices = load_daily(tickers, start.date())
+
+    groups = None
+    if arguments["--peer-group"] is not None:
+        # Sets the Quandl API key for the database
+        SharadarFundamentals(database)
+        metadata = load_ticker_metadata(tickers, arguments["--tickers-cache"])
+        groups = peer_groups(metadata, arguments["--peer-group"])
+
+    build_cache = None
+    if arguments["--build-cache"] is not None:
+        build_cache = BuildCache(
+            arguments["--build-cache"], database, dimension, years, profile
+        )
+
+    sql_store = None
+    if arguments["--db"] is not None:
+        sql_store = SQLStore(arguments["--db"])
+
     print("Output will be written to {}".format(outfile))
+    if arguments["--trace"] is not None:
+        tracing.enable(arguments["--trace"])
     #  stock_xlsx(outfile, tickers, database, dimension, years)
-    stock_xlsx(outfile, tickers, database, dimension, years)
+    try:
+        stock_xlsx(
+            outfile,
+            tickers,
+            database,
+            dimension,
+            years,
+            checkpoint_dir=checkpoint_dir,
+            resume=resume,
+            workers=workers,
+            bulk_threshold=bulk_threshold,
+            sql_store=sql_store,
+            screen=arguments["--screen"],
+            prices=prices,
+            peer_groups=groups,
+            build_cache=build_cache,
+            issues_file=arguments["--issues"],
+            profile=profile,
+            dead_letters=dead_letters,
+            breaker=CircuitBreaker(),
+        )
+    finally:
+        tracing.disable()
+        cassette.close()
+        if dead_letters is not None:
+            # Also removes the file of an earlier build when none failed
+            dead_letters.write(dead_letters_file)
+        if sql_store is not None:
+            sql_store.close()
+    exit_if_failed(dead_letters, dead_letters_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+"""A compact representation of SF1 indicators for universe-wide work.
+
+The frames returned by get_indicators hold every indicator as float64 and
+the ticker, dimension and dates as objects or datetime64[ns]. For a whole
+universe, or several dimensions of one, that is more memory than needed.
+In compact form:
+
+    value columns  float32, for those columns whose every value survives
+                   the conversion within a relative error of FLOAT32_RTOL.
+                   Object columns of numbers and None, such as the
+                   calculated ratios, are converted to floats first
+    ticker etc.    categoricals
+    dates          int32 days since 1970-01-01, NAT_DAYS for missing dates
+
+Ratios calculated from compact indicators agree with those calculated from
+the float64 indicators within a relative tolerance of RATIO_RTOL, except
+where a ratio's expression takes the difference of two nearly equal values,
+e.g. debt - cashnequsd when the two almost cancel out.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype
+
+logger = logging.getLogger(__name__)
+
+# float32 carries about 7 significant digits, a relative error of at most 6e-8
+# for values within its range. Larger errors come from values beyond its range
+# or too small to be held at full precision.
+FLOAT32_RTOL = 1e-6
+RATIO_RTOL = 1e-5
+
+DATE_COLUMNS = ("datekey", "calendardate", "reportperiod", "lastupdated")
+CATEGORY_COLUMNS = ("ticker", "dimension")
+
+# The inferred types of object columns holding numbers, with None as missing
+NUMBER_TYPES = ("floating", "integer", "mixed-integer-float")
+
+DAYS_DTYPE = np.dtype("<i4")
+NAT_DAYS = np.iinfo(np.int32).min
+
+
+def float32_error(values):
+    """Returns the largest relative error of converting values to float32.
+
+    Values which float32 cannot hold, i.e. beyond its range, give inf.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        converted = values.astype(np.float32).astype(np.float64)
+        error = np.abs(converted - values) / np.abs(values)
+    finite = np.isfinite(values)
+    error = np.where(finite & (values != 0), error, 0.0)
+    error[finite & ~np.isfinite(converted)] = np.inf
+    return float(error.max()) if len(error) else 0.0
+
+
+def fits_float32(values, rtol=FLOAT32_RTOL):
+    return float32_error(values) <= rtol
+
+
+def to_days(dates):
+    """Converts dates to int32 days since the epoch, NaT to NAT_DAYS."""
+    dates = pd.to_datetime(pd.Series(dates)).to_numpy(dtype="datetime64[D]")
+    days = dates.astype(np.int64)
+    days[np.isnat(dates)] = NAT_DAYS
+    return days.astype(DAYS_DTYPE)
+
+
+def from_days(days):
+    """Converts int32 days since the epoch back to datetime64[ns]."""
+    days = np.asarray(days, dtype=np.int64)
+    dates = days.astype("datetime64[D]").astype("datetime64[ns]")
+    dates[days == NAT_DAYS] = np.datetime64("NaT")
+    return dates
+
+
+def compact_frame(frame, rtol=FLOAT32_RTOL):
+    """Returns frame in compact form, logging the memory saved.
+
+    Float columns are only downcast when every value fits within rtol, the
+    others are left as float64.
+    """
+    compacted = {}
+    for name in frame.columns:
+        column = frame[name]
+        if column.dtype == object and infer_dtype(column) in NUMBER_TYPES:
+            column = pd.to_numeric(column)
+        if name in DATE_COLUMNS:
+            compacted[name] = to_days(column)
+        elif name in CATEGORY_COLUMNS:
+            compacted[name] = column.astype("category")
+        elif pd.api.types.is_float_dtype(column) and fits_float32(column, rtol):
+            compacted[name] = column.astype(np.float32)
+        else:
+            compacted[name] = column
+    compact = pd.DataFrame(compacted, index=frame.index)
+
+    before = memory_usage(frame)
+    after = memory_usage(compact)
+    logger.info(
+        "Compacted %d rows from %.1f MB to %.1f MB, saving %.0f%%",
+        len(frame),
+        before / 2 ** 20,
+        after / 2 ** 20,
+        100.0 * (before - after) / before if before else 0.0,
+    )
+    return compact
+
+
+def expand_frame(compact):
+    """Converts a compact frame back to the dtypes of get_indicators."""
+    expanded = {}
+    for name in compact.columns:
+        column = compact[name]
+        if name in DATE_COLUMNS:
+            expanded[name] = from_days(column)
+        elif isinstance(column.dtype, pd.CategoricalDtype):
+            expanded[name] = column.astype(object)
+        elif column.dtype == np.float32:
+            expanded[name] = column.astype(np.float64)
+        else:
+            expanded[name] = column
+    return pd.DataFrame(expanded, index=compact.index)
+
+
+def memory_usage(frame):
+    """The bytes used by a frame, including the strings of object columns."""
+    return int(frame.memory_usage(deep=True, index=False).sum())
@@ -0,0 +1,195 @@
+"""A dense indicator x ticker x period cube of a panel, for factor models.
+
+The sheets hold a transposed block per ticker, and a panel a row per
+ticker and filing. Factor models want instead a matrix per indicator, with
+a row per ticker and a column per period, every matrix sharing the same
+axes. build_cube pivots a panel once into that shape, on disk:
+
+    axes.json    the indicators, tickers and dimension
+    periods.npy  the period end dates, the sorted calendardates of the
+                 panel, as datetime64[ns]
+    values.npy   float64 of shape (indicators, tickers, periods), nan where
+                 a ticker has no filing for a period
+
+values.npy is in C order, so each indicator's matrix is contiguous and
+slicing one ratio across the whole universe is a single sequential read of
+the memory-mapped file. When a ticker has several rows for a period, e.g. a
+restatement, the last by datekey is used. The ratios using pct_change
+compare each period with the ticker's period before it in the cube, rather
+than with the panel's row before it, which may be another version of the
+same period.
+
+Cube.save_npz writes the matrices to a single, optionally compressed, NPZ
+file for handing on.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import json
+import logging
+import os
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from .kernels import inline_expression
+from .ratios import RATIO_EXPRESSIONS, with_dependencies
+
+logger = logging.getLogger(__name__)
+
+AXES = "axes.json"
+PERIODS = "periods.npy"
+VALUES = "values.npy"
+
+
+def cube_cells(panel):
+    """Returns the periods of a panel and the cell of each of its rows.
+
+    Returns:
+        The sorted period end dates, and for each row its flat index into a
+        (tickers, periods) matrix, or -1 for a row superseded by a later row
+        of the same ticker and period.
+    """
+    calendardates = panel.dates("calendardate")
+    periods = np.unique(calendardates[~np.isnat(calendardates)])
+    codes = panel.ticker_codes()
+    cells = codes * len(periods) + np.searchsorted(periods, calendardates)
+    cells[np.isnat(calendardates)] = -1
+
+    # The rows of a ticker are sorted by datekey, so of the rows sharing a
+    # cell the last in the panel is kept
+    order = np.lexsort((np.arange(len(cells)), cells))
+    superseded = np.zeros(len(cells), dtype=bool)
+    superseded[order[:-1]] = cells[order[:-1]] == cells[order[1:]]
+    cells[superseded] = -1
+    return periods, cells
+
+
+def build_cube(path, panel, indicators=None, calc_ratios=None):
+    """Pivots a panel into a cube.
+
+    Args:
+        path: The cube's directory.
+        panel: A Panel.
+        indicators: Indicator codes and ratio names, by default every
+            indicator of the panel followed by every ratio.
+        calc_ratios: Ratios previously returned by panel.calc_ratios. The
+            ratios needed are calculated when not given. Those using
+            pct_change are always calculated, over the cube's periods.
+    Returns:
+        The opened Cube.
+    """
+    if indicators is None:
+        indicators = list(panel.columns) + list(RATIO_EXPRESSIONS)
+    needed = [i for i in indicators if i not in panel]
+    changing = [i for i in needed if inline_expression(i) is None]
+    needed = [i for i in needed if i not in changing]
+    if needed and calc_ratios is None:
+        calc_ratios = panel.calc_ratios(with_dependencies(needed))
+
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    periods, cells = cube_cells(panel)
+    kept = cells >= 0
+    shape = (len(indicators), len(panel.tickers), len(periods))
+
+    changes = {}
+    if changing:
+        # The kept rows in the order of their cells, each following the
+        # ticker's row of the period before
+        rows = np.flatnonzero(kept)
+        rows = rows[np.argsort(cells[rows], kind="stable")]
+        codes = panel.ticker_codes()[rows]
+        previous = np.full(len(rows), -1, dtype=np.int64)
+        follows = codes[1:] == codes[:-1]
+        previous[1:][follows] = rows[:-1][follows]
+        changes = panel.calc_ratios(
+            with_dependencies(changing), rows=rows, previous=previous
+        )
+
+    tmp_path = path / (VALUES + ".tmp")
+    values = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=np.float64, shape=shape
+    )
+    for i, indicator in enumerate(indicators):
+        matrix = values[i].reshape(-1)
+        matrix[:] = np.nan
+        if indicator in changes:
+            matrix[cells[rows]] = changes[indicator]
+            continue
+        if indicator in panel:
+            column = panel.values(indicator)
+        elif calc_ratios is not None and indicator in calc_ratios:
+            column = calc_ratios[indicator]
+        else:
+            raise KeyError("Couln't find indicator %s" % (indicator))
+        matrix[cells[kept]] = np.asarray(column)[kept]
+    values.flush()
+    del values
+    os.replace(tmp_path, path / VALUES)
+
+    np.save(path / PERIODS, periods.astype("datetime64[ns]"))
+    axes = {
+        "indicators": list(indicators),
+        "tickers": list(panel.tickers),
+        "dimension": panel.dimension,
+    }
+    tmp_path = path / (AXES + ".tmp")
+    with open(tmp_path, "w") as a_file:
+        json.dump(axes, a_file)
+    os.replace(tmp_path, path / AXES)
+    logger.info("Built a %d x %d x %d cube in %s", *shape, path)
+    return Cube(path)
+
+
+class Cube(object):
+    """A read-only cube, see build_cube.
+
+    Indexing a cube by an indicator returns its memory-mapped (tickers,
+    periods) matrix.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        with open(self.path / AXES) as a_file:
+            axes = json.load(a_file)
+        self.indicators = axes["indicators"]
+        self.tickers = axes["tickers"]
+        self.dimension = axes["dimension"]
+        self.periods = pd.DatetimeIndex(np.load(self.path / PERIODS))
+        self.values = np.load(self.path / VALUES, mmap_mode="r")
+        self._indicator_index = {n: i for i, n in enumerate(self.indicators)}
+
+    @classmethod
+    def open(cls, path):
+        return cls(path)
+
+    def __contains__(self, indicator):
+        return indicator in self._indicator_index
+
+    def __getitem__(self, indicator):
+        return self.values[self._indicator_index[indicator]]
+
+    def frame(self, indicator):
+        """Returns an indicator's matrix as a dataframe indexed by ticker,
+        with a column per period.
+        """
+        return pd.DataFrame(
+            np.asarray(self[indicator]),
+            index=pd.Index(self.tickers, name="ticker"),
+            columns=pd.Index(self.periods, name="calendardate"),
+        )
+
+    def save_npz(self, path, indicators=None, compressed=True):
+        """Writes indicators' matrices, by default all of them, and the axes
+        to an NPZ file, an array per indicator.
+        """
+        if indicators is None:
+            indicators = self.indicators
+        arrays = {indicator: self[indicator] for indicator in indicators}
+        arrays["tickers"] = np.asarray(self.tickers)
+        arrays["periods"] = self.periods.to_numpy()
+        save = np.savez_compressed if compressed else np.savez
+        save(path, **arrays)
@@ -0,0 +1,454 @@
+"""Sharing a build out between workers on several hosts.
+
+A full universe refresh over several dimensions can take longer on one host
+than the window it has. Instead the work is planned into a directory on a
+filesystem which every host mounts, the SharedStore:
+
+    run.json             the database, the manifest's jobs, see portfolios.py,
+                         and the batches of tickers to fetch, each batch
+                         being of one dimension and number of years
+    leases/<batch>       held by the worker processing a batch
+    done/<batch>         written once a batch's results are all saved
+    results/<dimension>-<years>/<ticker>.pkl
+                         a ticker's SharadarFundamentals and sheet blocks,
+                         or <ticker>.missing for an unsupported ticker, or
+                         <ticker>.failed holding the stage and reason its
+                         fetch or calculation failed
+
+Any number of workers, see run_worker, then claim the batches by creating
+their lease file exclusively. A worker renews its lease, by touching the
+file, as each ticker is saved, and a lease not renewed for lease_seconds is
+taken over by another worker, which skips the tickers already saved. When
+two workers race to take over the same expired lease a batch may be
+processed twice, which is harmless as each result is written atomically and
+the same by both. Leases are timed by the modification times the shared
+filesystem gives them, so the hosts' clocks need to roughly agree.
+
+A ticker which fails is recorded as failed, as resilience.py's DeadLetters
+do, rather than ending the worker and leaving its batch to be taken over and
+fail again. Once every batch is done, assemble renders the workbooks of the
+jobs from the saved results, reporting the tickers which failed.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import collections.abc
+import json
+import logging
+import os
+import pathlib
+import shutil
+import socket
+import time
+
+import pandas as pd
+
+from .cache import IndicatorCache
+from .export import BULK_EXPORT_THRESHOLD
+from .fundamentals import (
+    calc_fund_ratios,
+    load_fundamentals,
+    prefetch_bulk_export,
+    stock_blocks,
+)
+from .pipeline import run_pipeline
+from .portfolios import Job, render_jobs, ticker_union
+from .resilience import DeadLetters
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+LEASE_SECONDS = 300
+POLL_SECONDS = 5
+
+
+def default_owner():
+    """Identifies this worker process in its leases."""
+    return "%s-%d" % (socket.gethostname(), os.getpid())
+
+
+class StoredResults(collections.abc.Mapping):
+    """A read only mapping of ticker to the (fund, blocks) saved for it.
+
+    Only the path is held, the results being read from the store as they
+    are looked up, so the mapping is cheap to hand to render processes.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+
+    def __getitem__(self, ticker):
+        try:
+            return pd.read_pickle(self._ticker_path(ticker))
+        except FileNotFoundError:
+            raise KeyError(ticker)
+
+    def __contains__(self, ticker):
+        return self._ticker_path(ticker).exists()
+
+    def __iter__(self):
+        return (p.stem for p in self.path.glob("*" + SharedStore.SUFFIX))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def _ticker_path(self, ticker):
+        return self.path / (ticker.replace(os.sep, "_") + SharedStore.SUFFIX)
+
+
+class SharedStore(object):
+    """A directory, on a shared filesystem, holding a planned build."""
+
+    RUN = "run.json"
+    SUFFIX = ".pkl"
+    MISSING_SUFFIX = ".missing"
+    FAILED_SUFFIX = ".failed"
+
+    def __init__(self, directory):
+        self.path = pathlib.Path(directory)
+        self._run = None
+
+    def plan(self, jobs, database, batch_size=BATCH_SIZE):
+        """Creates the store for jobs, discarding any earlier one.
+
+        The union of the jobs' tickers, for each of their dimensions and
+        years, is split into batches of batch_size tickers.
+
+        Returns:
+            The number of batches.
+        """
+        batches = []
+        for (dimension, years), tickers in ticker_union(jobs).items():
+            for start in range(0, len(tickers), batch_size):
+                batches.append(
+                    {
+                        "dimension": dimension,
+                        "years": years,
+                        "tickers": tickers[start : start + batch_size],
+                    }
+                )
+        run = {
+            "database": database,
+            "jobs": [job._asdict() for job in jobs],
+            "batches": batches,
+        }
+
+        if self.path.exists():
+            shutil.rmtree(self.path)
+        for name in ("leases", "done", "results"):
+            (self.path / name).mkdir(parents=True)
+        self._atomic_write(self.path / self.RUN, json.dumps(run, indent=1))
+        self._run = run
+        logger.info(
+            "Planned %d batches of %d jobs in %s", len(batches), len(jobs), self.path
+        )
+        return len(batches)
+
+    @property
+    def run(self):
+        if self._run is None:
+            with open(self.path / self.RUN) as r_file:
+                self._run = json.load(r_file)
+        return self._run
+
+    def jobs(self):
+        return [Job(**job) for job in self.run["jobs"]]
+
+    def planned_tickers(self, dimension, years):
+        """Returns the number of tickers planned for a dimension and years,
+        over all of their batches.
+        """
+        return sum(
+            len(entry["tickers"])
+            for entry in self.run["batches"]
+            if (entry["dimension"], entry["years"]) == (dimension, years)
+        )
+
+    def pending(self):
+        """Returns the batches which are not done."""
+        return [
+            batch
+            for batch in range(len(self.run["batches"]))
+            if not self._done_path(batch).exists()
+        ]
+
+    def claim(self, batch, owner, lease_seconds=LEASE_SECONDS):
+        """Tries to take the lease of a batch, taking over an expired lease.
+
+        Returns:
+            True if the lease was taken.
+        """
+        if self._done_path(batch).exists():
+            return False
+        lease = self._lease_path(batch)
+        try:
+            age = time.time() - lease.stat().st_mtime
+        except FileNotFoundError:
+            age = None
+        if age is not None:
+            if age < lease_seconds:
+                return False
+            # Its holder stopped renewing it, having presumably died. Renaming
+            # the lease away lets only one of the workers seeing it expired
+            # remove it.
+            expired = lease.with_name("%s.%s.expired" % (lease.name, owner))
+            try:
+                os.rename(lease, expired)
+            except FileNotFoundError:
+                return False
+            os.unlink(expired)
+            logger.warning("Taking over the expired lease of batch %d", batch)
+
+        try:
+            fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as l_file:
+            l_file.write(owner)
+        return True
+
+    def renew(self, batch):
+        try:
+            os.utime(self._lease_path(batch))
+        except FileNotFoundError:
+            pass
+
+    def release(self, batch):
+        try:
+            os.unlink(self._lease_path(batch))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, batch, owner):
+        """Marks a batch as done and releases its lease."""
+        done = {"owner": owner, "finished": time.time()}
+        self._atomic_write(self._done_path(batch), json.dumps(done))
+        self.release(batch)
+
+    def results(self, dimension, years):
+        """Returns the StoredResults of a dimension and number of years."""
+        return StoredResults(self._results_path(dimension, years))
+
+    def is_saved(self, dimension, years, ticker):
+        path = self.results(dimension, years)._ticker_path(ticker)
+        return (
+            path.exists()
+            or path.with_suffix(self.MISSING_SUFFIX).exists()
+            or path.with_suffix(self.FAILED_SUFFIX).exists()
+        )
+
+    def save(self, dimension, years, ticker, computed):
+        """Saves a ticker's (fund, blocks), or None if it is not supported."""
+        path = self.results(dimension, years)._ticker_path(ticker)
+        path.parent.mkdir(exist_ok=True)
+        if computed is None:
+            self._atomic_write(path.with_suffix(self.MISSING_SUFFIX), "")
+            return
+        tmp_path = path.with_name(path.name + ".%d.tmp" % os.getpid())
+        pd.to_pickle(computed, tmp_path)
+        os.replace(tmp_path, path)
+
+    def save_failure(self, dimension, years, ticker, stage, reason):
+        """Saves that a ticker's fetch or calculation failed.
+
+        Args:
+            stage: Where it failed, e.g. fetch.
+            reason: Why, a single line.
+        """
+        path = self.results(dimension, years)._ticker_path(ticker)
+        path.parent.mkdir(exist_ok=True)
+        self._atomic_write(
+            path.with_suffix(self.FAILED_SUFFIX),
+            json.dumps({"ticker": ticker, "stage": stage, "reason": reason}),
+        )
+
+    def failures(self):
+        """Returns a dict of each failed ticker to the (stage, reason) it
+        failed, over every dimension and years.
+        """
+        failures = collections.OrderedDict()
+        for path in sorted(self.path.glob("results/*/*" + self.FAILED_SUFFIX)):
+            with open(path) as f_file:
+                failure = json.load(f_file)
+            failures[failure["ticker"]] = (failure["stage"], failure["reason"])
+        return failures
+
+    def _results_path(self, dimension, years):
+        return self.path / "results" / ("%s-%d" % (dimension, years))
+
+    def _lease_path(self, batch):
+        return self.path / "leases" / str(batch)
+
+    def _done_path(self, batch):
+        return self.path / "done" / str(batch)
+
+    def _atomic_write(self, path, text):
+        tmp_path = path.with_name(path.name + ".%d.tmp" % os.getpid())
+        with open(tmp_path, "w") as t_file:
+            t_file.write(text)
+        os.replace(tmp_path, path)
+
+
+def process_batch(store, batch, workers=1, bulk_threshold=BULK_EXPORT_THRESHOLD):
+    """Fetches and calculates the tickers of a batch, saving each to the
+    store. The tickers already saved, by an earlier holder of the batch's
+    lease, are skipped, and those which fail are saved as failed.
+
+    The batch's tickers are fetched with a bulk export when at least
+    bulk_threshold tickers are planned for its dimension and years, over
+    all of their batches, as run_manifest compares it with the union of its
+    jobs.
+    """
+    database = store.run["database"]
+    entry = store.run["batches"][batch]
+    dimension, years = entry["dimension"], entry["years"]
+    tickers = [t for t in entry["tickers"] if not store.is_saved(dimension, years, t)]
+    logger.info(
+        "Processing batch %d, %d tickers of %s over %d years",
+        batch,
+        len(tickers),
+        dimension,
+        years,
+    )
+
+    cache = None
+    if (
+        bulk_threshold is not None
+        and tickers
+        and store.planned_tickers(dimension, years) >= bulk_threshold
+    ):
+        cache = IndicatorCache()
+        try:
+            prefetch_bulk_export(tickers, database, dimension, years, cache)
+        except Exception as exc:
+            logger.warning(
+                "The bulk export failed, fetching the stocks one at a time: %s", exc
+            )
+
+    dead_letters = DeadLetters()
+
+    def fetch(stock):
+        try:
+            return load_fundamentals(stock, database, dimension, years, cache=cache)
+        except Exception as exc:
+            dead_letters.add(stock, "fetch", exc)
+            return None
+
+    def compute(stock, fund):
+        if fund is None:
+            return None
+        try:
+            calc_fund_ratios(stock, fund)
+            return fund, stock_blocks(fund)
+        except Exception as exc:
+            dead_letters.add(stock, "compute", exc)
+            return None
+
+    def write(stock, computed):
+        failure = dead_letters.failures.get(stock)
+        if failure is None:
+            store.save(dimension, years, stock, computed)
+        else:
+            store.save_failure(dimension, years, stock, *failure)
+        store.renew(batch)
+
+    run_pipeline(
+        tickers,
+        fetch,
+        compute,
+        write,
+        fetch_workers=workers,
+        compute_workers=min(workers, os.cpu_count() or 1),
+    )
+
+
+def run_worker(
+    directory,
+    workers=1,
+    bulk_threshold=BULK_EXPORT_THRESHOLD,
+    lease_seconds=LEASE_SECONDS,
+    poll_seconds=POLL_SECONDS,
+    owner=None,
+):
+    """Claims and processes the batches of a store until every one is done.
+
+    While the remaining batches are leased by other workers it waits, in
+    case one of them dies and its lease has to be taken over.
+
+    Args:
+        directory: The SharedStore's directory.
+        workers: The number of threads fetching indicators from Quandl.
+        bulk_threshold: As for stock_xlsx, compared with the number of
+            tickers planned for a batch's dimension and years.
+        lease_seconds: How long a lease lasts without being renewed.
+        poll_seconds: How long to wait before looking for work again.
+        owner: Identifies this worker, by default by host and process id.
+    Returns:
+        The number of batches this worker processed.
+    """
+    store = SharedStore(directory)
+    if owner is None:
+        owner = default_owner()
+    processed = 0
+    while True:
+        pending = store.pending()
+        if not pending:
+            break
+        claimed = next(
+            (b for b in pending if store.claim(b, owner, lease_seconds)), None
+        )
+        if claimed is None:
+            time.sleep(poll_seconds)
+            continue
+        try:
+            process_batch(store, claimed, workers, bulk_threshold)
+        except BaseException:
+            store.release(claimed)
+            raise
+        store.complete(claimed, owner)
+        processed += 1
+    logger.info("%s processed %d batches", owner, processed)
+    return processed
+
+
+def assemble(directory, render_workers=None, dead_letters=None):
+    """Renders the workbooks of a store's jobs once every batch is done.
+
+    The tickers which failed in the workers are left out of the workbooks
+    and logged.
+
+    Args:
+        directory: The SharedStore's directory.
+        render_workers: As for run_manifest.
+        dead_letters: An optional DeadLetters, see resilience.py, in which
+            the tickers which failed in the workers are recorded, as are
+            those whose sheets fail to be written, which are then left out
+            of the workbooks rather than the failure ending the build.
+    Returns:
+        A dict of each job's output to the number of stock sheets written.
+    Raises:
+        ValueError: Some of the batches are not done.
+    """
+    store = SharedStore(directory)
+    pending = store.pending()
+    if pending:
+        raise ValueError(
+            "%d of the %d batches in %s are not done"
+            % (len(pending), len(store.run["batches"]), directory)
+        )
+    failures = store.failures()
+    if failures:
+        logger.warning(
+            "%d tickers failed in the workers and are left out: %s",
+            len(failures),
+            ", ".join(failures),
+        )
+        if dead_letters is not None:
+            dead_letters.update(failures)
+    jobs = store.jobs()
+    results = {
+        (job.dimension, job.years): store.results(job.dimension, job.years)
+        for job in jobs
+    }
+    return render_jobs(jobs, results, render_workers, dead_letters)
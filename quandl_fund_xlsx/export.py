@@ -0,0 +1,141 @@
+"""Fetches the SF1 table for many tickers at once with a bulk export.
+
+quandl.get_table returns the table as pages of JSON, which for a universe of
+thousands of tickers is a long series of round trips and JSON decoding. The
+tables API can instead prepare a zipped CSV export of every row matching a
+filter. bulk_export requests the exports, polls until they are ready, then
+decodes the CSV in chunks, handing back each ticker's rows as a dataframe
+shaped like those returned by quandl.get_table.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import logging
+import tempfile
+import time
+import zipfile
+
+import pandas as pd
+from quandl.connection import Connection
+from quandl.util import Util
+from quandl.utils.request_type_util import RequestType
+
+logger = logging.getLogger(__name__)
+
+# Above this many tickers stock_xlsx and build_panel use a bulk export.
+BULK_EXPORT_THRESHOLD = 200
+
+SF1_EXPORT_PATH = "datatables/SHARADAR/SF1.json"
+
+DATE_COLUMNS = ("datekey", "calendardate", "reportperiod", "lastupdated")
+
+
+class ExportTimeoutError(Exception):
+    pass
+
+
+def request_export(tickers, dimension):
+    """Asks for an export of the SF1 rows for tickers and dimension.
+
+    Returns:
+        The file description from the response, a dict with a status of
+        "fresh" and a link once the export is ready to download.
+    """
+    params = {"ticker": list(tickers), "dimension": dimension, "qopts.export": "true"}
+    request_type = RequestType.get_request_type(SF1_EXPORT_PATH, params=params)
+    options = Util.convert_options(request_type=request_type, params=params)
+    response = Connection.request(request_type, SF1_EXPORT_PATH, **options)
+    return response.json()["datatable_bulk_download"]["file"]
+
+
+def wait_for_export(tickers, dimension, poll_interval=5, timeout=600):
+    """Requests an export and polls until it is ready.
+
+    Returns:
+        The link to download the zipped CSV from.
+    Raises:
+        ExportTimeoutError: If the export is not ready within timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        file_info = request_export(tickers, dimension)
+        if file_info["status"] == "fresh" and file_info.get("link"):
+            return file_info["link"]
+        if time.monotonic() + poll_interval > deadline:
+            raise ExportTimeoutError(
+                "The SF1 export was still %s after %ss" % (file_info["status"], timeout)
+            )
+        logger.debug("wait_for_export: export is %s", file_info["status"])
+        time.sleep(poll_interval)
+
+
+def read_export(zip_file, chunksize=50000):
+    """Decodes an exported zipped CSV, yielding (ticker, dataframe) pairs.
+
+    The CSV is read chunksize rows at a time. While the rows arrive sorted by
+    ticker, as the exports are, each ticker is yielded as soon as the rows of
+    the next ticker start, so only one ticker's rows are held in memory. If
+    the rows turn out not to be sorted the remaining tickers are yielded once
+    the whole file has been read.
+    """
+    pieces = {}
+    is_sorted = True
+    last_ticker = None
+
+    with zipfile.ZipFile(zip_file) as archive:
+        member = [n for n in archive.namelist() if n.endswith(".csv")][0]
+        with archive.open(member) as csv_file:
+            for chunk in pd.read_csv(csv_file, chunksize=chunksize):
+                for name in DATE_COLUMNS:
+                    if name in chunk.columns:
+                        chunk[name] = pd.to_datetime(chunk[name])
+                tickers = chunk["ticker"].to_numpy()
+                if is_sorted:
+                    if last_ticker is not None and tickers[0] < last_ticker:
+                        is_sorted = False
+                    elif (tickers[1:] < tickers[:-1]).any():
+                        is_sorted = False
+                for ticker, rows in chunk.groupby("ticker", sort=False):
+                    pieces.setdefault(ticker, []).append(rows)
+                last_ticker = tickers[-1]
+
+                if is_sorted:
+                    for ticker in [t for t in pieces if t != last_ticker]:
+                        yield ticker, _join(pieces.pop(ticker))
+
+    for ticker in list(pieces):
+        yield ticker, _join(pieces.pop(ticker))
+
+
+def _join(rows):
+    return pd.concat(rows, ignore_index=True)
+
+
+def bulk_export(tickers, dimension, batch_size=500, poll_interval=5, timeout=600):
+    """Fetches the SF1 rows for many tickers through bulk exports.
+
+    The tickers are split into batches of batch_size, each its own export.
+    The exports for every batch are requested before any are downloaded so
+    that they are prepared concurrently.
+
+    Yields:
+        (ticker, dataframe) pairs. Tickers without any rows are not yielded.
+    """
+    tickers = list(tickers)
+    batches = [tickers[i : i + batch_size] for i in range(0, len(tickers), batch_size)]
+    for batch in batches:
+        request_export(batch, dimension)
+
+    session = Connection.get_session()
+    for batch in batches:
+        link = wait_for_export(batch, dimension, poll_interval, timeout)
+        logger.info("Downloading the SF1 export of %d tickers", len(batch))
+        with tempfile.TemporaryFile() as zip_file:
+            with session.get(link, stream=True) as response:
+                response.raise_for_status()
+                for data in response.iter_content(chunk_size=1024 * 1024):
+                    zip_file.write(data)
+            zip_file.seek(0)
+            for ticker, frame in read_export(zip_file):
+                yield ticker, frame
@@ -14,24 +14,46 @@ import numpy as np
 import os
 import sys
 import pandas as pd
+from pandas.api.types import infer_dtype
 import quandl
 from quandl.errors.quandl_error import NotFoundError
 from xlsxwriter.utility import xl_range
 from xlsxwriter.utility import xl_rowcol_to_cell
 
-
-# Added this one line below  to get logging from the requests module,
-# comment me out when done
-# logging.basicConfig(level=logging.DEBUG)
-
+from .analytics import STATISTICS, block_statistics
+from .cache import IndicatorCache
+from .checkpoint import CheckpointStore
+from .compact import compact_frame
+from .export import BULK_EXPORT_THRESHOLD, bulk_export
+from .peers import peer_statistics
+from .pipeline import run_pipeline
+from .profiles import BLOCKS, PROFILES
+from .prices import (
+    ASOF_RATIOS,
+    CURRENT_SUMMARIZE_IND,
+    VALUATION_RATIOS,
+    asof_valuations,
+    current_valuations,
+    group_prices,
+)
+from .ratios import (
+    RATIO_EXPRESSIONS,
+    evaluate_ratios,
+    ratio_inputs,
+    with_dependencies,
+)
+from .screen import check_screen, latest_values, screen_names, screen_stocks
+from . import tracing
+from .validate import (
+    concat_issues,
+    log_issues,
+    mask_ratios,
+    validate_frame,
+    write_issues,
+)
+
+# The handlers and level are set by the application, see cli.main
 logger = logging.getLogger(__name__)
-handler = logging.StreamHandler()
-formatter = logging.Formatter("%(asctime)s %(levelname)-8s %(message)s")
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-
-logger.setLevel(logging.INFO)
-#logger.setLevel(logging.DEBUG)
 
 
 class Fundamentals_ng(object):
@@ -77,9 +99,18 @@ class Fundamentals_ng(object):
         self.metrics_and_ratios_df = None
         self.calc_ratios_dict = collections.OrderedDict(calc_ratios)
         self.calc_ratios_df = None
+        self.issues_df = None
         self.dimension = None
         self.periods = None
         self.summarize_ind_dict = collections.OrderedDict(summarize_ind)
+        # Ratios calculated, but not shown, beyond those of calc_ratios_dict
+        # and summarize_ind_dict
+        self.hidden_ratios = []
+        # The SF1 columns fetched, None for all of them
+        self.fetch_columns = None
+        # Summarized values which are not the latest of a dataframe column,
+        # e.g. the valuations at the latest price
+        self.current_values = {}
 
     def get_indicators(self, ticker, dimension, periods):
         """Obtains fundamental company indicators from the Quandl API.
@@ -112,29 +143,60 @@ class Fundamentals_ng(object):
         # At some point the SF0 table was removed and if we just  have an "SF0" database access
         # we still need to request access to SHARADAR/SF1 table. Their API takes care of
         # restricting access to the SF0 limited dataset
+        options = {}
+        if self.fetch_columns is not None:
+            options["qopts"] = {"columns": self.fetch_columns}
         try:
-            self.all_inds_df = quandl.get_table(
-                "SHARADAR/SF1", ticker=ticker, dimension=dimension
-            )
+            with tracing.span("fetch", ticker) as span:
+                self.all_inds_df = quandl.get_table(
+                    "SHARADAR/SF1", ticker=ticker, dimension=dimension, **options
+                )
+                span.set(rows=len(self.all_inds_df))
 
             if self.all_inds_df.empty:
                 raise NotFoundError
 
             # Sort so that earliest dates will now be at the top
-            self.all_inds_df.sort_values("datekey", inplace=True)
-            self.all_inds_df = self.all_inds_df.tail(periods)
+            self.all_inds_df = latest_periods(self.all_inds_df, periods)
 
             loc_df = self.all_inds_df.copy()
 
-            logger.debug(
-                "get_indicators: df columns  = %s" % (self.all_inds_df.columns.tolist())
-            )
-            logger.debug("get_indicators: all_inds_df = %s" % (self.all_inds_df.head()))
+            # Formatting the dataframe is costly, only done when it is logged
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "get_indicators: df columns  = %s",
+                    self.all_inds_df.columns.tolist(),
+                )
+                logger.debug(
+                    "get_indicators: all_inds_df = %s", self.all_inds_df.head()
+                )
 
         except NotFoundError:
             logger.warning("get_indicators: The ticker %s " "is not supported", ticker)
             raise
 
+        self.set_indicators(self.all_inds_df, dimension, periods)
+        return loc_df
+
+    def set_indicators(self, all_inds_df, dimension, periods):
+        """Populates the statement dataframes from an SF1 indicators dataframe.
+
+        Used by get_indicators once the data has been obtained from Quandl and
+        when restoring previously fetched indicators e.g from a checkpoint.
+
+        Args:
+            all_inds_df: A dataframe as returned by get_indicators, sorted with
+                the earliest dates at the top.
+            dimension: A string representing the timeframe of the data.
+            periods: An integer representing the number of periods of data.
+        """
+        if self.fetch_columns is not None:
+            # e.g. a bulk export holds every column
+            all_inds_df = all_inds_df.loc[
+                :, all_inds_df.columns.isin(self.fetch_columns)
+            ]
+        self.all_inds_df = all_inds_df
+
         # Let's create separate income statement dataframe, cf, balance and metrics dataframes
         # by filtering out from the all_inds datafarame.
 
@@ -147,9 +209,10 @@ class Fundamentals_ng(object):
         self.dimension = dimension
         self.periods = periods
 
-        logger.debug("get_indicators: income dataframe = %s" % (self.i_stmnt_df.head()))
-
-        return loc_df
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "get_indicators: income dataframe = %s", self.i_stmnt_df.head()
+            )
 
     def get_transposed_and_formatted_i_stmnt(self):
         """ Returns a transposed and formatted partial income statement dataframe with
@@ -217,7 +280,9 @@ class Fundamentals_ng(object):
         Returns:
             A dataframe
         """
-        stmnt_df = self.calc_ratios_df.copy()
+        # Leaving out the ratios which are only summarized or needed by others
+        shown = [r for r in self.calc_ratios_dict if r in self.calc_ratios_df.columns]
+        stmnt_df = self.calc_ratios_df[["datekey"] + shown].copy()
         desc_dict = self.calc_ratios_dict
         description = "Calculated Metrics and Ratios"
 
@@ -282,8 +347,13 @@ class Fundamentals_ng(object):
         self.calc_ratios_df = pd.DataFrame(index=self.i_stmnt_df.index)
 
         for ratio in self.calc_ratios_dict:
-            logger.debug("get_calc_ratios: ratio = %s" % (ratio))
-            self._calc_ratios(ratio)
+            if ratio not in RATIO_EXPRESSIONS:
+                logger.warning("calc_ratios: No definition for the ratio %s", ratio)
+        calculated = evaluate_ratios(
+            with_dependencies(self.ratio_names()), self.all_inds_df
+        )
+        for ratio in self.ratio_names(calculated):
+            self.calc_ratios_df[ratio] = calculated[ratio]
 
         # This datekey column will be needed later when we transpose the dataframe
         # The sharadar returned dataframes included a datekey column as part of the results.
@@ -294,400 +364,54 @@ class Fundamentals_ng(object):
         # returned by sharadar
         self.calc_ratios_df.insert(0, "datekey", self.i_stmnt_df["datekey"])
 
-        # Change  nan to None and inf to a big recognizable number.
+        # Ratios with a zero denominator become nan, then nan becomes None.
+        self.validate(self.calc_ratios_df)
         self.calc_ratios_df = self.calc_ratios_df.replace({np.nan: None})
-        self.calc_ratios_df = self.calc_ratios_df.replace({np.inf: 999999999})
 
-        logger.debug("get_calc_ratios: dataframe = %s" % (self.calc_ratios_df))
+        logger.debug("get_calc_ratios: dataframe = %s", self.calc_ratios_df)
         return self.calc_ratios_df.copy()
 
-    def _calc_ratios(self, ratio):
-        # Debt to Cash Flow From Operations
-        def _debt_cfo_ratio():
-            logger.debug(
-                "_calc_ratios._debt_cfo_ratio: debt = %s" % (self.bal_stmnt_df["debt"])
-            )
-
-            self.calc_ratios_df[ratio] = (
-                self.bal_stmnt_df["debt"] / self.cf_stmnt_df["ncfo"]
-            )
-            return
-
-        # Debt to Equity
-        def _debt_equity_ratio():
-            logger.debug(
-                "_calc_ratios._debt_equity_ratio: debt = %s"
-                % (self.bal_stmnt_df["debt"])
-            )
-            logger.debug(
-                "_calc_ratios._debt_equity_ratio: equity = %s"
-                % (self.bal_stmnt_df["equity"])
-            )
-            self.calc_ratios_df[ratio] = (
-                self.bal_stmnt_df["debt"] / self.bal_stmnt_df["equity"]
-            )
-            return
-
-        def _liabilities_equity_ratio():
-            logger.debug(
-                "_calc_ratios._liabilities_equity:_ratio liabilities = %s"
-                % (self.bal_stmnt_df["liabilities"])
-            )
-            logger.debug(
-                "_calc_ratios._liabilities_equity_ratio: equity = %s"
-                % (self.bal_stmnt_df["equity"])
-            )
-            self.calc_ratios_df[ratio] = (
-                self.bal_stmnt_df["liabilities"] / self.bal_stmnt_df["equity"]
-            )
-            return
-
-        # Debt to ebitda
-        def _debt_ebitda_ratio():
-            self.calc_ratios_df[ratio] = (
-                self.bal_stmnt_df["debt"] / self.metrics_and_ratios_df["ebitda"]
-            )
-            return
-
-        # Debt to ebitda minus CapEx
-        def _debt_ebitda_minus_capex_ratio():
-
-            # capex is returned from Sharadar as a -ve number, hence we need to add this to
-            # subtract capex
-            self.calc_ratios_df[ratio] = self.bal_stmnt_df["debt"] / (
-                self.metrics_and_ratios_df["ebitda"] + self.cf_stmnt_df["capex"]
-            )
-            return
-
-        # Net Debt to ebitda
-        def _net_debt_ebitda_ratio():
-            self.calc_ratios_df[ratio] = (
-                self.bal_stmnt_df["debt"] - self.bal_stmnt_df["cashnequsd"]
-            ) / self.metrics_and_ratios_df["ebitda"]
-            return
-
-        # Net Debt to ebitda minus CapEx
-        def _net_debt_ebitda_minus_capex_ratio():
-            # capex is returned from Sharadar as a -ve number, hence we need to add this to
-            # subtract capex
-            self.calc_ratios_df[ratio] = (
-                self.bal_stmnt_df["debt"] - self.bal_stmnt_df["cashnequsd"]
-            ) / (self.metrics_and_ratios_df["ebitda"] + self.cf_stmnt_df["capex"])
-            return
-
-        # Depreciation to Cash Flow From Operations Pg 278.
-        def _depreciation_cfo_ratio():
-            self.calc_ratios_df[ratio] = (
-                self.cf_stmnt_df["depamor"] / self.cf_stmnt_df["ncfo"]
-            )
-            return
-
-        def _depreciation_revenue_ratio():
-            self.calc_ratios_df[ratio] = (
-                self.cf_stmnt_df["depamor"] / self.i_stmnt_df["revenue"]
-            )
-            return
-
-        def _debt_to_total_capital():
-            self.calc_ratios_df[ratio] = (
-                self.bal_stmnt_df["debt"] / self.metrics_and_ratios_df["invcapavg"]
-            )
-            return
-
-        def _roic():
-            self.calc_ratios_df[ratio] = (
-                self.i_stmnt_df["ebit"] / self.metrics_and_ratios_df["invcapavg"]
-            )
-
-        #        self.database =  database
-
-        # Times Interest coverage aka fixed charge coverage Pg 278.
-        # (Net Income + Income taxes + Interest Expense)/(Interest expense + Capitalized Interest)
-        # Cannot see how to get capitalized interest from the API so that term is excluded.
-        # This is the same as ebit to Interest Expense
-        def _ebit_interest_coverage():
-            self.calc_ratios_df[ratio] = (
-                self.i_stmnt_df["ebit"] / self.i_stmnt_df["intexp"]
-            )
-            return
-
-        def _ebitda_interest_coverage():
-            self.calc_ratios_df[ratio] = (
-                self.metrics_and_ratios_df["ebitda"] / self.i_stmnt_df["intexp"]
-            )
-            return
-
-        def _ebitda_minus_capex_interest_coverage():
-            # Recall that capex is returned from Sharadar as a -ve number.
-            self.calc_ratios_df[ratio] = (
-                self.metrics_and_ratios_df["ebitda"] + self.cf_stmnt_df["capex"]
-            ) / self.i_stmnt_df["intexp"]
-            return
-
-        def _rough_ffo():
-            self.calc_ratios_df[ratio] = (
-                self.i_stmnt_df["netinc"] + self.cf_stmnt_df["depamor"]
-            )
-            return
-
-        def _rough_affo():
-            # capex is returned from Quandl as a -ve number, hence we add this to
-            # subtract capex
-            self.calc_ratios_df[ratio] = (
-                self.i_stmnt_df["netinc"]
-                + self.cf_stmnt_df["depamor"]
-                + self.cf_stmnt_df["capex"]
-            )
-            return
-
-        def _rough_ffo_dividend_payout_ratio():
-            self.calc_ratios_df[ratio] = self.cf_stmnt_df["ncfdiv"] / (
-                self.i_stmnt_df["netinc"] + self.cf_stmnt_df["depamor"]
-            )
-            return
-
-        def _rough_affo_dividend_payout_ratio():
-            self.calc_ratios_df[ratio] = self.cf_stmnt_df["ncfdiv"] / (
-                self.i_stmnt_df["netinc"]
-                + self.cf_stmnt_df["depamor"]
-                + self.cf_stmnt_df["capex"]
-            )
-            return
-
-        def _income_dividend_payout_ratio():
-            # negating since ncfdiv is returned as a negative number
-            self.calc_ratios_df[ratio] = (
-                -self.cf_stmnt_df["ncfdiv"] / self.i_stmnt_df["netinc"]
-            )
-            return
-
-        # TODO add some conditional logig to use the fullydiluted shares value when it
-        # is provided
-        def _price_rough_ffo_ps_ratio():
-            self.calc_ratios_df[ratio] = self.i_stmnt_df["price"] / (
-                self.calc_ratios_df["rough_ffo"] / self.bal_stmnt_df["shareswa"]
-            )
-            return
-
-        def _rough_ffo_ps():
-            self.calc_ratios_df[ratio] = (
-                self.calc_ratios_df["rough_ffo"] / self.bal_stmnt_df["shareswa"]
-            )
-            return
-
-        def _cfo_ps():
-            self.calc_ratios_df[ratio] = (
-                self.cf_stmnt_df["ncfo"] / self.bal_stmnt_df["shareswa"]
-            )
-            return
-
-        def _opinc_ps():
-            self.calc_ratios_df[ratio] = (
-                self.i_stmnt_df["opinc"] / self.bal_stmnt_df["shareswa"]
-            )
-            return
-
-        def _fcf_ps():
-            self.calc_ratios_df[ratio] = (
-                self.metrics_and_ratios_df["fcf"] / self.bal_stmnt_df["shareswa"]
-            )
-            return
-
-        def _ev_opinc_ratio():
-            self.calc_ratios_df[ratio] = (
-                self.metrics_and_ratios_df["ev"] / self.i_stmnt_df["opinc"]
-            )
-            return
-
-        # Kenneth Jeffrey Marshal, author of Good Stocks Cheap, definition
-        # of capital employed. He has two defnitions, one where cash is
-        # subtracted and one where it's not. Accrued expenses should be
-        # substracted but Is not available in the Sharadar API, probably a
-        # scour the footnotes thing if really wanted to include this.
-        def _kjm_capital_employed_sub_cash():
-            self.calc_ratios_df[ratio] = (
-                self.bal_stmnt_df["assets"]
-                - self.bal_stmnt_df["cashnequsd"]
-                - self.bal_stmnt_df["payables"]
-                - self.bal_stmnt_df["deferredrev"]
-            )
-            return
-
-        def _kjm_capital_employed_with_cash():
-            self.calc_ratios_df[ratio] = (
-                self.bal_stmnt_df["assets"]
-                - self.bal_stmnt_df["payables"]
-                - self.bal_stmnt_df["deferredrev"]
-            )
-            return
-
-        def _kjm_roce_sub_cash():
-            self.calc_ratios_df[ratio] = (
-                self.i_stmnt_df["opinc"]
-                / self.calc_ratios_df["kjm_capital_employed_sub_cash"]
-            )
-            return
-
-        def _kjm_roce_with_cash():
-            self.calc_ratios_df[ratio] = (
-                self.i_stmnt_df["opinc"]
-                / self.calc_ratios_df["kjm_capital_employed_with_cash"]
-            )
-            return
-
-        def _kjm_fcf_return_on_capital_employed_sub_cash():
-            self.calc_ratios_df[ratio] = (
-                self.metrics_and_ratios_df["fcf"]
-                / self.calc_ratios_df["kjm_capital_employed_sub_cash"]
-            )
-            return
-
-        def _kjm_fcf_return_on_capital_employed_with_cash():
-            self.calc_ratios_df[ratio] = (
-                self.metrics_and_ratios_df["fcf"]
-                / self.calc_ratios_df["kjm_capital_employed_with_cash"]
-            )
-            return
+    def validate(self, calculated=None):
+        """Checks the quality of the indicators and calculated ratios, see
+        validate.py, setting issues_df.
 
-        def _kjm_delta_oi_fds():
-            self.calc_ratios_df[ratio] = self.calc_ratios_df["opinc_ps"].pct_change()
-            return
-
-        def _kjm_delta_fcf_fds():
-            self.calc_ratios_df[ratio] = self.calc_ratios_df["fcf_ps"].pct_change()
-            return
-
-        def _kjm_delta_bv_fds():
-            self.calc_ratios_df[ratio] = self.bal_stmnt_df["equity"].pct_change()
-            return
-
-        def _kjm_delta_tbv_fds():
-            self.calc_ratios_df[ratio] = (
-                self.bal_stmnt_df["equity"] - self.bal_stmnt_df["intangibles"]
-            ).pct_change()
-            return
-
-        def _dividends_free_cash_flow_ratio():
-            self.calc_ratios_df[ratio] = (
-                -self.cf_stmnt_df["ncfdiv"] / self.metrics_and_ratios_df["fcf"]
-            )
-            return
-
-        def _preferred_free_cash_flow_ratio():
-            self.calc_ratios_df[ratio] = (
-                self.i_stmnt_df["prefdivis"] / self.metrics_and_ratios_df["fcf"]
-            )
-            return
-
-        def _operating_margin():
-            self.calc_ratios_df[ratio] = (
-                self.i_stmnt_df["opinc"] / self.i_stmnt_df["revenue"]
-            )
-            return
-
-        def _sg_and_a_gross_profit_ratio():
-            self.calc_ratios_df[ratio] = self.i_stmnt_df["sgna"] / self.i_stmnt_df["gp"]
-            return
-
-        def _ltdebt_cfo_ratio():
-            self.calc_ratios_df[ratio] = (
-                self.bal_stmnt_df["debtnc"] / self.cf_stmnt_df["ncfo"]
-            )
-            return
-
-        def _ltdebt_earnings_ratio():
-            self.calc_ratios_df[ratio] = (
-                self.bal_stmnt_df["debtnc"] / self.i_stmnt_df["netinc"]
-            )
-            return
-
-        def _free_cash_flow_conversion_ratio():
-            self.calc_ratios_df[ratio] = (
-                self.metrics_and_ratios_df["fcf"] / self.metrics_and_ratios_df["ebitda"]
-            )
-            return
-
-        # Pg 290 of Creative Cash Flow Reporting, Mumford et al.
-        def _excess_cash_margin_ratio():
-            self.calc_ratios_df[ratio] = (
-                (self.cf_stmnt_df["ncfo"] - self.i_stmnt_df["opinc"])
-                * 100
-                / self.i_stmnt_df["revenue"]
-            )
-            return
-
-        def _interest_to_cfo_plus_interest_coverage():
-            self.calc_ratios_df[ratio] = self.i_stmnt_df["intexp"] / (
-                self.cf_stmnt_df["ncfo"] + self.i_stmnt_df["intexp"]
-            )
-            return
-
-        def _dividends_cfo_ratio():
-            # negating since ncfdiv is returned as a negative number
-            self.calc_ratios_df[ratio] = (
-                -self.cf_stmnt_df["ncfdiv"] / self.cf_stmnt_df["ncfo"]
-            )
-            return
-
-        def _preferred_cfo_ratio():
-            self.calc_ratios_df[ratio] = (
-                self.i_stmnt_df["prefdivis"] / self.cf_stmnt_df["ncfo"]
+        Args:
+            calculated: The calculated ratios, which are masked in place. By
+                default the ratios are recalculated for checking only, as
+                for stocks restored from a checkpoint.
+        Returns:
+            The issues dataframe.
+        """
+        if calculated is None:
+            calculated = evaluate_ratios(
+                with_dependencies(self.ratio_names()), self.all_inds_df
             )
-            return
+            # In the order of calc_ratios_df, as are the issues found
+            calculated = {r: calculated[r] for r in self.ratio_names(calculated)}
+        self.issues_df, zero = validate_frame(
+            self.all_inds_df, calculated, self.dimension
+        )
+        mask_ratios(calculated, zero)
+        return self.issues_df
 
-        switcher = {
-            "debt_equity_ratio": _debt_equity_ratio,
-            "liabilities_equity_ratio": _liabilities_equity_ratio,
-            "debt_ebitda_ratio": _debt_ebitda_ratio,
-            "debt_ebitda_minus_capex_ratio": _debt_ebitda_minus_capex_ratio,
-            "net_debt_ebitda_ratio": _net_debt_ebitda_ratio,
-            "net_debt_ebitda_minus_capex_ratio": _net_debt_ebitda_minus_capex_ratio,
-            "debt_to_total_capital": _debt_to_total_capital,
-            "return_on_invested_capital": _roic,
-            "ebit_interest_coverage": _ebit_interest_coverage,
-            "ebitda_interest_coverage": _ebitda_interest_coverage,
-            "ebitda_minus_capex_interest_coverage": _ebitda_minus_capex_interest_coverage,
-            "debt_cfo_ratio": _debt_cfo_ratio,
-            "depreciation_cfo_ratio": _depreciation_cfo_ratio,
-            "depreciation_revenue_ratio": _depreciation_revenue_ratio,
-            "rough_ffo": _rough_ffo,
-            "rough_affo": _rough_affo,
-            "rough_ffo_dividend_payout_ratio": _rough_ffo_dividend_payout_ratio,
-            "rough_affo_dividend_payout_ratio": _rough_affo_dividend_payout_ratio,
-            "income_dividend_payout_ratio": _income_dividend_payout_ratio,
-            "price_rough_ffo_ps_ratio": _price_rough_ffo_ps_ratio,
-            "rough_ffo_ps": _rough_ffo_ps,
-            "opinc_ps": _opinc_ps,
-            "cfo_ps": _cfo_ps,
-            "fcf_ps": _fcf_ps,
-            "ev_opinc_ratio": _ev_opinc_ratio,
-            "dividends_free_cash_flow_ratio": _dividends_free_cash_flow_ratio,
-            "preferred_free_cash_flow_ratio": _preferred_free_cash_flow_ratio,
-            "operating_margin": _operating_margin,
-            "sg_and_a_gross_profit_ratio": _sg_and_a_gross_profit_ratio,
-            "ltdebt_cfo_ratio": _ltdebt_cfo_ratio,
-            "ltdebt_earnings_ratio": _ltdebt_earnings_ratio,
-            "free_cash_flow_conversion_ratio": _free_cash_flow_conversion_ratio,
-            "excess_cash_margin_ratio": _excess_cash_margin_ratio,
-            "interest_to_cfo_plus_interest_coverage": _interest_to_cfo_plus_interest_coverage,
-            "dividends_cfo_ratio": _dividends_cfo_ratio,
-            "preferred_cfo_ratio": _preferred_cfo_ratio,
-            "kjm_capital_employed_sub_cash": _kjm_capital_employed_sub_cash,
-            "kjm_capital_employed_with_cash": _kjm_capital_employed_with_cash,
-            "kjm_roce_sub_cash": _kjm_roce_sub_cash,
-            "kjm_roce_with_cash": _kjm_roce_with_cash,
-            "kjm_fcf_return_on_capital_employed_sub_cash": _kjm_fcf_return_on_capital_employed_sub_cash,
-            "kjm_fcf_return_on_capital_employed_with_cash": _kjm_fcf_return_on_capital_employed_with_cash,
-            "kjm_delta_oi_fds": _kjm_delta_oi_fds,
-            "kjm_delta_fcf_fds": _kjm_delta_fcf_fds,
-            "kjm_delta_bv_fds": _kjm_delta_bv_fds,
-            "kjm_delta_tbv_fds": _kjm_delta_tbv_fds,
-        }
+    def ratio_names(self, calculated=()):
+        """Returns the names of the ratios to calculate, as defined in
+        ratios.RATIO_EXPRESSIONS, in the order of calc_ratios_df.
 
-        # Get the function from switcher dictionary
-        func = switcher.get(ratio, lambda: NotImplementedError)
-        # Execute the function
-        return func()
+        Args:
+            calculated: The names of the ratios calculated, appended in the
+                order of RATIO_EXPRESSIONS when not already in the list.
+        """
+        names = []
+        for ratio in [
+            *self.calc_ratios_dict,
+            *self.summarize_ind_dict,
+            *self.hidden_ratios,
+            *calculated,
+        ]:
+            if ratio in RATIO_EXPRESSIONS and ratio not in names:
+                names.append(ratio)
+        return names
 
 
 class SharadarFundamentals(Fundamentals_ng):
@@ -878,21 +602,81 @@ class SharadarFundamentals(Fundamentals_ng):
         ("preferred_cfo_ratio", "desc"),
     ]
 
-    def __init__(self, database):
+    # Always fetched, whatever the profile
+    KEY_COLUMNS = [
+        "ticker",
+        "dimension",
+        "calendardate",
+        "datekey",
+        "reportperiod",
+        "lastupdated",
+    ]
+
+    def __init__(self, database, profile=None):
+        """
+        Args:
+            database: The Sharadar database, SF0 or SF1.
+            profile: The Profile of the blocks and ratios wanted, see
+                profiles.py, by default every one of them.
+        """
+        if profile is None:
+            profile = PROFILES["full"]
+        self.profile = profile
+        self.blocks = profile.blocks
+
+        # The statements not rendered only keep their datekey
+        statements = []
+        for block, ind_list in zip(
+            BLOCKS,
+            (
+                self.I_STMNT_IND,
+                self.CF_STMNT_IND,
+                self.BAL_STMNT_IND,
+                self.METRICS_AND_RATIOS_IND,
+            ),
+        ):
+            statements.append(ind_list if block in self.blocks else ind_list[:1])
+        calc_ratios = self.CALCULATED_RATIOS
+        if profile.ratios is not None:
+            descriptions = dict(self.CALCULATED_RATIOS)
+            calc_ratios = [(r, descriptions.get(r, r)) for r in profile.ratios]
+        if "calculated" not in self.blocks:
+            calc_ratios = []
+        summarize_ind = profile.summarize
+        if summarize_ind is None:
+            summarize_ind = self.SUMMARIZE_IND
+
         Fundamentals_ng.__init__(
-            self,
-            database,
-            self.I_STMNT_IND,
-            self.CF_STMNT_IND,
-            self.BAL_STMNT_IND,
-            self.METRICS_AND_RATIOS_IND,
-            self.CALCULATED_RATIOS,
-            self.SUMMARIZE_IND,
+            self, database, *statements, calc_ratios, summarize_ind
         )
+        self.hidden_ratios = [n for n in profile.needs if n in RATIO_EXPRESSIONS]
+        if not profile.all_columns:
+            self.fetch_columns = self._needed_columns(statements)
+
+    def _needed_columns(self, statements):
+        columns = list(self.KEY_COLUMNS)
+        needed = [code for ind_list in statements for code, _ in ind_list]
+        needed += ratio_inputs(self.ratio_names())
+        needed += [*self.summarize_ind_dict, *self.profile.needs]
+        for code in needed:
+            if code not in RATIO_EXPRESSIONS and code not in columns:
+                columns.append(code)
+        return columns
+
+
+# The inferred types of the object columns write_cells can write as numbers
+NUMBER_TYPES = ("empty", "floating", "integer", "mixed-integer-float")
 
 
 class Excel:
-    def __init__(self, outfile):
+    def __init__(self, outfile, use_pandas=False):
+        """
+        Args:
+            outfile: The name of the excel workbook to create.
+            use_pandas: Write the sheet blocks with DataFrame.to_excel rather
+                than directly with xlsxwriter, see write_cells.
+        """
+        self.use_pandas = use_pandas
         writer = pd.ExcelWriter(outfile, engine="xlsxwriter", date_format="d mmmm yyyy")
         self.writer = writer
         self.workbook = writer.book
@@ -914,18 +698,61 @@ class Excel:
     def save(self):
         self.writer.save()
 
+    def remove_sheet(self, sheetname):
+        """Removes a sheet, e.g. one left half written by a failure, so that
+        it isn't saved. Nothing is done if there is no such sheet.
+        """
+        worksheet = self.workbook.get_worksheet_by_name(sheetname)
+        if worksheet is None:
+            return
+        self.workbook.worksheets_objs.remove(worksheet)
+        del self.workbook.sheetnames[sheetname]
+        for index, sheet in enumerate(self.workbook.worksheets_objs):
+            sheet.index = index
+
+    def write_issues_sheet(self, issues_df):
+        """Writes the data quality issues, see validate.py, to an Issues sheet.
+        Nothing is written when there are none.
+        """
+        if len(issues_df) == 0:
+            return
+        issues_df.to_excel(self.writer, sheet_name="Issues", index=False)
+        sheet = self.writer.sheets["Issues"]
+        sheet.set_column(0, 3, 24)
+        sheet.set_column(4, 4, 16, self.format_commas_1dec)
+
     def add_summary_row(self, ticker, fund):
         """Accumulate summary values for a given ticker.
         Args:
         ticker: The ticker for the stock we are given data for.
         sum_ind_l: A list of (indicator,value) tuples for a given ticker
         """
-        sum_ind_l = self._summarized_indicators(fund, ticker)
+        self.add_summary_values(ticker, self.summarized_indicators(fund, ticker))
+
+    def add_summary_values(self, ticker, sum_ind_l):
+        """Accumulate summary values already obtained for a ticker, with
+        summarized_indicators.
+        Args:
+        ticker: The ticker for the stock we are given data for.
+        sum_ind_l: A list of (indicator,value) tuples for a given ticker
+        """
         self.summary_rows.append((ticker, sum_ind_l))
 
-    def write_summary_sheet(self, summarized_ind_dict):
+    def write_summary_sheet(self, summarized_ind_dict, peer_groups=None):
         """Writes the accumulated summary_values to the Summary sheet
+
+        Args:
+        summarized_ind_dict: The summarized indicators and their formatting.
+        peer_groups: An optional Series of each ticker's sector or industry.
+        The percentile of each indicator within the ticker's peer group is
+        added as an extra column, and the peer comparison written to a Peers
+        sheet.
         """
+        if peer_groups is not None:
+            summarized_ind_dict = self._add_peer_percentiles(
+                summarized_ind_dict, peer_groups
+            )
+
         # calculate the size of the table  we will need
         # this is using row,column indexing
         top_left = (0,0)
@@ -942,6 +769,35 @@ class Excel:
         self._data_to_summary_table(top_left, bottom_right, self.format_commas_1dec)
         self._format_table(top_left, bottom_right, summarized_ind_dict)
 
+    def _add_peer_percentiles(self, summarized_ind_dict, peer_groups):
+        """Writes the Peers sheet and adds the percentile columns to the
+        summary rows.
+
+        Returns:
+        The summarized indicators including the percentiles, which are
+        formatted as the indicators they rank.
+        """
+        latest = pd.DataFrame(
+            [dict(values) for _, values in self.summary_rows],
+            index=[ticker for ticker, _ in self.summary_rows],
+            columns=list(summarized_ind_dict),
+        )
+        stats = peer_statistics(latest, peer_groups)
+        stats.to_excel(self.writer, sheet_name="Peers", index_label="Ticker")
+
+        pctile_columns = [ind + "_pctile" for ind in summarized_ind_dict]
+        pctiles = stats[pctile_columns].astype(object)
+        pctiles = pctiles.where(pctiles.notna(), None)
+        self.summary_rows = [
+            (ticker, values + list(zip(pctile_columns, pctiles.loc[ticker])))
+            for ticker, values in self.summary_rows
+        ]
+
+        with_pctiles = collections.OrderedDict(summarized_ind_dict)
+        for ind, fmt in summarized_ind_dict.items():
+            with_pctiles[ind + "_pctile"] = fmt
+        return with_pctiles
+
     def _format_table(self, top_left, bottom_right, summarized_ind_dict):
         """ Will conditionally format each column of data.
         Hard coded with the simple 3_color_scale
@@ -1017,8 +873,13 @@ class Excel:
         # breakpoint()
         self.summary_sht.add_table(*top_left, *bottom_right, {"columns": dict_list})
 
+    @staticmethod
     def _latest_indicator_values(
-        self, ticker, indicators, calc_ratios_df, all_sharadar_inds_df
+        ticker,
+        indicators,
+        calc_ratios_df,
+        all_sharadar_inds_df,
+        current_values=None,
     ):
         """Obtains the latest values for a given list of indicators
 
@@ -1031,13 +892,17 @@ class Excel:
         calc_ratios_df: The calculated ratios dataframe.
         all_sharadar_inds_df: The dataframe containing the full table of
         results for a given dimension and ticker from Sharadar
+        current_values: An optional dict of indicator values taking precedence
+        over those in the dataframes.
 
         Returns:
         A list of Tuples of indicator, values pairs.
         """
         ind_val_l = []
         for indicator in indicators:
-            if indicator in calc_ratios_df.columns:
+            if current_values and indicator in current_values:
+                recent_ind_val = current_values[indicator]
+            elif indicator in calc_ratios_df.columns:
                 recent_ind_val = calc_ratios_df[indicator].tail(1).iloc[0]
             elif indicator in all_sharadar_inds_df.columns:
                 recent_ind_val = all_sharadar_inds_df[indicator].tail(1).iloc[0]
@@ -1048,15 +913,70 @@ class Excel:
 
         return ind_val_l
 
-    def _summarized_indicators(self, fund, stock):
+    @staticmethod
+    def summarized_indicators(fund, stock):
+        """Returns the (indicator, latest value) pairs of a stock's row on the
+        summary sheet.
+        """
         # unpack the indicators from the inds_to_summarize
         indicators = [*fund.summarize_ind_dict]
-        summarized = self._latest_indicator_values(
-            stock, indicators, fund.calc_ratios_df, fund.all_inds_df
+        summarized = Excel._latest_indicator_values(
+            stock,
+            indicators,
+            fund.calc_ratios_df,
+            fund.all_inds_df,
+            fund.current_values,
         )
         # need to add fmt  to the thing we pass return and deal wit it all the way downstream
         return summarized
 
+    def write_cells(self, dframe, row, col, sheetname, num_text_cols=2):
+        """Writes the cells of a block directly with xlsxwriter.
+
+        The cells written are those DataFrame.to_excel would write, without
+        a header or index, but without going through pandas' formatting of
+        each cell. Missing values are left empty and inf is written as the
+        string "inf", as pandas does. The columns are written one after the
+        other with write_column, again as pandas does, so that the shared
+        strings table is the same.
+
+        Args:
+            dframe: The block, with num_text_cols text columns followed by
+                numeric ones.
+            row: An int, the row to start writing at, zero based.
+            col: An int, the col to start writing at, zero based.
+            sheetname: The sheet, which is added if it doesn't exist.
+            num_text_cols: The number of text columns.
+        Returns:
+            False, having written nothing, if a numeric column holds values
+            which aren't numbers, else True.
+        """
+        values = dframe.iloc[:, num_text_cols:]
+        for _, column in values.items():
+            if column.dtype == object and infer_dtype(column) not in NUMBER_TYPES:
+                return False
+        numeric = values.to_numpy(dtype=np.float64, na_value=np.nan)
+
+        worksheet = self.workbook.get_worksheet_by_name(sheetname)
+        if worksheet is None:
+            worksheet = self.workbook.add_worksheet(sheetname)
+            # Else a later block written with to_excel would add it again
+            self.writer.sheets[sheetname] = worksheet
+
+        # None is written as an empty cell, which without a format is none
+        text = dframe.iloc[:, :num_text_cols].astype(object)
+        text = text.where(text.notna(), None).to_numpy()
+        cells = numeric.astype(object)
+        cells[np.isnan(numeric)] = None
+        cells[numeric == np.inf] = "inf"
+        cells[numeric == -np.inf] = "-inf"
+
+        for c in range(num_text_cols):
+            worksheet.write_column(row, col + c, text[:, c].tolist())
+        for c in range(cells.shape[1]):
+            worksheet.write_column(row, col + num_text_cols + c, cells[:, c].tolist())
+        return True
+
     def write_df(
         self, dframe, row, col, sheetname, dimension, use_header=True, num_text_cols=2
     ):
@@ -1079,24 +999,28 @@ class Excel:
         """
 
         # logging.debug("write_df_to_excel_sheet: dataframe = %s" % ( dframe.info()))
-        # We need to write out the df first using to_excel to obtain a
-        # worksheet object which we'll then operate on for formatting.
-        # We do not write the header using to_excel but explicitly write
+        # We write out the cells of the df first, with write_cells or, if it
+        # holds values which aren't numbers, to_excel, to obtain a worksheet
+        # object which we'll then operate on for formatting.
+        # We do not write the header with the cells but explicitly write
         # later with Xlsxwriter.
 
         if use_header is True:
             start_row = row + 1
         else:
             start_row = row
-        dframe.to_excel(
-            self.writer,
-            sheet_name=sheetname,
-            startcol=col,
-            startrow=start_row,
-            index=False,
-            header=False,
-        )
-        worksheet = self.writer.sheets[sheetname]
+        if self.use_pandas or not self.write_cells(
+            dframe, start_row, col, sheetname, num_text_cols
+        ):
+            dframe.to_excel(
+                self.writer,
+                sheet_name=sheetname,
+                startcol=col,
+                startrow=start_row,
+                index=False,
+                header=False,
+            )
+        worksheet = self.workbook.get_worksheet_by_name(sheetname)
         rows_written = len(dframe.index)
 
         num_cols = len(dframe.columns.values)
@@ -1164,6 +1088,19 @@ class Excel:
                 {"range": numeric_data_row_range, "markers": "True"},
             )
 
+        # The historical statistics of each row, following the sparklines
+        stats_col = spark_col + 1
+        stats_df = block_statistics(dframe, num_text_cols)
+        worksheet.set_column(stats_col, stats_col + len(STATISTICS) - 1, 12)
+        for offset, (stat, hdr) in enumerate(STATISTICS):
+            if use_header is True:
+                worksheet.write_string(row, stats_col + offset, hdr, self.format_bold)
+            for stat_row, value in enumerate(stats_df[stat], start_row):
+                if np.isfinite(value):
+                    worksheet.write_number(
+                        stat_row, stats_col + offset, value, self.format_commas_2dec
+                    )
+
         if use_header is True:
             for column, hdr in zip(
                 range(col, num_cols + col), dframe.columns.values.tolist()
@@ -1174,69 +1111,583 @@ class Excel:
         return rows_written
 
 
-def stock_xlsx(outfile, stocks, database, dimension, periods):
-
+def stock_xlsx(
+    outfile,
+    stocks,
+    database,
+    dimension,
+    periods,
+    checkpoint_dir=None,
+    resume=False,
+    workers=1,
+    compute_workers=None,
+    cache=None,
+    bulk_threshold=BULK_EXPORT_THRESHOLD,
+    sql_store=None,
+    screen=None,
+    prices=None,
+    peer_groups=None,
+    build_cache=None,
+    issues_file=None,
+    profile=None,
+    dead_letters=None,
+    breaker=None,
+):
+    """Writes a workbook with a sheet per stock and a summary sheet.
+
+    Fetching, calculating and writing are run as a pipeline, see
+    pipeline.run_pipeline. The sheets are always written in the order of
+    stocks, after normalize_tickers has removed blanks and duplicates.
+
+    Args:
+        outfile: The name of the excel workbook to create.
+        stocks: A list of ticker strings.
+        database: The Sharadar database, SF0 or SF1.
+        dimension: The Sharadar dimension e.g MRY, ARQ.
+        periods: An integer, the number of periods of results.
+        checkpoint_dir: Optional directory in which each ticker's results are
+            checkpointed as soon as they have been calculated. The checkpoints
+            are removed once the workbook has been saved.
+        resume: Reuse the checkpoints in checkpoint_dir from an earlier,
+            interrupted, run. Only the tickers without a checkpoint are fetched.
+        workers: The number of threads fetching indicators from Quandl.
+        compute_workers: The number of threads calculating ratios and
+            transposing statements. Defaults to the number of CPUs, at most
+            workers.
+        cache: An optional IndicatorCache shared with other builds.
+        bulk_threshold: When at least this many stocks need fetching their
+            indicators are obtained with a single bulk export rather than a
+            request per stock, see prefetch_bulk_export. None to never use
+            a bulk export.
+        sql_store: An optional SQLStore to which each stock's indicators and
+            calculated ratios are added, for querying later.
+        screen: An optional expression over the indicators and calculated
+            ratios, see screen.screen_stocks. Sheets are only written for the
+            stocks whose latest values pass the screen, the summary sheet
+            still has a row for every stock.
+        prices: An optional prices dataframe, see prices.py. Each filing is
+            also valued at the price as of its datekey and the summary sheet
+            has the valuations at the latest price.
+        peer_groups: An optional Series of the sector or industry of each
+            stock, see peers.py. The summary sheet then also ranks each
+            indicator within the stock's peer group, with the group medians
+            and z-scores on a Peers sheet.
+        build_cache: An optional BuildCache, see incremental.py. The ratios
+            and sheet blocks of the stocks whose fetched data hasn't changed
+            since the last build are reused rather than recalculated.
+        issues_file: An optional CSV file to which the data quality issues
+            are written, see validate.py. They are also written to an Issues
+            sheet.
+        profile: An optional Profile, see profiles.py, of the blocks and
+            ratios wanted. Only the SF1 columns they need are fetched, only
+            their ratios calculated and only their blocks rendered. By
+            default every block and ratio.
+        dead_letters: An optional DeadLetters, see resilience.py. A stock
+            whose fetch, calculation or writing fails is then recorded in it
+            and left out of the workbook, rather than the failure ending the
+            build.
+            A failed bulk export falls back to fetching the stocks one at a
+            time.
+        breaker: An optional CircuitBreaker through which the indicators are
+            fetched, pausing the fetches while the error rate is high.
+    """
+    stocks = normalize_tickers(stocks)
+    if profile is None:
+        profile = PROFILES["full"]
+    if screen is not None:
+        check_screen(screen)
+        profile = profile.needing(screen_names(screen))
+    if prices is not None:
+        # Read by asof_valuations and current_valuations
+        profile = profile.needing(
+            ratio_inputs(VALUATION_RATIOS) + ["price", "ev", "shareswa"]
+        )
     excel = Excel(outfile)
 
-    # Get a stmnt dataframe, a quandl ratios dataframe and our calculated ratios dataframe
-    # for each of these frames write into a separate worksheet per stock
-    for stock in stocks:
-        fund = SharadarFundamentals(database)
-
-        logger.info("Processing the stock %s", stock)
-
-        shtname = "{}".format(stock)
+    summarize_ind = list(profile.summarize or SharadarFundamentals.SUMMARIZE_IND)
+    if prices is not None:
+        empty_prices = prices.iloc[:0]
+        prices = group_prices(prices)
+        summarize_ind += CURRENT_SUMMARIZE_IND
 
+    store = None
+    if checkpoint_dir is not None:
+        store = CheckpointStore(
+            checkpoint_dir, database, dimension, periods, profile
+        )
+        store.open(resume)
+
+    to_fetch = stocks
+    if store is not None:
+        to_fetch = [s for s in stocks if not store.is_complete(s)]
+    if bulk_threshold is not None and len(to_fetch) >= bulk_threshold:
+        if cache is None:
+            cache = IndicatorCache()
         try:
-            fund.get_indicators(stock, dimension, periods)
-        except NotFoundError:
+            prefetch_bulk_export(to_fetch, database, dimension, periods, cache, profile)
+        except Exception as exc:
+            if dead_letters is None:
+                raise
             logger.warning(
-                "NotFoundError when getting indicators for the stock %s", stock
+                "The bulk export failed, fetching the stocks one at a time: %s", exc
             )
-            continue
 
-        # Now calculate some of the additional ratios for credit analysis
-        fund.calc_ratios()
+    if compute_workers is None:
+        compute_workers = min(workers, os.cpu_count() or 1)
 
-        row, col = 0, 0
+    # With a screen the sheets are written once every stock has been screened
+    screened = []
+    issues = []
 
-        i_stmnt_trans_df = fund.get_transposed_and_formatted_i_stmnt()
-        rows_written = excel.write_df(
-            i_stmnt_trans_df, row, col, shtname, dimension, use_header=True
-        )
-        row = row + rows_written + 1
+    def fetch(stock):
+        try:
+            return load_fundamentals(
+                stock,
+                database,
+                dimension,
+                periods,
+                store=store,
+                cache=cache,
+                profile=profile,
+                breaker=breaker,
+            )
+        except Exception as exc:
+            if dead_letters is None:
+                raise
+            dead_letters.add(stock, "fetch", exc)
+            return None
+
+    def compute(stock, fund):
+        if fund is None:
+            return None
+        try:
+            return compute_stock(stock, fund)
+        except Exception as exc:
+            if dead_letters is None:
+                raise
+            dead_letters.add(stock, "compute", exc)
+            return None
+
+    def compute_stock(stock, fund):
+        stock_prices = None if prices is None else prices.get(stock, empty_prices)
+
+        if build_cache is not None:
+            content_hash = build_cache.content_hash(fund.all_inds_df, stock_prices)
+            previous = build_cache.load(stock, content_hash)
+            if previous is not None:
+                restore_build(fund, previous, stock_prices is not None)
+                blocks = previous["blocks"]
+                if blocks is None and screen is None:
+                    blocks = stock_blocks(fund)
+                return fund, blocks
+
+        if fund.calc_ratios_df is None:
+            # Now calculate some of the additional ratios for credit analysis
+            calc_fund_ratios(stock, fund, cache=cache)
+            if store is not None:
+                store.save(stock, fund)
+        if stock_prices is not None:
+            add_valuations(fund, stock_prices)
+        blocks = None
+        if screen is None:
+            with tracing.span("render", stock):
+                blocks = stock_blocks(fund)
+        if build_cache is not None:
+            build_cache.save(stock, content_hash, fund, blocks)
+        return fund, blocks
+
+    def write(stock, computed):
+        if computed is None:
+            return
+        try:
+            write_stock(stock, computed)
+        except Exception as exc:
+            if dead_letters is None:
+                raise
+            dead_letters.add(stock, "write", exc)
+
+    def write_stock(stock, computed):
+        fund, blocks = computed
+        # Whatever can fail is done before the stock is added anywhere, and
+        # its sheet removed again if it can't be added to the SQL store, so
+        # that a failed stock leaves nothing behind
+        issues_df = fund.issues_df if fund.issues_df is not None else fund.validate()
+        summary = excel.summarized_indicators(fund, stock)
+        if screen is None:
+            with tracing.span("write", stock):
+                write_stock_sheet(excel, stock, blocks, dimension)
+        if sql_store is not None:
+            try:
+                sql_store.add_fund(fund)
+            except Exception:
+                excel.remove_sheet(stock)
+                raise
+        if screen is not None:
+            screened.append((stock, fund, blocks))
+        excel.add_summary_values(stock, summary)
+        issues.append(issues_df)
+        logger.info("Processed the stock %s", stock)
 
-        cf_stmnt_trans_df = fund.get_transposed_and_formatted_cf_stmnt()
-        rows_written = excel.write_df(
-            cf_stmnt_trans_df, row, col, shtname, dimension, use_header=True
+    def write_screened(stock, fund, blocks):
+        try:
+            if blocks is None:
+                with tracing.span("render", stock):
+                    blocks = stock_blocks(fund)
+            with tracing.span("write", stock):
+                write_stock_sheet(excel, stock, blocks, dimension)
+        except Exception as exc:
+            if dead_letters is None:
+                raise
+            dead_letters.add(stock, "write", exc)
+
+    run_pipeline(
+        stocks,
+        fetch,
+        compute,
+        write,
+        fetch_workers=workers,
+        compute_workers=compute_workers,
+    )
+
+    if screen is not None:
+        funds = [(stock, fund) for stock, fund, _ in screened]
+        survivors = set(screen_stocks(latest_values(funds), screen))
+        for stock, fund, blocks in screened:
+            if stock in survivors:
+                write_screened(stock, fund, blocks)
+
+    if build_cache is not None:
+        logger.info(
+            "Reused the last build of %d stocks, rebuilt %d",
+            build_cache.hits,
+            build_cache.misses,
         )
-        row = row + rows_written + 1
 
-        bal_stmnt_trans_df = fund.get_transposed_and_formatted_bal_stmnt()
-        rows_written = excel.write_df(
-            bal_stmnt_trans_df, row, col, shtname, dimension, use_header=True
-        )
-        row = row + rows_written + 1
+    excel.write_summary_sheet(collections.OrderedDict(summarize_ind), peer_groups)
+    issues_df = concat_issues(issues)
+    log_issues(issues_df)
+    excel.write_issues_sheet(issues_df)
+    if issues_file is not None:
+        write_issues(issues_df, issues_file)
+    excel.save()
 
-        # Now for the metrics and ratios from the quandl API
-        metrics_and_ratios_trans_df = (
-            fund.get_transposed_and_formatted_metrics_and_ratios()
+    if store is not None:
+        store.remove()
+
+
+def load_fundamentals(
+    stock,
+    database,
+    dimension,
+    periods,
+    store=None,
+    cache=None,
+    profile=None,
+    breaker=None,
+):
+    """Obtains the indicators for a stock, from a checkpoint, cache or Quandl.
+
+    Args:
+        stock: The ticker.
+        database: The Sharadar database, SF0 or SF1.
+        dimension: The Sharadar dimension e.g MRY, ARQ.
+        periods: An integer, the number of periods of results.
+        store: An optional CheckpointStore. A checkpointed stock also has its
+            calculated ratios restored.
+        cache: An optional IndicatorCache of fetched indicators.
+        profile: An optional Profile, see profiles.py, of the indicators
+            fetched and the ratios calculated.
+        breaker: An optional CircuitBreaker, see resilience.py, through
+            which the indicators are fetched from Quandl.
+    Returns:
+        A SharadarFundamentals with its indicators populated, or None if the
+        stock is not supported.
+    """
+    fund = SharadarFundamentals(database, profile)
+    logger.info("Processing the stock %s", stock)
+
+    if store is not None and store.is_complete(stock):
+        checkpoint = store.load(stock)
+        if checkpoint is None:
+            logger.warning("Skipping the unsupported stock %s", stock)
+            return None
+        sf1_df, calc_ratios_df, issues_df = checkpoint
+        fund.set_indicators(sf1_df, dimension, periods)
+        fund.calc_ratios_df = calc_ratios_df
+        fund.issues_df = issues_df
+        return fund
+
+    def get_indicators():
+        if breaker is None:
+            return fund.get_indicators(stock, dimension, periods)
+        return breaker.call(fund.get_indicators, stock, dimension, periods)
+
+    try:
+        if cache is None:
+            get_indicators()
+        else:
+            sf1_df = cache.get(
+                indicators_key(stock, dimension, periods, database, profile),
+                get_indicators,
+            )
+            fund.set_indicators(sf1_df.copy(), dimension, periods)
+    except NotFoundError:
+        logger.warning("NotFoundError when getting indicators for the stock %s", stock)
+        if store is not None:
+            store.save_not_found(stock)
+        return None
+    return fund
+
+
+def restore_build(fund, previous, with_prices):
+    """Restores the calculated ratios, issues and summarized values of a
+    stock from a BuildCache entry.
+    """
+    fund.calc_ratios_df = previous["calc_ratios_df"]
+    fund.issues_df = previous["issues_df"]
+    fund.current_values = previous["current_values"]
+    if with_prices:
+        fund.calc_ratios_dict.update(ASOF_RATIOS)
+        fund.summarize_ind_dict.update(CURRENT_SUMMARIZE_IND)
+
+
+def add_valuations(fund, prices_df):
+    """Adds the valuations of a stock's filings at daily prices.
+
+    The valuations as of each filing's datekey are added to the calculated
+    ratios and those at the latest price to the summarized values.
+
+    Args:
+        fund: A SharadarFundamentals with its ratios calculated.
+        prices_df: A prices dataframe for the stock, see prices.py.
+    """
+    valuations = asof_valuations(fund.all_inds_df, prices_df)
+    current = current_valuations(fund.all_inds_df, prices_df)
+
+    # As for calc_ratios, nan and inf become None
+    valuations = valuations.replace([np.inf, -np.inf], np.nan)
+    valuations = valuations.astype(object).where(valuations.notna(), None)
+    fund.calc_ratios_df = pd.concat([fund.calc_ratios_df, valuations], axis=1)
+    fund.calc_ratios_dict.update(ASOF_RATIOS)
+
+    fund.summarize_ind_dict.update(CURRENT_SUMMARIZE_IND)
+    for ratio, _ in CURRENT_SUMMARIZE_IND:
+        value = current[ratio].iloc[0] if len(current) else None
+        if value is not None and not np.isfinite(value):
+            value = None
+        fund.current_values[ratio] = value
+
+
+def indicators_key(stock, dimension, periods, database, profile=None):
+    """Returns the cache key of a stock's fetched indicators.
+
+    A profile fetching only some of the columns has its name added, so its
+    indicators aren't used for a build needing other columns.
+    """
+    key = (stock, dimension, periods, database)
+    if profile is not None and not profile.all_columns:
+        key += (profile.name,)
+    return key
+
+
+def latest_periods(all_inds_df, periods):
+    """Sorts SF1 indicators with the earliest dates at the top, keeping only
+    the most recent periods rows.
+    """
+    return all_inds_df.sort_values("datekey").tail(periods)
+
+
+def export_indicators(stocks, database, dimension, periods):
+    """Obtains the indicators of many stocks with a bulk export.
+
+    Yields:
+        (stock, dataframe) pairs, the dataframes being as returned by
+        get_indicators. Stocks missing from the export are not yielded.
+    """
+    # Sets the Quandl API key for the database
+    SharadarFundamentals(database)
+    for stock, sf1_df in bulk_export(stocks, dimension):
+        yield stock, latest_periods(sf1_df, periods)
+
+
+def prefetch_bulk_export(stocks, database, dimension, periods, cache, profile=None):
+    """Fills the cache with the indicators of stocks from a bulk export.
+
+    Stocks missing from the export are left out of the cache, so that
+    load_fundamentals falls back to fetching them one at a time. They are
+    cached for the stocks being loaded with profile.
+
+    Returns:
+        The number of stocks cached.
+    """
+    cached = 0
+    with tracing.span("bulk_export", stocks=len(stocks)) as span:
+        for stock, sf1_df in export_indicators(stocks, database, dimension, periods):
+            key = indicators_key(stock, dimension, periods, database, profile)
+            cache.put(key, sf1_df)
+            cached += 1
+        span.set(cached=cached)
+    logger.info("Prefetched %d of %d stocks with a bulk export", cached, len(stocks))
+    return cached
+
+
+def calc_fund_ratios(stock, fund, cache=None):
+    """Calculates the ratios for a stock, reusing those in the cache if present.
+
+    The ratios and the issues found calculating them are cached under the
+    key of the stock's indicators, see indicators_key, with "ratios"
+    appended.
+    """
+
+    def calc_ratios():
+        return fund.calc_ratios(), fund.issues_df
+
+    with tracing.span("ratios", stock):
+        if cache is None:
+            fund.calc_ratios()
+            return
+        key = indicators_key(
+            stock, fund.dimension, fund.periods, fund.database, fund.profile
         )
-        rows_written = excel.write_df(
-            metrics_and_ratios_trans_df, row, col, shtname, dimension, use_header=True
+        key += ("ratios",)
+        calc_ratios_df, fund.issues_df = cache.get(key, calc_ratios)
+        fund.calc_ratios_df = calc_ratios_df.copy()
+
+
+def normalize_tickers(tickers):
+    """Normalizes a list of tickers, preserving the order they first appear in.
+
+    Surrounding whitespace is stripped and tickers are upper cased. Blank
+    entries and repeats of a ticker are dropped, e.g. when a ticker file is
+    the concatenation of several watchlists. Anything after a # is a
+    comment, e.g. the reason a dead lettered ticker failed.
+
+    Returns:
+        A list of unique tickers.
+    """
+    seen = set()
+    normalized = []
+    for ticker in tickers:
+        ticker = ticker.split("#", 1)[0].strip().upper()
+        if ticker and ticker not in seen:
+            seen.add(ticker)
+            normalized.append(ticker)
+    return normalized
+
+
+def fundamentals_frame(
+    stocks,
+    database,
+    dimension,
+    periods,
+    workers=1,
+    cache=None,
+    bulk_threshold=BULK_EXPORT_THRESHOLD,
+    prices=None,
+    compact=False,
+):
+    """Obtains the indicators and calculated ratios for a list of stocks.
+
+    Args:
+        prices: An optional prices dataframe, see prices.py. The valuations
+            of each filing as of its datekey are added, from a single as-of
+            merge over every stock.
+        compact: Return the frame in the compact form of compact.py, with
+            float32 values, categorical tickers and int32 day dates.
+    Returns:
+        A dataframe with a row per stock and period holding the Sharadar
+        indicators followed by the calculated ratios.
+    """
+    stocks = normalize_tickers(stocks)
+    frames = []
+
+    if bulk_threshold is not None and len(stocks) >= bulk_threshold:
+        if cache is None:
+            cache = IndicatorCache()
+        prefetch_bulk_export(stocks, database, dimension, periods, cache)
+
+    def compute(stock, fund):
+        if fund is None:
+            return None
+        calc_fund_ratios(stock, fund, cache=cache)
+        return pd.concat(
+            [fund.all_inds_df, fund.calc_ratios_df.drop(columns="datekey")], axis=1
         )
-        row = row + rows_written + 2
 
-        calculated_ratios_df = fund.get_transposed_and_formatted_calculated_ratios()
-        rows_written = excel.write_df(
-            calculated_ratios_df, row, col, shtname, dimension
-        )
+    def write(stock, frame):
+        if frame is not None:
+            frames.append(frame)
 
-        excel.add_summary_row(stock, fund)
-        logger.info("Processed the stock %s", stock)
+    run_pipeline(
+        stocks,
+        lambda stock: load_fundamentals(
+            stock, database, dimension, periods, cache=cache
+        ),
+        compute,
+        write,
+        fetch_workers=workers,
+        compute_workers=min(workers, os.cpu_count() or 1),
+    )
+    if not frames:
+        return pd.DataFrame()
+    frame = pd.concat(frames, ignore_index=True)
+    if prices is not None:
+        frame = pd.concat([frame, asof_valuations(frame, prices)], axis=1)
+    if compact:
+        frame = compact_frame(frame)
+    return frame
+
+
+def stock_blocks(fund):
+    """Transposes and formats the blocks making up the sheet for a stock.
+
+    Args:
+        fund: A SharadarFundamentals with indicators and ratios populated.
+    Returns:
+        A list of (dataframe, use_header, blank_rows_after) tuples in the order
+        they appear on the sheet, for the blocks of the fund's profile.
+    """
+    blocks = [
+        ("income", fund.get_transposed_and_formatted_i_stmnt, 1),
+        ("cash_flow", fund.get_transposed_and_formatted_cf_stmnt, 1),
+        ("balance", fund.get_transposed_and_formatted_bal_stmnt, 1),
+        # Now for the metrics and ratios from the quandl API
+        ("metrics", fund.get_transposed_and_formatted_metrics_and_ratios, 2),
+        ("calculated", fund.get_transposed_and_formatted_calculated_ratios, 0),
+    ]
+    # Only those of the fund's profile
+    return [
+        (transposed(), True, blank_rows_after)
+        for block, transposed, blank_rows_after in blocks
+        if block in fund.blocks
+    ]
 
-    excel.write_summary_sheet(fund.summarize_ind_dict)
-    excel.save()
+
+def write_stock_sheet(excel, stock, blocks, dimension):
+    """Writes the statement, metrics and calculated ratio blocks of a stock
+    to its own worksheet.
+
+    Should a block fail to be written the sheet is removed, rather than
+    left half written, before the exception is raised.
+
+    Args:
+        excel: The Excel workbook to write to.
+        stock: The ticker, used as the sheet name.
+        blocks: The blocks to write, as returned by stock_blocks.
+        dimension: The Sharadar dimension of the data.
+    """
+    shtname = "{}".format(stock)
+    row, col = 0, 0
+
+    try:
+        for block_df, use_header, blank_rows_after in blocks:
+            rows_written = excel.write_df(
+                block_df, row, col, shtname, dimension, use_header=use_header
+            )
+            row = row + rows_written + blank_rows_after
+    except Exception:
+        excel.remove_sheet(shtname)
+        raise
 
 
 def main():
@@ -0,0 +1,111 @@
+"""Reuse of the previous build's results for the tickers which haven't changed.
+
+A nightly build of a large ticker list mostly refetches data which hasn't
+changed since the night before. The BuildCache keeps, for each ticker, a
+hash of the inputs of the last build along with the ratios calculated and
+the sheet blocks rendered from them. When a ticker's fetched rows hash to
+the same value the ratios and blocks are reused, so that only the tickers
+with new filings have their ratios recalculated and their sheets rendered.
+
+The hash covers the SF1 rows, any daily prices, the database, dimension
+and number of periods, any profile, and the ratio definitions, so a change
+to any of these is a change of input.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import hashlib
+import logging
+import os
+import pathlib
+import threading
+
+import pandas as pd
+
+from .ratios import RATIO_EXPRESSIONS
+
+logger = logging.getLogger(__name__)
+
+# Bump when the rendering of the blocks changes, invalidating every entry
+CACHE_VERSION = 3
+
+
+def _hash_frame(digest, frame):
+    digest.update(repr(list(frame.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+
+
+class BuildCache(object):
+    """A directory holding the last build's results of each ticker."""
+
+    SUFFIX = ".pkl"
+
+    def __init__(self, directory, database, dimension, periods, profile=None):
+        self.path = pathlib.Path(directory) / dimension
+        self.params = (CACHE_VERSION, database, dimension, int(periods))
+        if profile is not None and not profile.all_columns:
+            # The blocks saved are those of the profile
+            self.params += (repr(profile),)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def content_hash(self, sf1_df, prices_df=None):
+        """Returns the hash of a ticker's inputs to the build."""
+        digest = hashlib.sha256(repr(self.params).encode())
+        digest.update(repr(list(RATIO_EXPRESSIONS.items())).encode())
+        _hash_frame(digest, sf1_df)
+        if prices_df is not None:
+            _hash_frame(digest, prices_df)
+        return digest.hexdigest()
+
+    def load(self, ticker, content_hash):
+        """Returns the entry saved for ticker if its inputs are unchanged.
+
+        Returns:
+            A dict with the calc_ratios_df, issues_df, current_values and
+            blocks saved by the last build, or None when the inputs have changed or the
+            ticker wasn't built before.
+        """
+        path = self._ticker_path(ticker)
+        entry = None
+        if path.exists():
+            try:
+                entry = pd.read_pickle(path)
+            except Exception:
+                logger.warning("Ignoring the unreadable build cache of %s", ticker)
+        unchanged = entry is not None and entry["hash"] == content_hash
+        with self._lock:
+            if unchanged:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry if unchanged else None
+
+    def save(self, ticker, content_hash, fund, blocks):
+        """Saves the results of building a ticker.
+
+        Args:
+            ticker: The ticker.
+            content_hash: The hash of its inputs, from content_hash.
+            fund: The SharadarFundamentals with its ratios calculated.
+            blocks: The blocks of its sheet, as returned by stock_blocks, or
+                None if they weren't rendered.
+        """
+        entry = {
+            "hash": content_hash,
+            "calc_ratios_df": fund.calc_ratios_df,
+            "issues_df": fund.issues_df,
+            "current_values": fund.current_values,
+            "blocks": blocks,
+        }
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self._ticker_path(ticker)
+        tmp_path = path.with_name(path.name + ".tmp")
+        pd.to_pickle(entry, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _ticker_path(self, ticker):
+        safe = ticker.replace(os.sep, "_")
+        return self.path / (safe + self.SUFFIX)
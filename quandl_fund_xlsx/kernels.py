@@ -0,0 +1,194 @@
+"""Single pass evaluation of the ratio expressions over large arrays.
+
+Evaluating an expression such as ``(debt - cashnequsd) / (ebitda + capex)``
+with numpy over a whole panel allocates a full size temporary array for each
+operation. The backends here evaluate each ratio in one pass over its
+indicators instead, with the ratios it refers to inlined, so that only the
+result is allocated:
+
+    numexpr  numexpr.evaluate, blocked and multi-threaded
+    numba    a loop over the rows compiled by numba.njit for each ratio
+    numpy    numpy evaluated over blocks of BLOCK_ROWS rows, so that the
+             temporaries are only block sized
+
+numexpr and numba are optional, select_backend uses the first of them which
+is installed, falling back to numpy. Ratios using pct_change, which looks
+across rows, are always evaluated by ratios.evaluate_ratio.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import ast
+import collections
+import logging
+
+import numpy as np
+
+from .ratios import RATIO_EXPRESSIONS, evaluate_ratio, expression_source
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("numexpr", "numba", "numpy")
+
+BLOCK_ROWS = 1 << 16
+
+_inlined = {}
+_numba_kernels = {}
+
+
+def available_backends():
+    """Returns the backends which can be used, in order of preference."""
+    installed = {"numexpr": numexpr, "numba": numba, "numpy": np}
+    return [b for b in BACKENDS if installed[b] is not None]
+
+
+def select_backend(backend=None):
+    """Returns the backend to use, the preferred one when backend is None.
+
+    Raises:
+        ValueError: backend is unknown or not installed.
+    """
+    available = available_backends()
+    if backend is None:
+        return available[0]
+    if backend not in BACKENDS:
+        raise ValueError(
+            "The ratio backend must be one of %s, not %s"
+            % (", ".join(BACKENDS), backend)
+        )
+    if backend not in available:
+        raise ValueError("The %s ratio backend is not installed" % backend)
+    return backend
+
+
+class _Inline(ast.NodeTransformer):
+    def visit_Call(self, node):
+        raise _UsesPctChange()
+
+    def visit_Name(self, node):
+        if node.id in RATIO_EXPRESSIONS:
+            return _inline_tree(node.id).body
+        return node
+
+
+class _UsesPctChange(Exception):
+    pass
+
+
+def _inline_tree(ratio):
+    tree = ast.parse(RATIO_EXPRESSIONS[ratio], mode="eval")
+    return _Inline().visit(tree)
+
+
+def inline_expression(ratio):
+    """Returns a ratio's expression with the ratios it refers to replaced by
+    their own expressions, or None if it uses pct_change.
+    """
+    if ratio not in _inlined:
+        try:
+            _inlined[ratio] = expression_source(_inline_tree(ratio))
+        except _UsesPctChange:
+            _inlined[ratio] = None
+    return _inlined[ratio]
+
+
+def expression_inputs(expression):
+    """Returns the indicator codes an inlined expression reads, in order."""
+    names = []
+    for node in ast.walk(ast.parse(expression, mode="eval")):
+        if isinstance(node, ast.Name) and node.id not in names:
+            names.append(node.id)
+    return names
+
+
+def _numba_kernel(expression):
+    kernel = _numba_kernels.get(expression)
+    if kernel is None:
+        inputs = expression_inputs(expression)
+        # Each input indexed by the row
+        body = expression_source(ast.parse(expression, mode="eval"), "%s[i]")
+        source = (
+            "def kernel(out, %s):\n"
+            "    for i in range(out.shape[0]):\n"
+            "        out[i] = %s\n" % (", ".join(inputs), body)
+        )
+        namespace = {}
+        exec(compile(source, "<%s>" % expression, "exec"), namespace)
+        # error_model numpy gives inf or nan rather than raising on division
+        # by zero
+        kernel = numba.njit(error_model="numpy", nogil=True)(namespace["kernel"])
+        _numba_kernels[expression] = kernel
+    return kernel
+
+
+def _evaluate_numpy(expression, arrays, out):
+    code = compile(expression, expression, "eval")
+    for start in range(0, len(out), BLOCK_ROWS):
+        block = slice(start, start + BLOCK_ROWS)
+        namespace = {name: values[block] for name, values in arrays.items()}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[block] = eval(code, {"__builtins__": {}}, namespace)
+
+
+def evaluate_kernel(ratio, indicators, backend):
+    """Evaluates one ratio in a single pass over its indicators.
+
+    Args:
+        ratio: The name of a ratio in RATIO_EXPRESSIONS not using pct_change.
+        indicators: A mapping of indicator codes to float64 arrays.
+        backend: One of BACKENDS.
+    Returns:
+        A float64 array.
+    """
+    expression = inline_expression(ratio)
+    arrays = {
+        name: np.asarray(indicators[name], dtype=np.float64)
+        for name in expression_inputs(expression)
+    }
+    out = np.empty(len(next(iter(arrays.values()))), dtype=np.float64)
+    if backend == "numexpr":
+        numexpr.evaluate(expression, local_dict=arrays, out=out)
+    elif backend == "numba":
+        _numba_kernel(expression)(out, *arrays.values())
+    else:
+        _evaluate_numpy(expression, arrays, out)
+    return out
+
+
+def evaluate_ratios_compiled(
+    ratios, indicators, group_starts=None, backend=None, previous=None
+):
+    """As ratios.evaluate_ratios, evaluating each ratio with a backend.
+
+    Args:
+        ratios: The ratio names, in the order they are to be evaluated.
+        indicators: A mapping of indicator codes to float64 arrays.
+        group_starts: For arrays holding several tickers, the index at which
+            each ticker's rows start.
+        backend: One of BACKENDS, by default as chosen by select_backend.
+        previous: The row pct_change compares each row with, as for
+            ratios.evaluate_ratio.
+    Returns:
+        An ordered dict of ratio name to array.
+    """
+    backend = select_backend(backend)
+    results = collections.OrderedDict()
+    for ratio in ratios:
+        if inline_expression(ratio) is None:
+            results[ratio] = evaluate_ratio(
+                ratio, indicators, results, group_starts, previous
+            )
+        else:
+            results[ratio] = evaluate_kernel(ratio, indicators, backend)
+    return results
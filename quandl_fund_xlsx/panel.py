@@ -0,0 +1,550 @@
+"""A memory-mapped, on-disk panel of Sharadar indicators for many tickers.
+
+Backtests load the same universe of fundamentals over and over. A panel
+stores the frames returned by get_indicators for a whole universe as one
+fixed-width float64 file per indicator, with the rows sorted by ticker and
+then datekey. Opening a panel maps those files with numpy.memmap, so loading
+costs next to nothing whatever the size of the universe, and the ratio
+calculations and summary extraction run vectorized over the mapped arrays.
+
+A panel directory holds::
+
+    meta.json        the tickers, indicator names, row count and dimension
+    offsets.i8       the first row of each ticker, plus the total row count
+    <date>.i8        datekey, calendardate, ... as int64 nanoseconds
+    <indicator>.f8   one float64 per row
+
+compact_panel converts a panel in place to the compact form of compact.py,
+storing the indicators which fit as float32 ``<indicator>.f4`` files and the
+dates as int32 day counts in ``<date>.d4`` files, roughly halving its size.
+Reading a compact panel returns float64 values and datetime64[ns] dates as
+before, so ratios calculated from it are within compact.RATIO_RTOL of those
+calculated from the float64 panel.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import collections.abc
+import json
+import logging
+import os
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from .analytics import STATISTICS, grouped_statistics
+from .asof import previous_periods
+from .compact import DAYS_DTYPE, FLOAT32_RTOL, fits_float32, from_days, to_days
+from .export import BULK_EXPORT_THRESHOLD
+from .fundamentals import SharadarFundamentals, export_indicators, load_fundamentals
+from .pipeline import run_pipeline
+from .kernels import evaluate_ratios_compiled
+from .ratios import RATIO_EXPRESSIONS, with_dependencies
+from .validate import (
+    concat_issues,
+    mask_ratios,
+    period_issues,
+    ratio_issues,
+    restatement_issues,
+)
+
+logger = logging.getLogger(__name__)
+
+META = "meta.json"
+OFFSETS = "offsets.i8"
+VALUE_DTYPE = np.dtype("<f8")
+DATE_DTYPE = np.dtype("<i8")
+COMPACT_DTYPE = np.dtype("<f4")
+
+# The file suffix of each dtype a column may be stored as
+SUFFIXES = {"f8": VALUE_DTYPE, "f4": COMPACT_DTYPE, "i8": DATE_DTYPE, "d4": DAYS_DTYPE}
+
+# The SF1 columns which are dates, stored as int64 nanoseconds since the epoch.
+DATE_COLUMNS = ("datekey", "calendardate", "reportperiod", "lastupdated")
+
+# Columns which are the same for every row of a ticker and are not stored.
+LABEL_COLUMNS = ("ticker", "dimension")
+
+
+class PanelWriter(object):
+    """Writes a panel one ticker at a time, appending to each column file.
+
+    Only the frame being added is held in memory, so building a panel for a
+    large universe uses the same memory as building one for a single ticker.
+    The columns are fixed by the first frame added.
+    """
+
+    def __init__(self, path, dimension=None):
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dimension = dimension
+        self.tickers = []
+        self.offsets = [0]
+        self.date_columns = None
+        self.columns = None
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, ticker, frame):
+        """Appends the rows for one ticker.
+
+        Args:
+            ticker: The ticker.
+            frame: A dataframe as returned by get_indicators.
+        """
+        if ticker in self.tickers:
+            raise ValueError("The ticker %s is already in the panel" % ticker)
+        if self.columns is None:
+            self.date_columns = [c for c in DATE_COLUMNS if c in frame.columns]
+            self.columns = [
+                c
+                for c in frame.columns
+                if c not in DATE_COLUMNS
+                and c not in LABEL_COLUMNS
+                and pd.api.types.is_numeric_dtype(frame[c])
+            ]
+            for name in self.date_columns:
+                self._files[name] = open(self.path / (name + ".i8"), "wb")
+            for name in self.columns:
+                self._files[name] = open(self.path / (name + ".f8"), "wb")
+
+        frame = frame.sort_values("datekey")
+        for name in self.date_columns:
+            values = pd.to_datetime(frame[name]).to_numpy(dtype="datetime64[ns]")
+            self._files[name].write(values.view(DATE_DTYPE).tobytes())
+        for name in self.columns:
+            if name in frame.columns:
+                values = frame[name].to_numpy(dtype=VALUE_DTYPE, na_value=np.nan)
+            else:
+                values = np.full(len(frame), np.nan, dtype=VALUE_DTYPE)
+            self._files[name].write(values.tobytes())
+
+        self.tickers.append(ticker)
+        self.offsets.append(self.offsets[-1] + len(frame))
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        np.asarray(self.offsets, dtype=DATE_DTYPE).tofile(str(self.path / OFFSETS))
+        meta = {
+            "version": 1,
+            "dimension": self.dimension,
+            "nrows": self.offsets[-1],
+            "tickers": self.tickers,
+            "date_columns": self.date_columns or [],
+            "columns": self.columns or [],
+        }
+        tmp_path = self.path / (META + ".tmp")
+        with open(tmp_path, "w") as m_file:
+            json.dump(meta, m_file)
+        os.replace(tmp_path, self.path / META)
+
+
+class Panel(object):
+    """A read-only panel of indicators for a universe of tickers.
+
+    Indexing a panel by an indicator code returns a memory-mapped float64
+    array with one value per row. The rows of a ticker are contiguous and
+    sorted by datekey, rows(ticker) gives their slice.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        with open(self.path / META) as m_file:
+            meta = json.load(m_file)
+        self.dimension = meta["dimension"]
+        self.nrows = meta["nrows"]
+        self.tickers = meta["tickers"]
+        self.columns = meta["columns"]
+        self.date_columns = meta["date_columns"]
+        # Panels written before compact_panel existed have neither key
+        self.dtypes = meta.get("dtypes", {})
+        self.date_unit = meta.get("date_unit", "ns")
+        self.offsets = self._map(OFFSETS, DATE_DTYPE, len(self.tickers) + 1)
+        self._ticker_index = {t: i for i, t in enumerate(self.tickers)}
+        self._arrays = {}
+        self._previous_rows = None
+
+    @classmethod
+    def open(cls, path):
+        return cls(path)
+
+    def __len__(self):
+        return self.nrows
+
+    def __contains__(self, name):
+        return name in self.columns or name in self.date_columns
+
+    def __getitem__(self, name):
+        array = self._arrays.get(name)
+        if array is None:
+            if name in self.columns:
+                suffix = self.dtypes.get(name, "f8")
+            elif name in self.date_columns:
+                suffix = "d4" if self.date_unit == "D" else "i8"
+            else:
+                raise KeyError(name)
+            array = self._map(name + "." + suffix, SUFFIXES[suffix], self.nrows)
+            self._arrays[name] = array
+        return array
+
+    def values(self, name):
+        """Returns an indicator as float64 values.
+
+        The memory-mapped array itself for a float64 column, a float64 copy
+        of a float32 one.
+        """
+        array = self[name]
+        if array.dtype == VALUE_DTYPE:
+            return array
+        return array.astype(VALUE_DTYPE)
+
+    def dates(self, name="datekey"):
+        """Returns a date column as datetime64[ns].
+
+        A view without copying, except for a compact panel.
+        """
+        if self.date_unit == "D":
+            return from_days(self[name])
+        return self[name].view("datetime64[ns]")
+
+    @property
+    def group_starts(self):
+        """The first row of each ticker."""
+        return self.offsets[:-1]
+
+    def ticker_codes(self):
+        """Returns, for each row, the index of its ticker in tickers."""
+        return np.repeat(np.arange(len(self.tickers)), np.diff(self.offsets))
+
+    def rows(self, ticker):
+        """Returns the slice of rows holding a ticker."""
+        i = self._ticker_index[ticker]
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def frame(self, ticker, periods=None):
+        """Returns a ticker's rows as a dataframe like get_indicators does."""
+        rows = self.rows(ticker)
+        if periods is not None:
+            rows = slice(max(rows.start, rows.stop - periods), rows.stop)
+        data = {"ticker": ticker, "dimension": self.dimension}
+        for name in self.date_columns:
+            data[name] = self.dates(name)[rows]
+        for name in self.columns:
+            data[name] = np.array(self.values(name)[rows], dtype=VALUE_DTYPE)
+        return pd.DataFrame(data)
+
+    def calc_ratios(self, ratios=None, backend=None, rows=None, previous=None):
+        """Calculates ratios for every row of the panel at once.
+
+        A ratio using pct_change compares each row with the latest version,
+        as known when the row became known, of its ticker's period before
+        the row's own, see previous_rows, rather than with the row before
+        it, which may be another version of the same period.
+
+        Args:
+            ratios: A list of ratio names, defaulting to all of those in
+                RATIO_EXPRESSIONS, in the order they are to be evaluated.
+            backend: The backend evaluating the ratios, see kernels.py. By
+                default numexpr or numba when installed, else numpy.
+            rows: Optional rows to calculate the ratios of, rather than every
+                row, with previous.
+            previous: The row each of rows is to be compared with by
+                pct_change, -1 for none, e.g. the latest version of its
+                period before as known on a later date, see asof.py.
+        Returns:
+            An ordered dict of ratio name to a float64 array with one value
+            per row, or per one of rows.
+        """
+        if ratios is None:
+            ratios = list(RATIO_EXPRESSIONS)
+        indicators = _Float64Columns(self)
+        row_previous = self.previous_rows()
+        tickers = self._row_tickers()
+        datekeys = self.dates()
+        if rows is not None:
+            # The rows are added after the panel's, so that the forward fill
+            # of pct_change follows on from their previous rows
+            rows = np.asarray(rows, dtype=np.int64)
+            indicators = _Float64Columns(self, rows)
+            row_previous = np.concatenate(
+                (row_previous, np.asarray(previous, dtype=np.int64))
+            )
+            tickers = np.concatenate((tickers, tickers[rows]))
+            datekeys = np.concatenate((datekeys, datekeys[rows]))
+        calculated = evaluate_ratios_compiled(
+            ratios, indicators, self.group_starts, backend, row_previous
+        )
+        _, zero = ratio_issues(
+            ratios,
+            indicators,
+            calculated,
+            tickers,
+            datekeys,
+            self.group_starts,
+            row_previous,
+        )
+        mask_ratios(calculated, zero)
+        if rows is not None:
+            for ratio, values in calculated.items():
+                calculated[ratio] = values[self.nrows :]
+        return calculated
+
+    def previous_rows(self):
+        """Returns, for each row, the row pct_change compares it with.
+
+        That is the latest version, of the rows known when it became known,
+        of its ticker's period before its own, -1 for a ticker's first
+        period. Without restatements, it is the ticker's row before it.
+        """
+        if self._previous_rows is None:
+            self._previous_rows = previous_periods(self)
+        return self._previous_rows
+
+    def validate(self):
+        """Runs the data quality checks of validate.py over the whole panel.
+
+        Returns:
+            The issues dataframe.
+        """
+        ratios = list(RATIO_EXPRESSIONS)
+        calculated = evaluate_ratios_compiled(
+            ratios, _Float64Columns(self), self.group_starts, None, self.previous_rows()
+        )
+        issues, _ = self._ratio_issues(ratios, calculated)
+        tickers = self._row_tickers()
+        datekeys = self.dates()
+        calendardates = self.dates("calendardate")
+        return concat_issues(
+            [
+                issues,
+                period_issues(tickers, datekeys, calendardates, self.dimension),
+                restatement_issues(
+                    tickers,
+                    datekeys,
+                    calendardates,
+                    _Float64Columns(self),
+                    self.columns,
+                ),
+            ]
+        )
+
+    def _row_tickers(self):
+        return np.asarray(self.tickers, dtype=object)[self.ticker_codes()]
+
+    def _ratio_issues(self, ratios, calculated):
+        return ratio_issues(
+            ratios,
+            _Float64Columns(self),
+            calculated,
+            self._row_tickers(),
+            self.dates(),
+            self.group_starts,
+            self.previous_rows(),
+        )
+
+    def latest(self, indicators=None, calc_ratios=None):
+        """Returns the latest value of each indicator for every ticker.
+
+        Args:
+            indicators: Indicator codes and ratio names, defaulting to those
+                on the summary sheet.
+            calc_ratios: Ratios previously returned by calc_ratios. The ratios
+                needed are calculated when not given.
+        Returns:
+            A dataframe indexed by ticker with a column per indicator. Tickers
+            without any rows are omitted.
+        """
+        if indicators is None:
+            indicators = [ind for ind, _ in SharadarFundamentals.SUMMARIZE_IND]
+        present = np.diff(self.offsets) > 0
+        last = self.offsets[1:][present] - 1
+        needed = [i for i in indicators if i not in self]
+        if needed and calc_ratios is None:
+            calc_ratios = self.calc_ratios(with_dependencies(needed))
+
+        data = {}
+        for indicator in indicators:
+            if indicator in self:
+                data[indicator] = self.values(indicator)[last]
+            elif indicator in calc_ratios:
+                data[indicator] = calc_ratios[indicator][last]
+            else:
+                raise KeyError("Couln't find indicator %s" % (indicator))
+        index = pd.Index(np.asarray(self.tickers)[present], name="ticker")
+        return pd.DataFrame(data, index=index, columns=indicators)
+
+    def statistics(self, indicators=None, calc_ratios=None):
+        """Calculates the historical statistics of indicators for every ticker.
+
+        See analytics.py for the statistics.
+
+        Args:
+            indicators: Indicator codes and ratio names, defaulting to those
+                on the summary sheet.
+            calc_ratios: Ratios previously returned by calc_ratios. The ratios
+                needed are calculated when not given.
+        Returns:
+            A dataframe indexed by ticker with an <indicator>_<statistic>
+            column for each indicator and statistic.
+        """
+        if indicators is None:
+            indicators = [ind for ind, _ in SharadarFundamentals.SUMMARIZE_IND]
+        needed = [i for i in indicators if i not in self]
+        if needed and calc_ratios is None:
+            calc_ratios = self.calc_ratios(with_dependencies(needed))
+
+        data = {}
+        for indicator in indicators:
+            if indicator in self:
+                values = self.values(indicator)
+            elif indicator in calc_ratios:
+                values = calc_ratios[indicator]
+            else:
+                raise KeyError("Couln't find indicator %s" % (indicator))
+            stats = grouped_statistics(values, self.group_starts, self.nrows)
+            for stat, _ in STATISTICS:
+                data[indicator + "_" + stat] = stats[stat]
+        index = pd.Index(self.tickers, name="ticker")
+        return pd.DataFrame(data, index=index)
+
+    def _map(self, name, dtype, count):
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.path / name, dtype=dtype, mode="r", shape=(count,))
+
+
+class _Float64Columns(collections.abc.Mapping):
+    """The indicators of a panel as float64, for evaluating ratios.
+
+    Given rows, they are repeated after the panel's rows.
+    """
+
+    def __init__(self, panel, rows=None):
+        self.panel = panel
+        self.rows = rows
+
+    def __getitem__(self, name):
+        values = self.panel.values(name)
+        if self.rows is None:
+            return values
+        return np.concatenate((values, values[self.rows]))
+
+    def __iter__(self):
+        return iter(self.panel.columns)
+
+    def __len__(self):
+        return len(self.panel.columns)
+
+
+def compact_panel(path, rtol=FLOAT32_RTOL):
+    """Converts a panel in place to the compact form.
+
+    One column is converted at a time. Indicators having any value which
+    float32 can't hold within rtol are left as float64.
+
+    Returns:
+        The size of the panel's column files before and after, in bytes.
+    """
+    path = pathlib.Path(path)
+    with open(path / META) as m_file:
+        meta = json.load(m_file)
+    if meta.get("date_unit") == "D":
+        raise ValueError("The panel %s is already compact" % path)
+    nrows = meta["nrows"]
+    before = after = 0
+
+    def convert(name, old, new, values):
+        tmp_path = path / (name + "." + new + ".tmp")
+        values.tofile(str(tmp_path))
+        os.replace(tmp_path, path / (name + "." + new))
+        (path / (name + "." + old)).unlink()
+        return values.nbytes
+
+    dtypes = {}
+    for name in meta["columns"]:
+        values = np.fromfile(str(path / (name + ".f8")), dtype=VALUE_DTYPE)
+        before += values.nbytes
+        if fits_float32(values, rtol):
+            dtypes[name] = "f4"
+            after += convert(name, "f8", "f4", values.astype(COMPACT_DTYPE))
+        else:
+            dtypes[name] = "f8"
+            after += values.nbytes
+    for name in meta["date_columns"]:
+        values = np.fromfile(str(path / (name + ".i8")), dtype=DATE_DTYPE)
+        before += values.nbytes
+        after += convert(name, "i8", "d4", to_days(values.view("datetime64[ns]")))
+
+    meta["dtypes"] = dtypes
+    meta["date_unit"] = "D"
+    tmp_path = path / (META + ".tmp")
+    with open(tmp_path, "w") as m_file:
+        json.dump(meta, m_file)
+    os.replace(tmp_path, path / META)
+
+    logger.info(
+        "Compacted the panel of %d rows from %.1f MB to %.1f MB, %d of %d "
+        "indicators as float32",
+        nrows,
+        before / 2 ** 20,
+        after / 2 ** 20,
+        sum(1 for d in dtypes.values() if d == "f4"),
+        len(dtypes),
+    )
+    return before, after
+
+
+def build_panel(
+    path,
+    stocks,
+    database,
+    dimension,
+    periods,
+    workers=1,
+    cache=None,
+    bulk_threshold=BULK_EXPORT_THRESHOLD,
+    compact=False,
+):
+    """Fetches the indicators for a list of stocks into a panel.
+
+    When there are at least bulk_threshold stocks their indicators are
+    obtained with a bulk export and streamed straight into the panel, stocks
+    missing from the export are then fetched one at a time. With compact the
+    panel is then converted with compact_panel.
+
+    Returns:
+        The opened Panel.
+    """
+    with PanelWriter(path, dimension) as writer:
+        if bulk_threshold is not None and len(stocks) >= bulk_threshold:
+            exported = export_indicators(stocks, database, dimension, periods)
+            for stock, sf1_df in exported:
+                writer.add(stock, sf1_df)
+            added = set(writer.tickers)
+            stocks = [s for s in stocks if s not in added]
+
+        def write(stock, fund):
+            if fund is not None:
+                writer.add(stock, fund.all_inds_df)
+
+        run_pipeline(
+            stocks,
+            lambda stock: load_fundamentals(
+                stock, database, dimension, periods, cache=cache
+            ),
+            lambda stock, fund: fund,
+            write,
+            fetch_workers=workers,
+        )
+    if compact:
+        compact_panel(path)
+    return Panel.open(path)
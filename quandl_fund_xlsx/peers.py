@@ -0,0 +1,124 @@
+"""Sector and industry peer group statistics for the summary sheet.
+
+Ranking a REIT's net debt to ebitda against a semiconductor's says little.
+Each ticker's sector and industry come from the SHARADAR/TICKERS table,
+cached in a local CSV file as they rarely change. The summarized indicators
+are then compared within each peer group, with grouped pandas operations
+over every ticker at once, giving the group median, the ticker's percentile
+within the group and its z-score.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import collections
+import logging
+import os
+import pathlib
+
+import numpy as np
+import pandas as pd
+import quandl
+
+logger = logging.getLogger(__name__)
+
+TICKERS_COLUMNS = ["ticker", "name", "sector", "industry"]
+
+# The peer group levels of the TICKERS table
+PEER_GROUPS = ("sector", "industry")
+
+DEFAULT_TICKERS_CACHE = pathlib.Path("~/.cache/quandl_fund_xlsx/tickers.csv")
+
+UNKNOWN_GROUP = "Unknown"
+
+
+def load_ticker_metadata(tickers, cache_path=None):
+    """Obtains the name, sector and industry of tickers.
+
+    Tickers which are not in the local cache are fetched from
+    SHARADAR/TICKERS with a single paginated request and added to the cache,
+    including those which the table does not have.
+
+    Args:
+        tickers: A list of tickers.
+        cache_path: The CSV file caching the TICKERS table, by default
+            ~/.cache/quandl_fund_xlsx/tickers.csv.
+    Returns:
+        A dataframe indexed by ticker, in the order of tickers, with the
+        TICKERS_COLUMNS.
+    """
+    cache_path = pathlib.Path(cache_path or DEFAULT_TICKERS_CACHE).expanduser()
+    if cache_path.exists():
+        cached = pd.read_csv(cache_path, dtype=str, keep_default_na=False)
+    else:
+        cached = pd.DataFrame(columns=TICKERS_COLUMNS)
+
+    known = set(cached["ticker"])
+    missing = [t for t in tickers if t not in known]
+    if missing:
+        logger.info("Fetching the sector of %d tickers", len(missing))
+        fetched = quandl.get_table(
+            "SHARADAR/TICKERS",
+            table="SF1",
+            ticker=missing,
+            qopts={"columns": TICKERS_COLUMNS},
+            paginate=True,
+        )
+        # Remember the tickers TICKERS doesn't have so they aren't refetched
+        unknown = pd.DataFrame({"ticker": missing}, columns=TICKERS_COLUMNS)
+        cached = pd.concat([cached, fetched, unknown], ignore_index=True)
+        cached = cached.drop_duplicates("ticker", keep="first").fillna("")
+
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+        cached.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, cache_path)
+
+    return cached.set_index("ticker").reindex(tickers).fillna("")
+
+
+def peer_groups(metadata, level):
+    """Returns the peer group of each ticker, a Series indexed by ticker.
+
+    Args:
+        metadata: As returned by load_ticker_metadata.
+        level: "sector" or "industry".
+    """
+    if level not in PEER_GROUPS:
+        raise ValueError(
+            "The peer group must be one of %s, not %s" % (", ".join(PEER_GROUPS), level)
+        )
+    return metadata[level].replace("", UNKNOWN_GROUP)
+
+
+def peer_statistics(latest, groups):
+    """Compares each ticker's indicators with those of its peer group.
+
+    Args:
+        latest: A dataframe indexed by ticker with the latest value of each
+            indicator.
+        groups: The peer group of each ticker, tickers without one are in
+            the "Unknown" group.
+    Returns:
+        A dataframe indexed by ticker with a group column, then for each
+        indicator its value, the group median, the ticker's percentile within
+        the group (0 to 1) and its z-score against the group.
+    """
+    values = latest.apply(pd.to_numeric, errors="coerce")
+    values = values.replace([np.inf, -np.inf], np.nan)
+    group = groups.reindex(values.index).fillna(UNKNOWN_GROUP)
+    grouped = values.groupby(group)
+
+    median = grouped.transform("median")
+    mean = grouped.transform("mean")
+    std = grouped.transform("std")
+    percentile = grouped.rank(pct=True)
+    zscore = (values - mean) / std.replace(0, np.nan)
+
+    columns = collections.OrderedDict(group=group)
+    for indicator in values.columns:
+        columns[indicator] = values[indicator]
+        columns[indicator + "_median"] = median[indicator]
+        columns[indicator + "_pctile"] = percentile[indicator]
+        columns[indicator + "_zscore"] = zscore[indicator]
+    return pd.DataFrame(columns, index=values.index)
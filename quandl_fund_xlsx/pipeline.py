@@ -0,0 +1,179 @@
+"""A fetch, compute and write pipeline with bounded queues.
+
+Fetching indicators from Quandl is dominated by network latency, calculating
+ratios and transposing statements by pandas, and writing sheets must happen
+on a single thread since xlsxwriter is not thread-safe. Running the three as
+separate stages connected by bounded queues lets them overlap while the
+writer still sees the results in the original ticker order.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Placed on a queue to tell a worker thread to exit.
+_STOP = object()
+
+
+class _Failed(object):
+    """Carries an exception raised by a stage through to the writer."""
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def run_pipeline(
+    items, fetch, compute, write, fetch_workers=1, compute_workers=1, max_in_flight=None
+):
+    """Runs fetch, compute and write for each item, writing in item order.
+
+    fetch(item) is run by a pool of fetch_workers threads, compute(item,
+    fetched) by a pool of compute_workers threads and write(item, computed)
+    by the calling thread. With fetch_workers of 1 or fewer every stage runs
+    inline on the calling thread.
+
+    Memory stays flat however many items there are: at most max_in_flight
+    items are admitted to the pipeline and not yet written, which bounds
+    both the queues and the buffer used to restore the item order.
+
+    An exception raised by fetch or compute is re-raised by the calling
+    thread when the writer reaches the failed item, as it would be if the
+    items were processed one at a time.
+
+    Args:
+        items: An iterable of items, e.g. tickers.
+        fetch: A callable taking an item.
+        compute: A callable taking an item and the result of fetch.
+        write: A callable taking an item and the result of compute.
+        fetch_workers: The number of fetch threads.
+        compute_workers: The number of compute threads.
+        max_in_flight: The maximum number of items between admission and
+            being written. Defaults to twice the number of worker threads.
+    """
+    if fetch_workers <= 1:
+        for item in items:
+            write(item, compute(item, fetch(item)))
+        return
+
+    compute_workers = max(1, compute_workers)
+    if max_in_flight is None:
+        max_in_flight = 2 * (fetch_workers + compute_workers)
+
+    slots = threading.BoundedSemaphore(max_in_flight)
+    stopping = threading.Event()
+    fetch_q = queue.Queue(maxsize=max_in_flight)
+    compute_q = queue.Queue(maxsize=max_in_flight)
+    result_q = queue.Queue()
+    admitted = []
+
+    def feeder():
+        count = 0
+        try:
+            for item in items:
+                slots.acquire()
+                if stopping.is_set():
+                    break
+                fetch_q.put((count, item))
+                count += 1
+        finally:
+            admitted.append(count)
+            result_q.put(_STOP)
+            for _ in range(fetch_workers):
+                fetch_q.put(_STOP)
+
+    def fetcher():
+        while True:
+            job = fetch_q.get()
+            if job is _STOP:
+                break
+            index, item = job
+            if stopping.is_set():
+                compute_q.put((index, item, None))
+                continue
+            try:
+                fetched = fetch(item)
+            except Exception as exc:
+                fetched = _Failed(exc)
+            compute_q.put((index, item, fetched))
+
+    def computer():
+        while True:
+            job = compute_q.get()
+            if job is _STOP:
+                break
+            index, item, fetched = job
+            if isinstance(fetched, _Failed) or stopping.is_set():
+                result_q.put((index, item, fetched))
+                continue
+            try:
+                computed = compute(item, fetched)
+            except Exception as exc:
+                computed = _Failed(exc)
+            result_q.put((index, item, computed))
+
+    threads = [threading.Thread(target=feeder, name="pipeline-feeder")]
+    fetchers = [
+        threading.Thread(target=fetcher, name="pipeline-fetch-%d" % i)
+        for i in range(fetch_workers)
+    ]
+    computers = [
+        threading.Thread(target=computer, name="pipeline-compute-%d" % i)
+        for i in range(compute_workers)
+    ]
+    threads.extend(fetchers + computers)
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    pending = {}
+    next_index = 0
+    feeder_done = False
+    try:
+        while not (feeder_done and next_index == admitted[0]):
+            result = result_q.get()
+            if result is _STOP:
+                feeder_done = True
+                continue
+            index, item, computed = result
+            pending[index] = (item, computed)
+            while next_index in pending:
+                item, computed = pending.pop(next_index)
+                next_index += 1
+                if isinstance(computed, _Failed):
+                    raise computed.exc
+                write(item, computed)
+                slots.release()
+    except BaseException:
+        stopping.set()
+        # Unblock the feeder so that it can notice we are stopping.
+        for _ in range(max_in_flight):
+            try:
+                slots.release()
+            except ValueError:
+                break
+        raise
+    finally:
+        if not stopping.is_set():
+            for fetch_thread in fetchers:
+                fetch_thread.join()
+            for _ in computers:
+                compute_q.put(_STOP)
+        else:
+            _stop_workers(fetchers, computers, compute_q)
+
+
+def _stop_workers(fetchers, computers, compute_q):
+    """Lets the workers drain their queues and exit after a failure."""
+
+    def stopper():
+        for fetch_thread in fetchers:
+            fetch_thread.join()
+        for _ in computers:
+            compute_q.put(_STOP)
+
+    threading.Thread(target=stopper, name="pipeline-stopper", daemon=True).start()
@@ -0,0 +1,330 @@
+"""Building many workbooks, one per portfolio, from one shared pass.
+
+Several watchlists usually overlap, and building each of them with its own
+stock_xlsx refetches and recalculates the tickers they share. A manifest
+lists the jobs instead, a CSV file with a row per workbook:
+
+    tickers   the ticker file, one ticker per line
+    output    the workbook to write
+    dimension optional, the Sharadar dimension, e.g. MRY
+    years     optional, the number of periods
+
+Relative paths are relative to the manifest. run_manifest fetches and
+calculates each ticker once for each dimension and years in the manifest,
+using a bulk export for the union of the tickers when there are enough of
+them, then renders the workbooks from the shared results in a pool of
+processes, since xlsxwriter is single threaded and rendering is CPU bound.
+Given a DeadLetters, see resilience.py, the tickers whose fetch, calculation
+or writing fails are left out of the workbooks, as with stock_xlsx.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import collections
+import concurrent.futures
+import csv
+import logging
+import os
+import pathlib
+
+from .cache import IndicatorCache
+from .export import BULK_EXPORT_THRESHOLD
+from .fundamentals import (
+    Excel,
+    SharadarFundamentals,
+    calc_fund_ratios,
+    load_fundamentals,
+    normalize_tickers,
+    prefetch_bulk_export,
+    stock_blocks,
+    write_stock_sheet,
+)
+from .pipeline import run_pipeline
+from .resilience import DeadLetters
+from .validate import concat_issues, log_issues
+
+logger = logging.getLogger(__name__)
+
+Job = collections.namedtuple("Job", ["tickers", "output", "dimension", "years"])
+
+# The results shared with each render process, and whether it records the
+# tickers which fail, see _init_render
+_shared_results = None
+_isolate_failures = False
+
+
+def read_tickers(path):
+    """Reads a ticker file, one ticker per line, normalizing the tickers."""
+    with open(path) as t_file:
+        return normalize_tickers(t_file)
+
+
+def read_manifest(path, dimension="MRY", years=5):
+    """Reads the jobs of a manifest.
+
+    Args:
+        path: The manifest CSV file.
+        dimension: The dimension of the jobs not giving one.
+        years: The years of the jobs not giving them.
+    Returns:
+        A list of Jobs, each holding the normalized tickers of its ticker
+        file.
+    Raises:
+        ValueError: The manifest lacks the tickers or output column, or two
+            jobs write the same workbook.
+    """
+    base = pathlib.Path(path).parent
+    jobs = []
+    with open(path, newline="") as m_file:
+        reader = csv.DictReader(m_file)
+        missing = {"tickers", "output"} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(
+                "The manifest %s has no %s column" % (path, ", ".join(sorted(missing)))
+            )
+        for row in reader:
+            jobs.append(
+                Job(
+                    read_tickers(base / row["tickers"].strip()),
+                    str(base / row["output"].strip()),
+                    (row.get("dimension") or "").strip() or dimension,
+                    int((row.get("years") or "").strip() or years),
+                )
+            )
+
+    outputs = collections.Counter(job.output for job in jobs)
+    repeated = [output for output, n in outputs.items() if n > 1]
+    if repeated:
+        raise ValueError(
+            "The manifest %s writes %s more than once" % (path, ", ".join(repeated))
+        )
+    return jobs
+
+
+def ticker_union(jobs):
+    """Returns a dict of each (dimension, years) of the jobs to the union of
+    their tickers, in the order they first appear.
+    """
+    union = collections.OrderedDict()
+    for job in jobs:
+        key = (job.dimension, job.years)
+        union.setdefault(key, collections.OrderedDict()).update(
+            dict.fromkeys(job.tickers)
+        )
+    return collections.OrderedDict((key, list(t)) for key, t in union.items())
+
+
+def compute_shared(
+    stocks,
+    database,
+    dimension,
+    periods,
+    workers=1,
+    bulk_threshold=BULK_EXPORT_THRESHOLD,
+    dead_letters=None,
+):
+    """Fetches and calculates each stock once.
+
+    Args:
+        dead_letters: An optional DeadLetters in which the stocks whose
+            fetch or calculation fails are recorded, rather than the failure
+            ending the build.
+    Returns:
+        A dict of stock to (fund, blocks), for the stocks which are
+        supported, fund being a SharadarFundamentals with its ratios
+        calculated and blocks as returned by stock_blocks.
+    """
+    cache = None
+    if bulk_threshold is not None and len(stocks) >= bulk_threshold:
+        cache = IndicatorCache()
+        try:
+            prefetch_bulk_export(stocks, database, dimension, periods, cache)
+        except Exception as exc:
+            if dead_letters is None:
+                raise
+            logger.warning(
+                "The bulk export failed, fetching the stocks one at a time: %s", exc
+            )
+
+    results = {}
+
+    def fetch(stock):
+        try:
+            return load_fundamentals(stock, database, dimension, periods, cache=cache)
+        except Exception as exc:
+            if dead_letters is None:
+                raise
+            dead_letters.add(stock, "fetch", exc)
+            return None
+
+    def compute(stock, fund):
+        if fund is None:
+            return None
+        try:
+            calc_fund_ratios(stock, fund)
+            return fund, stock_blocks(fund)
+        except Exception as exc:
+            if dead_letters is None:
+                raise
+            dead_letters.add(stock, "compute", exc)
+            return None
+
+    def write(stock, computed):
+        if computed is not None:
+            results[stock] = computed
+
+    run_pipeline(
+        stocks,
+        fetch,
+        compute,
+        write,
+        fetch_workers=workers,
+        compute_workers=min(workers, os.cpu_count() or 1),
+    )
+    return results
+
+
+def render_workbook(job, results, dead_letters=None):
+    """Writes the workbook of a job from the shared results.
+
+    Args:
+        job: A Job.
+        results: A dict of stock to (fund, blocks) as returned by
+            compute_shared for the job's dimension and years.
+        dead_letters: An optional DeadLetters in which the stocks whose
+            sheet fails to be written are recorded, and left out of the
+            workbook, rather than the failure ending the build.
+    Returns:
+        The number of stock sheets written.
+    """
+    stocks = [stock for stock in job.tickers if stock in results]
+    if not stocks:
+        logger.warning("Skipping %s, none of its tickers are supported", job.output)
+        return 0
+
+    excel = Excel(job.output)
+    issues = []
+    written = 0
+    for stock in stocks:
+        try:
+            fund, blocks = results[stock]
+            # Summarized first so that a failure leaves no sheet behind
+            summary = excel.summarized_indicators(fund, stock)
+            write_stock_sheet(excel, stock, blocks, job.dimension)
+        except Exception as exc:
+            if dead_letters is None:
+                raise
+            dead_letters.add(stock, "write", exc)
+            continue
+        excel.add_summary_values(stock, summary)
+        issues.append(fund.issues_df)
+        written += 1
+    if not written:
+        logger.warning("Skipping %s, none of its tickers were written", job.output)
+        return 0
+
+    excel.write_summary_sheet(
+        collections.OrderedDict(SharadarFundamentals.SUMMARIZE_IND)
+    )
+    issues_df = concat_issues(issues)
+    log_issues(issues_df)
+    excel.write_issues_sheet(issues_df)
+    excel.save()
+    logger.info("Wrote %d stocks to %s", written, job.output)
+    return written
+
+
+def _init_render(results, isolate_failures=False):
+    global _shared_results, _isolate_failures
+    _shared_results = results
+    _isolate_failures = isolate_failures
+
+
+def _render_shared(job):
+    """Renders a job in a render process.
+
+    Returns:
+        The number of stock sheets written and the failures of the stocks
+        left out, for the DeadLetters of the parent process.
+    """
+    key = (job.dimension, job.years)
+    dead_letters = DeadLetters() if _isolate_failures else None
+    written = render_workbook(job, _shared_results[key], dead_letters)
+    return written, {} if dead_letters is None else dead_letters.failures
+
+
+def run_manifest(
+    jobs,
+    database,
+    workers=1,
+    render_workers=None,
+    bulk_threshold=BULK_EXPORT_THRESHOLD,
+    dead_letters=None,
+):
+    """Builds the workbooks of a manifest's jobs.
+
+    Args:
+        jobs: A list of Jobs, see read_manifest.
+        database: The Sharadar database, SF0 or SF1.
+        workers: The number of threads fetching indicators from Quandl.
+        render_workers: The number of processes rendering the workbooks,
+            by default the number of CPUs. 1 renders them in this process.
+        bulk_threshold: As for stock_xlsx, compared with the number of
+            tickers in the union of the jobs.
+        dead_letters: An optional DeadLetters in which the tickers whose
+            fetch, calculation or writing fails are recorded, and left out
+            of the workbooks, rather than the failure ending the build.
+    Returns:
+        A dict of each job's output to the number of stock sheets written.
+    """
+    results = {}
+    for (dimension, years), stocks in ticker_union(jobs).items():
+        logger.info(
+            "Fetching %d tickers for %d jobs with dimension %s and %d years",
+            len(stocks),
+            sum((j.dimension, j.years) == (dimension, years) for j in jobs),
+            dimension,
+            years,
+        )
+        results[dimension, years] = compute_shared(
+            stocks, database, dimension, years, workers, bulk_threshold, dead_letters
+        )
+
+    return render_jobs(jobs, results, render_workers, dead_letters)
+
+
+def render_jobs(jobs, results, render_workers=None, dead_letters=None):
+    """Renders the workbooks of jobs from shared results.
+
+    Args:
+        jobs: A list of Jobs.
+        results: A dict of (dimension, years) to a mapping of stock to
+            (fund, blocks), as returned by compute_shared.
+        render_workers: As for run_manifest.
+        dead_letters: An optional DeadLetters, as for render_workbook.
+    Returns:
+        A dict of each job's output to the number of stock sheets written.
+    """
+    if render_workers is None:
+        render_workers = os.cpu_count() or 1
+    render_workers = min(render_workers, len(jobs))
+    if render_workers <= 1:
+        written = [
+            render_workbook(job, results[job.dimension, job.years], dead_letters)
+            for job in jobs
+        ]
+    else:
+        # The results are handed to each process once, when it starts, rather
+        # than with each job
+        with concurrent.futures.ProcessPoolExecutor(
+            render_workers,
+            initializer=_init_render,
+            initargs=(results, dead_letters is not None),
+        ) as pool:
+            rendered = list(pool.map(_render_shared, jobs))
+        written = [n for n, _ in rendered]
+        if dead_letters is not None:
+            for _, failures in rendered:
+                dead_letters.update(failures)
+    return collections.OrderedDict((job.output, n) for job, n in zip(jobs, written))
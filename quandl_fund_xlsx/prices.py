@@ -0,0 +1,211 @@
+"""Valuation ratios from daily prices, joined to the filings as of each date.
+
+The price and ev in each SF1 row are snapshots taken at the filing's datekey,
+so price_rough_ffo_ps_ratio and ev_opinc_ratio go stale until the next
+filing. Given daily prices, from SHARADAR/DAILY or a local file, the
+valuation ratios are recalculated with a pandas merge_asof on date by
+ticker: one sorted merge however many tickers and rows there are.
+
+Two sets of valuation ratios are produced:
+
+    historical  each filing valued at the last price on or before its datekey,
+                the *_asof ratios added to the calculated ratios
+    current     the latest filing valued at the latest price, the *_current
+                ratios added to the summary sheet
+
+A prices dataframe has a ticker and a date column, and a price or a
+marketcap column. An ev column is optional, when absent the filing's ev is
+adjusted by the change in market capitalization. Amounts are in USD.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import collections
+import logging
+
+import pandas as pd
+import quandl
+
+from .ratios import evaluate_ratios, with_dependencies
+
+logger = logging.getLogger(__name__)
+
+# The calculated ratios which depend on the price or ev
+VALUATION_RATIOS = ["price_rough_ffo_ps_ratio", "ev_opinc_ratio"]
+
+ASOF_RATIOS = [
+    ("price_asof", "Price at the Filing Date"),
+    ("ev_asof", "Enterprise Value at the Filing Date"),
+    ("price_rough_ffo_ps_ratio_asof", "Price at the Filing Date / rough_ffo_ps"),
+    (
+        "ev_opinc_ratio_asof",
+        "Acquirers Multiple at the Filing Date: Enterprise Value / Operating Income",
+    ),
+]
+
+# Formatting of the current valuations on the summary sheet, see SUMMARIZE_IND
+CURRENT_SUMMARIZE_IND = [
+    ("price_rough_ffo_ps_ratio_current", "desc"),
+    ("ev_opinc_ratio_current", "desc"),
+]
+
+# SHARADAR/DAILY holds marketcap and ev in millions of USD
+DAILY_COLUMNS = ["ticker", "date", "marketcap", "ev"]
+DAILY_UNITS = 1e6
+
+
+def load_daily(tickers, start=None):
+    """Obtains the daily marketcap and ev of tickers from SHARADAR/DAILY.
+
+    Args:
+        tickers: A list of tickers, fetched with a single paginated request.
+        start: The earliest date wanted, e.g. "2015-01-01". Defaults to all
+            of the available history.
+    Returns:
+        A prices dataframe, amounts in USD.
+    """
+    options = {}
+    if start is not None:
+        options["date"] = {"gte": str(start)}
+    daily_df = quandl.get_table(
+        "SHARADAR/DAILY",
+        ticker=list(tickers),
+        qopts={"columns": DAILY_COLUMNS},
+        paginate=True,
+        **options
+    )
+    daily_df["marketcap"] *= DAILY_UNITS
+    daily_df["ev"] *= DAILY_UNITS
+    return daily_df
+
+
+def read_prices(path):
+    """Reads a prices dataframe from a CSV file.
+
+    The file has a ticker, a date and a price column, a close column being
+    taken as the price. marketcap and ev columns are optional.
+    """
+    prices_df = pd.read_csv(path, parse_dates=["date"])
+    if "price" not in prices_df.columns and "close" in prices_df.columns:
+        prices_df = prices_df.rename(columns={"close": "price"})
+    if "price" not in prices_df.columns and "marketcap" not in prices_df.columns:
+        raise ValueError("%s has neither a price nor a marketcap column" % path)
+    prices_df["ticker"] = prices_df["ticker"].str.strip().str.upper()
+    return prices_df
+
+
+def group_prices(prices_df):
+    """Splits a prices dataframe by ticker, each sorted by date."""
+    prices_df = prices_df.sort_values(["ticker", "date"], kind="mergesort")
+    return {
+        ticker: group.reset_index(drop=True)
+        for ticker, group in prices_df.groupby("ticker", sort=False)
+    }
+
+
+def _daily(prices_df):
+    # Distinguish the daily values from the filing's snapshots once merged
+    values = [c for c in prices_df.columns if c not in ("ticker", "date")]
+    return prices_df.rename(columns={c: c + "_daily" for c in values})
+
+
+def _merge_prices(left, right, left_on, right_on):
+    # merge_asof needs both sides sorted on the merge key
+    return pd.merge_asof(
+        left.sort_values(left_on),
+        right.sort_values(right_on),
+        left_on=left_on,
+        right_on=right_on,
+        by="ticker",
+        direction="backward",
+    )
+
+
+def _valuation_indicators(merged):
+    """Replaces the price and ev snapshots of merged rows with daily ones."""
+    if "marketcap" in merged.columns and "marketcap_daily" in merged.columns:
+        shares = merged["marketcap"] / merged["price"]
+    else:
+        shares = merged["shareswa"]
+
+    if "price_daily" in merged.columns:
+        price = merged["price_daily"]
+    elif "marketcap_daily" in merged.columns:
+        price = merged["marketcap_daily"] / shares
+    else:
+        raise ValueError("The prices have neither a price nor a marketcap column")
+    if "ev_daily" in merged.columns:
+        ev = merged["ev_daily"]
+    else:
+        ev = merged["ev"] + (price - merged["price"]) * shares
+
+    indicators = merged.copy()
+    indicators["price"] = price.astype(float)
+    indicators["ev"] = ev.astype(float)
+    return indicators
+
+
+def _valuation_ratios(indicators):
+    ratios = evaluate_ratios(with_dependencies(VALUATION_RATIOS), indicators)
+    return collections.OrderedDict((r, ratios[r]) for r in VALUATION_RATIOS)
+
+
+def asof_valuations(sf1_df, prices_df):
+    """Values each filing at the last price on or before its datekey.
+
+    Args:
+        sf1_df: SF1 indicators for one or many tickers.
+        prices_df: A prices dataframe.
+    Returns:
+        A dataframe with the index of sf1_df and the ASOF_RATIOS columns,
+        NaN for filings without an earlier price.
+    """
+    if prices_df.empty:
+        return pd.DataFrame(index=sf1_df.index, columns=[r for r, _ in ASOF_RATIOS])
+    left = sf1_df.assign(_row=range(len(sf1_df)))
+    merged = _merge_prices(left, _daily(prices_df), "datekey", "date")
+    indicators = _valuation_indicators(merged)
+    ratios = _valuation_ratios(indicators)
+
+    valuations = pd.DataFrame(
+        {
+            "price_asof": indicators["price"],
+            "ev_asof": indicators["ev"],
+            "price_rough_ffo_ps_ratio_asof": ratios["price_rough_ffo_ps_ratio"],
+            "ev_opinc_ratio_asof": ratios["ev_opinc_ratio"],
+        }
+    )
+    order = merged["_row"].to_numpy().argsort()
+    return valuations.iloc[order].set_axis(sf1_df.index, axis=0)
+
+
+def current_valuations(sf1_df, prices_df):
+    """Values the latest filing of each ticker at its latest price.
+
+    Args:
+        sf1_df: SF1 indicators for one or many tickers.
+        prices_df: A prices dataframe.
+    Returns:
+        A dataframe indexed by ticker with the date of the latest price and
+        the *_current valuation ratios. Tickers without a price since their
+        first filing are omitted.
+    """
+    if prices_df.empty:
+        columns = ["date"] + [r for r, _ in CURRENT_SUMMARIZE_IND]
+        return pd.DataFrame(columns=columns, index=pd.Index([], name="ticker"))
+    latest_prices = _daily(prices_df).sort_values("date").groupby("ticker").tail(1)
+    merged = _merge_prices(latest_prices, sf1_df, "date", "datekey")
+    merged = merged.dropna(subset=["datekey"])
+    indicators = _valuation_indicators(merged)
+    ratios = _valuation_ratios(indicators)
+
+    current = pd.DataFrame(
+        {
+            "ticker": merged["ticker"],
+            "date": merged["date"],
+            "price_rough_ffo_ps_ratio_current": ratios["price_rough_ffo_ps_ratio"],
+            "ev_opinc_ratio_current": ratios["ev_opinc_ratio"],
+        }
+    )
+    return current.set_index("ticker").sort_index()
@@ -0,0 +1,251 @@
+"""Named profiles of the sheet blocks and ratios a build needs.
+
+By default every stock's sheet has the income, cash flow and balance
+statements, the Sharadar metrics and every calculated ratio, and every SF1
+column is fetched for it. A profile narrows this to the blocks and ratios
+wanted, e.g. only the KJM capital employed ratios, and the build then:
+
+    fetches only the SF1 columns the profile's blocks, ratios and summary
+    read, with the qopts.columns option of the tables API
+    calculates only the profile's ratios and those they refer to
+    renders only the profile's blocks
+
+The profiles are those in PROFILES, or read from a JSON file by
+load_profiles, an object mapping each profile's name to its blocks, ratios
+and summary e.g.
+
+    {"dividends": {"blocks": ["cash_flow", "calculated"],
+                   "ratios": ["dividends_cfo_ratio", "rough_ffo"],
+                   "summarize": [["dividends_cfo_ratio", "desc"]]}}
+
+where ratios defaults to every calculated ratio and summarize to the
+default summary sheet.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import json
+import logging
+
+from .ratios import RATIO_EXPRESSIONS
+
+logger = logging.getLogger(__name__)
+
+# The blocks of a stock's sheet, in the order they are written
+BLOCKS = ("income", "cash_flow", "balance", "metrics", "calculated")
+
+# Formatting controls of the summary sheet, see SUMMARIZE_IND
+SUMMARY_FORMATS = ("asc", "desc")
+
+
+class Profile(object):
+    """The blocks and ratios of a build.
+
+    Args:
+        name: The profile's name.
+        blocks: The blocks rendered on each stock's sheet, from BLOCKS.
+        ratios: The names of the calculated ratios, by default every ratio
+            of SharadarFundamentals.CALCULATED_RATIOS.
+        summarize: The (indicator, format) pairs of the summary sheet, by
+            default SharadarFundamentals.SUMMARIZE_IND.
+        all_columns: Fetch every SF1 column rather than only those needed.
+        needs: Further indicator codes and ratio names the build reads, e.g.
+            in a screen.
+    Raises:
+        ValueError: If a block, ratio or summary format is unknown.
+    """
+
+    def __init__(
+        self,
+        name,
+        blocks=BLOCKS,
+        ratios=None,
+        summarize=None,
+        all_columns=False,
+        needs=(),
+    ):
+        for block in blocks:
+            if block not in BLOCKS:
+                raise ValueError(
+                    "Unknown block %s in the profile %s, the blocks are %s"
+                    % (block, name, ", ".join(BLOCKS))
+                )
+        if ratios is not None:
+            for ratio in ratios:
+                if ratio not in RATIO_EXPRESSIONS:
+                    raise ValueError(
+                        "Unknown ratio %s in the profile %s" % (ratio, name)
+                    )
+        if summarize is not None:
+            summarize = [tuple(pair) for pair in summarize]
+            for indicator, fmt in summarize:
+                if fmt not in SUMMARY_FORMATS:
+                    raise ValueError(
+                        "The summary format of %s in the profile %s must be "
+                        "asc or desc, not %s" % (indicator, name, fmt)
+                    )
+        self.name = name
+        self.blocks = tuple(blocks)
+        self.ratios = None if ratios is None else list(ratios)
+        self.summarize = summarize
+        self.all_columns = all_columns
+        self.needs = tuple(needs)
+
+    def __repr__(self):
+        return "Profile(%r, %r, %r, %r, %r, %r)" % (
+            self.name,
+            self.blocks,
+            self.ratios,
+            self.summarize,
+            self.all_columns,
+            self.needs,
+        )
+
+    def needing(self, names):
+        """Returns a copy of the profile also reading names, indicator codes
+        or ratio names.
+        """
+        needs = list(self.needs)
+        needs.extend(n for n in names if n not in needs)
+        return Profile(
+            self.name,
+            self.blocks,
+            self.ratios,
+            self.summarize,
+            self.all_columns,
+            needs,
+        )
+
+
+PROFILES = {
+    # Everything, as before profiles
+    "full": Profile("full", all_columns=True),
+    # Kenneth J Marshall's capital employed metrics, from Good Stocks Cheap
+    "kjm": Profile(
+        "kjm",
+        blocks=["calculated"],
+        ratios=[
+            "kjm_capital_employed_sub_cash",
+            "kjm_capital_employed_with_cash",
+            "kjm_roce_sub_cash",
+            "kjm_roce_with_cash",
+            "kjm_fcf_return_on_capital_employed_with_cash",
+            "kjm_fcf_return_on_capital_employed_sub_cash",
+            "opinc_ps",
+            "fcf_ps",
+            "kjm_delta_oi_fds",
+            "kjm_delta_fcf_fds",
+            "kjm_delta_bv_fds",
+            "kjm_delta_tbv_fds",
+        ],
+        summarize=[
+            ("kjm_roce_sub_cash", "asc"),
+            ("kjm_fcf_return_on_capital_employed_sub_cash", "asc"),
+            ("kjm_delta_oi_fds", "asc"),
+            ("kjm_delta_fcf_fds", "asc"),
+            ("kjm_delta_bv_fds", "asc"),
+        ],
+    ),
+    # The rough FFO of REITs and how well it covers their dividends
+    "reit": Profile(
+        "reit",
+        blocks=["income", "cash_flow", "calculated"],
+        ratios=[
+            "rough_ffo",
+            "rough_ffo_ps",
+            "price_rough_ffo_ps_ratio",
+            "rough_ffo_dividend_payout_ratio",
+            "dividends_cfo_ratio",
+            "net_debt_ebitda_ratio",
+            "ebitda_interest_coverage",
+        ],
+        summarize=[
+            ("price_rough_ffo_ps_ratio", "desc"),
+            ("rough_ffo_dividend_payout_ratio", "desc"),
+            ("dividends_cfo_ratio", "desc"),
+            ("net_debt_ebitda_ratio", "desc"),
+            ("ebitda_interest_coverage", "asc"),
+        ],
+    ),
+    # Leverage and interest coverage, for credit analysis
+    "credit": Profile(
+        "credit",
+        blocks=["balance", "calculated"],
+        ratios=[
+            "liabilities_equity_ratio",
+            "debt_ebitda_ratio",
+            "debt_ebitda_minus_capex_ratio",
+            "net_debt_ebitda_ratio",
+            "net_debt_ebitda_minus_capex_ratio",
+            "debt_equity_ratio",
+            "ebit_interest_coverage",
+            "ebitda_interest_coverage",
+            "ebitda_minus_capex_interest_coverage",
+            "interest_to_cfo_plus_interest_coverage",
+            "debt_to_total_capital",
+            "debt_cfo_ratio",
+            "ltdebt_cfo_ratio",
+        ],
+        summarize=[
+            ("ebitda_interest_coverage", "asc"),
+            ("net_debt_ebitda_ratio", "desc"),
+            ("debt_equity_ratio", "desc"),
+            ("debt_cfo_ratio", "desc"),
+            ("workingcapital", "asc"),
+        ],
+    ),
+}
+
+DEFAULT_PROFILE = "full"
+
+
+def load_profiles(path):
+    """Reads the profiles of a JSON file.
+
+    Returns:
+        A dict of profile name to Profile.
+    Raises:
+        ValueError: If a profile is not as described above.
+    """
+    with open(path) as p_file:
+        definitions = json.load(p_file)
+    if not isinstance(definitions, dict):
+        raise ValueError("%s must hold an object of profiles by name" % (path))
+    profiles = {}
+    for name, definition in definitions.items():
+        unknown = set(definition) - {"blocks", "ratios", "summarize"}
+        if unknown:
+            raise ValueError(
+                "Unknown keys %s in the profile %s of %s"
+                % (", ".join(sorted(unknown)), name, path)
+            )
+        profiles[name] = Profile(
+            name,
+            definition.get("blocks", BLOCKS),
+            definition.get("ratios"),
+            definition.get("summarize"),
+        )
+    return profiles
+
+
+def get_profile(name=None, path=None):
+    """Returns a profile by name, from PROFILES or a profiles file.
+
+    Args:
+        name: The profile's name, by default DEFAULT_PROFILE.
+        path: An optional JSON file of profiles, see load_profiles, which
+            take precedence over those of the same name in PROFILES.
+    Raises:
+        ValueError: If there's no such profile.
+    """
+    profiles = dict(PROFILES)
+    if path is not None:
+        profiles.update(load_profiles(path))
+    name = DEFAULT_PROFILE if name is None else name
+    if name not in profiles:
+        raise ValueError(
+            "Unknown profile %s, the profiles are %s"
+            % (name, ", ".join(sorted(profiles)))
+        )
+    return profiles[name]
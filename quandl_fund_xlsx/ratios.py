@@ -0,0 +1,355 @@
+"""Definitions of the ratios and metrics calculated from Sharadar indicators.
+
+Each calculated ratio is an arithmetic expression over Sharadar indicator
+codes and previously calculated ratios. Holding them as expressions, rather
+than as code tied to one ticker's dataframes, allows the same definitions to
+be evaluated for a single ticker's pandas Series or vectorized over numpy
+arrays holding a whole universe of tickers, e.g. a memory-mapped Panel.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import ast
+import collections
+import collections.abc
+import sys
+
+import numpy as np
+import pandas as pd
+
+# A ratio may refer to a ratio defined before it.
+RATIO_EXPRESSIONS = collections.OrderedDict(
+    [
+        # Debt to Cash Flow From Operations
+        ("debt_cfo_ratio", "debt / ncfo"),
+        # Debt to Equity
+        ("debt_equity_ratio", "debt / equity"),
+        ("liabilities_equity_ratio", "liabilities / equity"),
+        # Debt to ebitda
+        ("debt_ebitda_ratio", "debt / ebitda"),
+        # Debt to ebitda minus CapEx
+        # capex is returned from Sharadar as a -ve number, hence we need to add
+        # this to subtract capex
+        ("debt_ebitda_minus_capex_ratio", "debt / (ebitda + capex)"),
+        # Net Debt to ebitda
+        ("net_debt_ebitda_ratio", "(debt - cashnequsd) / ebitda"),
+        # Net Debt to ebitda minus CapEx
+        ("net_debt_ebitda_minus_capex_ratio", "(debt - cashnequsd) / (ebitda + capex)"),
+        # Depreciation to Cash Flow From Operations Pg 278.
+        ("depreciation_cfo_ratio", "depamor / ncfo"),
+        ("depreciation_revenue_ratio", "depamor / revenue"),
+        ("debt_to_total_capital", "debt / invcapavg"),
+        ("return_on_invested_capital", "ebit / invcapavg"),
+        # Times Interest coverage aka fixed charge coverage Pg 278.
+        # (Net Income + Income taxes + Interest Expense)/(Interest expense + Capitalized Interest)
+        # Cannot see how to get capitalized interest from the API so that term is excluded.
+        # This is the same as ebit to Interest Expense
+        ("ebit_interest_coverage", "ebit / intexp"),
+        ("ebitda_interest_coverage", "ebitda / intexp"),
+        # Recall that capex is returned from Sharadar as a -ve number.
+        ("ebitda_minus_capex_interest_coverage", "(ebitda + capex) / intexp"),
+        ("rough_ffo", "netinc + depamor"),
+        # capex is returned from Quandl as a -ve number, hence we add this to
+        # subtract capex
+        ("rough_affo", "netinc + depamor + capex"),
+        ("rough_ffo_dividend_payout_ratio", "ncfdiv / (netinc + depamor)"),
+        ("rough_affo_dividend_payout_ratio", "ncfdiv / (netinc + depamor + capex)"),
+        # negating since ncfdiv is returned as a negative number
+        ("income_dividend_payout_ratio", "-ncfdiv / netinc"),
+        ("rough_ffo_ps", "rough_ffo / shareswa"),
+        # TODO add some conditional logig to use the fullydiluted shares value when it
+        # is provided
+        ("price_rough_ffo_ps_ratio", "price / (rough_ffo / shareswa)"),
+        ("cfo_ps", "ncfo / shareswa"),
+        ("opinc_ps", "opinc / shareswa"),
+        ("fcf_ps", "fcf / shareswa"),
+        ("ev_opinc_ratio", "ev / opinc"),
+        # Kenneth Jeffrey Marshal, author of Good Stocks Cheap, definition
+        # of capital employed. He has two defnitions, one where cash is
+        # subtracted and one where it's not. Accrued expenses should be
+        # substracted but Is not available in the Sharadar API, probably a
+        # scour the footnotes thing if really wanted to include this.
+        (
+            "kjm_capital_employed_sub_cash",
+            "assets - cashnequsd - payables - deferredrev",
+        ),
+        ("kjm_capital_employed_with_cash", "assets - payables - deferredrev"),
+        ("kjm_roce_sub_cash", "opinc / kjm_capital_employed_sub_cash"),
+        ("kjm_roce_with_cash", "opinc / kjm_capital_employed_with_cash"),
+        (
+            "kjm_fcf_return_on_capital_employed_sub_cash",
+            "fcf / kjm_capital_employed_sub_cash",
+        ),
+        (
+            "kjm_fcf_return_on_capital_employed_with_cash",
+            "fcf / kjm_capital_employed_with_cash",
+        ),
+        ("kjm_delta_oi_fds", "pct_change(opinc_ps)"),
+        ("kjm_delta_fcf_fds", "pct_change(fcf_ps)"),
+        ("kjm_delta_bv_fds", "pct_change(equity)"),
+        ("kjm_delta_tbv_fds", "pct_change(equity - intangibles)"),
+        # negating since ncfdiv is returned as a negative number
+        ("dividends_free_cash_flow_ratio", "-ncfdiv / fcf"),
+        ("preferred_free_cash_flow_ratio", "prefdivis / fcf"),
+        ("operating_margin", "opinc / revenue"),
+        ("sg_and_a_gross_profit_ratio", "sgna / gp"),
+        ("ltdebt_cfo_ratio", "debtnc / ncfo"),
+        ("ltdebt_earnings_ratio", "debtnc / netinc"),
+        ("free_cash_flow_conversion_ratio", "fcf / ebitda"),
+        # Pg 290 of Creative Cash Flow Reporting, Mumford et al.
+        ("excess_cash_margin_ratio", "(ncfo - opinc) * 100 / revenue"),
+        ("interest_to_cfo_plus_interest_coverage", "intexp / (ncfo + intexp)"),
+        # negating since ncfdiv is returned as a negative number
+        ("dividends_cfo_ratio", "-ncfdiv / ncfo"),
+        ("preferred_cfo_ratio", "prefdivis / ncfo"),
+    ]
+)
+
+_compiled = {}
+
+
+def _compile(ratio):
+    code = _compiled.get(ratio)
+    if code is None:
+        code = compile(RATIO_EXPRESSIONS[ratio], ratio, "eval")
+        _compiled[ratio] = code
+    return code
+
+
+def group_pct_change(values, group_starts=None):
+    """The numpy equivalent of pandas Series.pct_change, within groups.
+
+    As with pandas missing values are forward filled before the change from
+    the previous value is calculated. Neither the forward fill nor the
+    previous value cross into a group from the one before it.
+
+    Args:
+        values: A 1-d float array.
+        group_starts: The sorted indices at which each group, e.g. each
+            ticker of a panel, starts. None for a single group.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0:
+        return values.copy()
+    starts = np.zeros(1, dtype=np.int64) if group_starts is None else group_starts
+    starts = np.asarray(starts, dtype=np.int64)
+    starts = starts[starts < n]
+
+    positions = np.arange(n)
+    fill_idx = np.where(np.isnan(values), 0, positions)
+    fill_idx[starts] = starts
+    np.maximum.accumulate(fill_idx, out=fill_idx)
+    filled = values[fill_idx]
+
+    previous = np.empty(n)
+    previous[1:] = filled[:-1]
+    previous[starts] = np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return filled / previous - 1
+
+
+def chain_pct_change(values, previous):
+    """As group_pct_change, with the previous value of each value given by
+    its index rather than being the one before it.
+
+    A panel holding restatements uses this to compare each row with the
+    latest version of the period before it, rather than with the row filed
+    before it. Missing values are forward filled along the chain of previous
+    values, as pandas does along a Series.
+
+    Args:
+        values: A 1-d float array.
+        previous: An int array, the index of each value's previous value,
+            -1 for none. Following it from any value must end at -1.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    previous = np.asarray(previous, dtype=np.int64)
+    fill_idx = np.arange(len(values))
+    todo = np.flatnonzero(np.isnan(values))
+    while len(todo):
+        fill_idx[todo] = previous[fill_idx[todo]]
+        todo = todo[fill_idx[todo] >= 0]
+        todo = todo[np.isnan(values[fill_idx[todo]])]
+    filled = np.where(fill_idx >= 0, values[np.maximum(fill_idx, 0)], np.nan)
+
+    before = np.where(previous >= 0, filled[np.maximum(previous, 0)], np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return filled / before - 1
+
+
+class RatioNamespace(collections.abc.Mapping):
+    """Resolves the names used in ratio expressions.
+
+    Names resolve to previously calculated ratios, then to indicator columns.
+    pct_change resolves to a Series, a chained or a grouped array
+    implementation depending on the type of its argument and whether the
+    previous row of each row is given.
+    """
+
+    def __init__(self, indicators, ratios, group_starts=None, previous=None):
+        self.indicators = indicators
+        self.ratios = ratios
+        self.group_starts = group_starts
+        self.previous = previous
+
+    def pct_change(self, values):
+        if isinstance(values, pd.Series):
+            return values.pct_change()
+        if self.previous is not None:
+            return chain_pct_change(values, self.previous)
+        return group_pct_change(values, self.group_starts)
+
+    def __getitem__(self, name):
+        if name == "pct_change":
+            return self.pct_change
+        if name in self.ratios:
+            return self.ratios[name]
+        return self.indicators[name]
+
+    def __iter__(self):
+        return iter(RATIO_EXPRESSIONS)
+
+    def __len__(self):
+        return len(RATIO_EXPRESSIONS)
+
+
+def evaluate_ratio(ratio, indicators, ratios, group_starts=None, previous=None):
+    """Evaluates one calculated ratio.
+
+    Args:
+        ratio: The name of a ratio in RATIO_EXPRESSIONS.
+        indicators: A mapping of Sharadar indicator codes to Series or arrays,
+            e.g. a dataframe.
+        ratios: A mapping holding the ratios calculated so far.
+        group_starts: For arrays holding several tickers, the index at which
+            each ticker's rows start.
+        previous: For arrays, the index of the row pct_change compares each
+            row with, -1 for none, in place of the row before it in its
+            group, see chain_pct_change.
+    Returns:
+        A Series or an array, matching the type of the indicators.
+    """
+    namespace = RatioNamespace(indicators, ratios, group_starts, previous)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return eval(_compile(ratio), {"__builtins__": {}}, namespace)
+
+
+def evaluate_ratios(ratios, indicators, group_starts=None, previous=None):
+    """Evaluates a list of ratios, in order, over arrays of indicators.
+
+    Returns:
+        An ordered dict of ratio name to array.
+    """
+    results = collections.OrderedDict()
+    for ratio in ratios:
+        results[ratio] = evaluate_ratio(
+            ratio, indicators, results, group_starts, previous
+        )
+    return results
+
+
+def with_dependencies(ratios):
+    """Returns the ratios needed to calculate ratios, in evaluation order.
+
+    Includes the ratios themselves and, recursively, the ratios their
+    expressions refer to.
+    """
+    needed = set(ratios)
+    for ratio in reversed(RATIO_EXPRESSIONS):
+        if ratio in needed:
+            needed.update(n for n in _compile(ratio).co_names if n in RATIO_EXPRESSIONS)
+    return [r for r in RATIO_EXPRESSIONS if r in needed]
+
+
+def ratio_inputs(ratios):
+    """Returns the indicator codes read by ratios, including those read by the
+    ratios their expressions refer to, in order.
+    """
+    inputs = []
+    for ratio in with_dependencies(ratios):
+        for name in _compile(ratio).co_names:
+            if name not in RATIO_EXPRESSIONS and name != "pct_change":
+                if name not in inputs:
+                    inputs.append(name)
+    return inputs
+
+
+# The precedence of the operators used in the expressions, highest last
+_PRECEDENCE = {
+    ast.Add: 1,
+    ast.Sub: 1,
+    ast.Mult: 2,
+    ast.Div: 2,
+    ast.FloorDiv: 2,
+    ast.Mod: 2,
+    ast.USub: 3,
+    ast.UAdd: 3,
+    ast.Pow: 4,
+}
+
+_SYMBOLS = {
+    ast.Add: "+",
+    ast.Sub: "-",
+    ast.Mult: "*",
+    ast.Div: "/",
+    ast.FloorDiv: "//",
+    ast.Mod: "%",
+    ast.USub: "-",
+    ast.UAdd: "+",
+    ast.Pow: "**",
+}
+
+
+def _precedence(node):
+    if isinstance(node, (ast.BinOp, ast.UnaryOp)):
+        return _PRECEDENCE[type(node.op)]
+    return 5
+
+
+def expression_source(node, name_format="%s"):
+    """Returns the source of a node of a parsed ratio expression.
+
+    As ast.unparse, which needs Python 3.9, for the arithmetic, names,
+    numbers and calls the expressions are made of.
+
+    Args:
+        node: An ast node, e.g. the body of ast.parse(expression, mode="eval").
+        name_format: The format each name is written with, e.g. "%s[i]".
+    """
+
+    def source(child, parenthesize):
+        text = expression_source(child, name_format)
+        return "(%s)" % text if parenthesize else text
+
+    if isinstance(node, ast.Expression):
+        return expression_source(node.body, name_format)
+    if isinstance(node, ast.Name):
+        return name_format % node.id
+    if isinstance(node, ast.Constant):
+        return repr(node.value)
+    if sys.version_info < (3, 8) and isinstance(node, ast.Num):
+        return repr(node.n)
+    if isinstance(node, ast.BinOp):
+        precedence = _precedence(node)
+        # Only ** is right associative
+        right_first = isinstance(node.op, ast.Pow)
+        return "%s %s %s" % (
+            source(node.left, _precedence(node.left) < precedence + right_first),
+            _SYMBOLS[type(node.op)],
+            source(
+                node.right, _precedence(node.right) < precedence + (not right_first)
+            ),
+        )
+    if isinstance(node, ast.UnaryOp):
+        return "%s%s" % (
+            _SYMBOLS[type(node.op)],
+            source(node.operand, _precedence(node.operand) < _precedence(node)),
+        )
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        return "%s(%s)" % (
+            node.func.id,
+            ", ".join(expression_source(arg, name_format) for arg in node.args),
+        )
+    raise ValueError("Unsupported in a ratio expression: %s" % ast.dump(node))
@@ -0,0 +1,230 @@
+"""Isolating the tickers which fail, and backing off an upstream in trouble.
+
+A long build used to stop at the first ticker whose fetch raised anything
+other than a NotFoundError, e.g. a timeout or a malformed response,
+throwing away every sheet calculated so far. With a DeadLetters given to
+stock_xlsx a ticker whose fetch, calculation or writing fails is instead
+skipped and recorded, and the rest of the workbook is built. The dead letters are
+written as a ticker file, one failed ticker per line followed by why as a
+comment, which can be given straight back with -i to retry just them.
+
+When the upstream itself is failing, e.g. throttling every request, retrying
+each ticker only makes things worse. A CircuitBreaker shared by the fetch
+threads watches the outcome of the recent requests:
+
+    closed     requests are made, until the error rate of the last window
+               requests reaches threshold
+    open       requests are paused for cooldown seconds
+    half open  a single trial request is made, closing the breaker if it
+               succeeds, reopening it for twice the cooldown if it fails
+
+After max_trials failed trials in a row the breaker gives up on the
+upstream, every later request failing at once with CircuitOpenError, so
+that the remaining tickers are dead lettered rather than waited on.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import collections
+import logging
+import os
+import threading
+import time
+
+from quandl.errors.quandl_error import NotFoundError
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("fetch", "compute", "write")
+
+
+class CircuitOpenError(Exception):
+    """Raised for a request refused once the circuit breaker has given up."""
+
+
+class CircuitBreaker(object):
+    """Pauses the requests to an upstream whose error rate spikes.
+
+    Args:
+        threshold: The fraction of failed requests opening the breaker.
+        window: The number of most recent requests the fraction is of.
+        min_requests: The requests needed before the breaker may open.
+        cooldown: The seconds the requests are first paused for.
+        max_cooldown: The most seconds the requests are paused for.
+        max_trials: The failed trial requests in a row after which the
+            breaker gives up, None to never give up.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half open"
+
+    def __init__(
+        self,
+        threshold=0.5,
+        window=20,
+        min_requests=5,
+        cooldown=30,
+        max_cooldown=300,
+        max_trials=5,
+    ):
+        self.threshold = threshold
+        self.min_requests = min_requests
+        self.initial_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_trials = max_trials
+        self.state = self.CLOSED
+        self.cooldown = cooldown
+        self.opened = 0
+        self.failed_trials = 0
+        self._outcomes = collections.deque(maxlen=window)
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def is_failure(exc):
+        """Whether an exception counts against the upstream. An unsupported
+        ticker is an answer, not a failure.
+        """
+        return not isinstance(exc, NotFoundError)
+
+    def call(self, function, *args, **kwargs):
+        """Calls function once the breaker lets the request through.
+
+        Raises:
+            CircuitOpenError: If the breaker has given up on the upstream.
+        """
+        trial = self._before()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as exc:
+            self._after(not self.is_failure(exc), trial)
+            raise
+        self._after(True, trial)
+        return result
+
+    def _before(self):
+        with self._condition:
+            while True:
+                if (
+                    self.max_trials is not None
+                    and self.failed_trials >= self.max_trials
+                ):
+                    raise CircuitOpenError(
+                        "Gave up on the upstream after %d failed trial requests"
+                        % (self.failed_trials)
+                    )
+                if self.state == self.CLOSED:
+                    return False
+                if self.state == self.OPEN:
+                    remaining = self._opened_at + self.cooldown - time.monotonic()
+                    if remaining <= 0:
+                        self.state = self.HALF_OPEN
+                        self._trial_in_flight = True
+                        return True
+                    self._condition.wait(remaining)
+                elif self._trial_in_flight:
+                    self._condition.wait()
+                else:
+                    self._trial_in_flight = True
+                    return True
+
+    def _after(self, succeeded, trial):
+        with self._condition:
+            if trial:
+                self._trial_in_flight = False
+                if succeeded:
+                    logger.info("Resuming the requests, the trial request succeeded")
+                    self.state = self.CLOSED
+                    self.cooldown = self.initial_cooldown
+                    self.failed_trials = 0
+                    self._outcomes.clear()
+                else:
+                    self.failed_trials += 1
+                    self.cooldown = min(2 * self.cooldown, self.max_cooldown)
+                    self._open()
+            else:
+                self._outcomes.append(succeeded)
+                failed = self._outcomes.count(False)
+                if (
+                    self.state == self.CLOSED
+                    and len(self._outcomes) >= self.min_requests
+                    and failed >= self.threshold * len(self._outcomes)
+                ):
+                    logger.warning(
+                        "%d of the last %d requests failed",
+                        failed,
+                        len(self._outcomes),
+                    )
+                    self._open()
+            self._condition.notify_all()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened += 1
+        self._opened_at = time.monotonic()
+        logger.warning("Pausing the requests for %.0f s", self.cooldown)
+
+
+class DeadLetters(object):
+    """The tickers skipped by a build as their fetch, calculation or writing
+    failed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.failures = collections.OrderedDict()
+
+    def __len__(self):
+        with self._lock:
+            return len(self.failures)
+
+    def add(self, ticker, stage, exc):
+        """Records a ticker's failure.
+
+        Args:
+            ticker: The ticker.
+            stage: One of STAGES, where it failed.
+            exc: The exception raised.
+        """
+        reason = "%s: %s" % (type(exc).__name__, exc)
+        # A single line, to follow the ticker in its file
+        reason = " ".join(reason.split())
+        logger.warning(
+            "Skipping the stock %s, its %s failed: %s", ticker, stage, reason
+        )
+        with self._lock:
+            self.failures[ticker] = (stage, reason)
+
+    def tickers(self):
+        with self._lock:
+            return list(self.failures)
+
+    def update(self, failures):
+        """Records the failures of another DeadLetters, e.g. one in a render
+        process.
+        """
+        with self._lock:
+            self.failures.update(failures)
+
+    def write(self, path):
+        """Writes the failed tickers to a ticker file, each followed by the
+        stage and reason it failed as a comment. With no failed tickers any
+        file left by an earlier build is removed.
+        """
+        with self._lock:
+            lines = [
+                "%s  # %s %s\n" % (ticker, stage, reason)
+                for ticker, (stage, reason) in self.failures.items()
+            ]
+        if not lines:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp_path = "%s.tmp" % path
+        with open(tmp_path, "w") as d_file:
+            d_file.writelines(lines)
+        os.replace(tmp_path, path)
+        logger.warning("Wrote the %d stocks which failed to %s", len(lines), path)
@@ -0,0 +1,138 @@
+"""Screens a universe of stocks on the latest values of their indicators.
+
+A screen is a boolean expression over Sharadar indicator codes and the
+names of calculated ratios, e.g.
+"net_debt_ebitda_ratio < 3 and operating_margin > 0.1". It is evaluated
+with DataFrame.eval over a dataframe holding the latest values of every
+stock, rather than stock by stock.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import ast
+import logging
+
+import pandas as pd
+
+from .ratios import RATIO_EXPRESSIONS
+
+logger = logging.getLogger(__name__)
+
+# The numeric indicator codes of the SHARADAR/SF1 table
+SF1_INDICATORS = frozenset(
+    """
+    accoci assets assetsavg assetsc assetsnc assetturnover bvps capex cashneq
+    cashnequsd cor consolinc currentratio de debt debtc debtnc debtusd
+    deferredrev depamor deposits divyield dps ebit ebitda ebitdamargin
+    ebitdausd ebitusd ebt eps epsdil epsusd equity equityavg equityusd ev
+    evebit evebitda fcf fcfps fxusd gp grossmargin intangibles intexp invcap
+    invcapavg inventory investments investmentsc investmentsnc liabilities
+    liabilitiesc liabilitiesnc marketcap ncf ncfbus ncfcommon ncfdebt ncfdiv
+    ncff ncfi ncfinv ncfo ncfx netinc netinccmn netinccmnusd netincdis
+    netincnci netmargin opex opinc payables payoutratio pb pe pe1 ppnenet
+    prefdivis price ps ps1 receivables retearn revenue revenueusd rnd roa roe
+    roic ros sbcomp sgna sharefactor sharesbas shareswa shareswadil sps
+    tangibles taxassets taxexp taxliabilities tbvps workingcapital
+    """.split()
+)
+
+
+def check_screen(expression):
+    """Checks a screen before any stocks are fetched.
+
+    Raises:
+        ValueError: If the expression is not a valid Python expression, or
+            refers to names which are neither SF1 indicator codes nor
+            calculated ratios.
+    """
+    try:
+        ast.parse(expression, mode="eval")
+    except SyntaxError as exc:
+        raise ValueError("Invalid screen %r: %s" % (expression, exc.msg))
+    unknown = [
+        name
+        for name in screen_names(expression)
+        if name not in SF1_INDICATORS and name not in RATIO_EXPRESSIONS
+    ]
+    if unknown:
+        raise ValueError(
+            "Invalid screen %r: unknown indicators or ratios %s"
+            % (expression, ", ".join(unknown))
+        )
+
+
+def screen_names(expression):
+    """Returns the indicator codes and ratio names a screen refers to.
+
+    The names of the functions it calls, such as abs, are not included.
+    """
+    tree = ast.parse(expression, mode="eval")
+    functions = {
+        node.func
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+    }
+    names = []
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Name)
+            and node not in functions
+            and node.id not in names
+        ):
+            names.append(node.id)
+    return names
+
+
+def latest_values(funds):
+    """Collects the latest indicators and calculated ratios of stocks.
+
+    Args:
+        funds: A list of (stock, SharadarFundamentals) tuples, with the
+            ratios calculated.
+    Returns:
+        A dataframe indexed by stock with a float column per indicator and
+        ratio. Values which are missing or not numeric are NaN.
+    """
+    index = pd.Index([stock for stock, _ in funds], name="ticker")
+    if not funds:
+        return pd.DataFrame(index=index)
+    sf1_df = pd.concat([fund.all_inds_df.tail(1) for _, fund in funds])
+    ratios_df = pd.concat(
+        [fund.calc_ratios_df.tail(1).drop(columns="datekey") for _, fund in funds]
+    )
+    latest = pd.concat(
+        [sf1_df.set_axis(index, axis=0), ratios_df.set_axis(index, axis=0)], axis=1
+    )
+    return latest.apply(pd.to_numeric, errors="coerce")
+
+
+def screen_stocks(latest, expression):
+    """Evaluates a screen over the latest values of a universe.
+
+    Stocks for which a value used by the screen is missing fail any
+    comparison involving it, so do not pass the screen.
+
+    Args:
+        latest: A dataframe indexed by stock, as returned by latest_values.
+        expression: The screen, a boolean expression over the columns of
+            latest.
+    Returns:
+        A list of the stocks passing the screen, in the order of latest.
+    Raises:
+        ValueError: If the screen refers to an unknown indicator or is not a
+            boolean expression.
+    """
+    if latest.empty:
+        return []
+    try:
+        passed = latest.eval(expression)
+    except NameError as exc:
+        raise ValueError("Invalid screen %r: %s" % (expression, exc))
+    if not pd.api.types.is_bool_dtype(passed):
+        raise ValueError("The screen %r is not a boolean expression" % expression)
+    survivors = latest.index[passed.to_numpy()].tolist()
+    logger.info(
+        "%d of %d stocks pass the screen %s", len(survivors), len(latest), expression
+    )
+    return survivors
@@ -0,0 +1,207 @@
+"""A long running HTTP service building workbooks on request.
+
+Each run of the quandl_fund_xlsx command pays for starting the interpreter,
+importing pandas and fetching every ticker from Quandl. The service keeps all
+of that warm between requests: the fetched indicators are held in an
+IndicatorCache shared by concurrent requests, and the Quandl client reuses a
+single pooled HTTP session while the service runs. The cached indicators are
+fetched again once older than the cache's ttl, picking up new filings.
+
+Requests::
+
+    GET /workbook?tickers=AAPL,INTC&dimension=MRY&periods=5&format=xlsx
+
+or a POST to /workbook with one ticker per line in the body. The format is
+xlsx (the default) or parquet, the latter requiring pyarrow.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import contextlib
+import io
+import logging
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+from quandl.connection import Connection
+from requests.adapters import HTTPAdapter
+
+from .cache import IndicatorCache
+from .cassette import _ThreadingHTTPServer
+from .fundamentals import (
+    SharadarFundamentals,
+    fundamentals_frame,
+    normalize_tickers,
+    stock_xlsx,
+)
+
+logger = logging.getLogger(__name__)
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+PARQUET_CONTENT_TYPE = "application/vnd.apache.parquet"
+
+DIMENSIONS = ("MRY", "ARY", "MRT", "ART", "MRQ", "ARQ")
+
+# Size of the chunks the response body is written in.
+CHUNK_SIZE = 64 * 1024
+
+
+@contextlib.contextmanager
+def share_quandl_session(pool_size):
+    """Makes the Quandl client reuse one pooled session for all requests
+    within the context, restoring its own sessions on leaving it.
+
+    By default the client creates a new requests session, and so a new
+    connection, for every API call.
+
+    Yields:
+        The shared session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Connection.get_retries(),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    get_session = Connection.__dict__["get_session"]
+    Connection.get_session = classmethod(lambda cls: session)
+    try:
+        yield session
+    finally:
+        Connection.get_session = get_session
+        session.close()
+
+
+class WorkbookServer(_ThreadingHTTPServer):
+    """Serves workbooks built from a cache shared between requests."""
+
+    def __init__(self, address, database, workers=4, cache=None):
+        HTTPServer.__init__(self, address, WorkbookRequestHandler)
+        self.database = database
+        self.workers = workers
+        self.cache = cache if cache is not None else IndicatorCache()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+
+class WorkbookRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        tickers = []
+        for value in params.get("tickers", []):
+            tickers.extend(value.split(","))
+        self._handle(url.path, params, tickers)
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        self._handle(url.path, params, body.splitlines())
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+    def _handle(self, path, params, tickers):
+        if path != "/workbook":
+            self.send_error(404, "Unknown path %s" % path)
+            return
+
+        tickers = normalize_tickers(tickers)
+        dimension = params.get("dimension", ["MRY"])[0]
+        periods = params.get("periods", ["5"])[0]
+        out_format = params.get("format", ["xlsx"])[0]
+        if not tickers:
+            self.send_error(400, "No tickers requested")
+            return
+        if dimension not in DIMENSIONS:
+            self.send_error(400, "Unknown dimension %s" % dimension)
+            return
+        if not periods.isdigit():
+            self.send_error(400, "periods must be an integer")
+            return
+        periods = int(periods)
+        if out_format not in ("xlsx", "parquet"):
+            self.send_error(400, "Unknown format %s" % out_format)
+            return
+
+        try:
+            body, content_type = self._build(tickers, dimension, periods, out_format)
+        except ImportError as exc:
+            self.send_error(501, str(exc))
+            return
+        except Exception:
+            logger.exception("Failed to build the %s for %s", out_format, tickers)
+            self.send_error(500, "Failed to build the %s" % out_format)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header(
+            "Content-Disposition", 'attachment; filename="stocks.%s"' % out_format
+        )
+        self.end_headers()
+        for start in range(0, len(body), CHUNK_SIZE):
+            self.wfile.write(body[start : start + CHUNK_SIZE])
+
+    def _build(self, tickers, dimension, periods, out_format):
+        server = self.server
+        buf = io.BytesIO()
+        if out_format == "xlsx":
+            stock_xlsx(
+                buf,
+                tickers,
+                server.database,
+                dimension,
+                periods,
+                workers=server.workers,
+                cache=server.cache,
+            )
+            return buf.getbuffer(), XLSX_CONTENT_TYPE
+
+        frame = fundamentals_frame(
+            tickers,
+            server.database,
+            dimension,
+            periods,
+            workers=server.workers,
+            cache=server.cache,
+        )
+        frame.to_parquet(buf, index=False)
+        return buf.getbuffer(), PARQUET_CONTENT_TYPE
+
+
+def serve(host, port, database, workers=4, cache_mb=256, cache_ttl=3600):
+    """Runs the workbook service until interrupted.
+
+    Args:
+        host: The address to listen on.
+        port: The port to listen on.
+        database: The Sharadar database, SF0 or SF1.
+        workers: The number of concurrent fetches for each request.
+        cache_mb: The memory bound, in MB, of the least recently used cache of
+            indicators and ratios.
+        cache_ttl: The seconds after which a ticker's cached indicators and
+            ratios are fetched and calculated again, None to keep them.
+    """
+    # Checks the API key is set before accepting any requests.
+    SharadarFundamentals(database)
+    cache = IndicatorCache(max_bytes=cache_mb * 1024 * 1024, ttl=cache_ttl)
+    server = WorkbookServer((host, port), database, workers=workers, cache=cache)
+    logger.info("Serving workbooks on %s", server.url)
+    try:
+        with share_quandl_session(pool_size=workers):
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
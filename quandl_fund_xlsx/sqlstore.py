@@ -0,0 +1,182 @@
+"""An embedded SQL store of fetched indicators and calculated ratios.
+
+Screening a universe, e.g. every ticker with a debt_ebitda_ratio under 2,
+should not need the workbooks to be regenerated. The SQLStore keeps each
+ticker's Sharadar indicators and calculated ratios in an SQLite database,
+one row per ticker, dimension and datekey, so that such questions can be
+asked in SQL with the filtering and aggregation done by the database engine.
+
+The store holds one table and one view::
+
+    fundamentals  the indicators followed by the calculated ratios, keyed and
+                  indexed by (ticker, dimension, datekey)
+    latest        the most recent row of each ticker and dimension
+
+Dates are stored as ISO 8601 text, which sorts and compares correctly.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import logging
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TABLE = "fundamentals"
+
+KEY_COLUMNS = ("ticker", "dimension", "datekey")
+
+DATE_COLUMNS = ("datekey", "calendardate", "reportperiod", "lastupdated")
+
+# The pandas inferred types stored as REAL, "empty" being a column of NaN
+NUMERIC_KINDS = ("floating", "integer", "mixed-integer-float", "decimal", "empty")
+
+LATEST_VIEW = """
+CREATE VIEW IF NOT EXISTS latest AS
+SELECT f.* FROM fundamentals AS f
+JOIN (
+    SELECT ticker, dimension, MAX(datekey) AS datekey
+    FROM fundamentals GROUP BY ticker, dimension
+) AS m USING (ticker, dimension, datekey)
+"""
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+class SQLStore(object):
+    """Indicators and calculated ratios for many tickers, queryable in SQL.
+
+    Args:
+        path: The SQLite database file, created if it does not exist.
+            ":memory:" for a store which is not persisted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(str(path))
+        # Each ticker is added in its own transaction, WAL makes those cheap
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        table_info = self.conn.execute("PRAGMA table_info(%s)" % TABLE)
+        self.columns = [row[1] for row in table_info]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, sf1_df, calc_ratios_df=None):
+        """Adds or replaces the rows of a ticker, removing those of its rows
+        with the same dimension which are no longer in sf1_df.
+
+        Args:
+            sf1_df: The indicators, as returned by get_indicators.
+            calc_ratios_df: The calculated ratios for the same rows, as
+                returned by calc_ratios.
+        """
+        frame = sf1_df
+        if calc_ratios_df is not None:
+            frame = pd.concat([sf1_df, calc_ratios_df.drop(columns="datekey")], axis=1)
+
+        with self.conn:
+            self._add_columns(frame)
+            keys = frame[["ticker", "dimension"]].drop_duplicates()
+            self.conn.executemany(
+                "DELETE FROM %s WHERE ticker = ? AND dimension = ?" % TABLE,
+                keys.itertuples(index=False, name=None),
+            )
+            columns = [c for c in frame.columns if c in self.columns]
+            sql = "INSERT OR REPLACE INTO %s (%s) VALUES (%s)" % (
+                TABLE,
+                ", ".join(_quote(c) for c in columns),
+                ", ".join("?" * len(columns)),
+            )
+            self.conn.executemany(sql, self._rows(frame[columns]))
+
+    def add_fund(self, fund):
+        """Adds the indicators and ratios held by a SharadarFundamentals."""
+        self.add(fund.all_inds_df, fund.calc_ratios_df)
+
+    def query(self, sql, params=()):
+        """Runs an SQL query, returning the result as a dataframe."""
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def screen(self, where, columns=None, dimension=None, params=()):
+        """Selects the latest row of each ticker matching an SQL condition.
+
+        Args:
+            where: An SQL expression over the indicators and ratios,
+                e.g. "debt_ebitda_ratio < 2 AND roe > 0.1".
+            columns: The columns to return, in addition to the ticker,
+                dimension and datekey. Defaults to all of them.
+            dimension: Only screen rows of this dimension.
+            params: Values for any ? placeholders in where.
+        Returns:
+            A dataframe with a row per matching ticker, ordered by ticker.
+        """
+        if columns is None:
+            selected = "*"
+        else:
+            selected = ", ".join(_quote(c) for c in list(KEY_COLUMNS) + list(columns))
+        sql = "SELECT %s FROM latest WHERE (%s)" % (selected, where)
+        params = list(params)
+        if dimension is not None:
+            sql += " AND dimension = ?"
+            params.append(dimension)
+        return self.query(sql + " ORDER BY ticker", params)
+
+    def tickers(self):
+        rows = self.conn.execute("SELECT DISTINCT ticker FROM %s ORDER BY ticker" % TABLE)
+        return [row[0] for row in rows]
+
+    def _add_columns(self, frame):
+        if not self.columns:
+            missing = [c for c in KEY_COLUMNS if c not in frame.columns]
+            if missing:
+                raise ValueError("The rows have no %s column" % ", ".join(missing))
+            self.conn.execute(
+                "CREATE TABLE %s (%s, PRIMARY KEY (%s))"
+                % (
+                    TABLE,
+                    ", ".join(self._column_def(frame, c) for c in frame.columns),
+                    ", ".join(KEY_COLUMNS),
+                )
+            )
+            self.conn.execute(LATEST_VIEW)
+            self.columns = list(frame.columns)
+            return
+
+        for name in frame.columns:
+            if name not in self.columns:
+                column_def = self._column_def(frame, name)
+                self.conn.execute("ALTER TABLE %s ADD COLUMN %s" % (TABLE, column_def))
+                self.columns.append(name)
+
+    @staticmethod
+    def _column_def(frame, name):
+        # The calculated ratios are object columns, holding None for NaN
+        kind = pd.api.types.infer_dtype(frame[name], skipna=True)
+        if name not in DATE_COLUMNS and kind in NUMERIC_KINDS:
+            return "%s REAL" % _quote(name)
+        return "%s TEXT" % _quote(name)
+
+    @staticmethod
+    def _rows(frame):
+        frame = frame.copy()
+        for name in DATE_COLUMNS:
+            if name in frame.columns:
+                frame[name] = pd.to_datetime(frame[name]).dt.strftime("%Y-%m-%d")
+        values = frame.astype(object).to_numpy()
+        values[pd.isna(values)] = None
+        for row in values:
+            yield tuple(v.item() if isinstance(v, np.generic) else v for v in row)
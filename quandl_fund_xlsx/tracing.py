@@ -0,0 +1,123 @@
+"""Structured trace events of a build, costing nothing while disabled.
+
+Each stage of a ticker's build, fetching its indicators, calculating its
+ratios, rendering and writing its sheet, is traced as a span. Once enabled
+with enable, every span is written on completion as a JSON line e.g.
+
+    {"ts": 1634567890.12, "stage": "fetch", "ticker": "AAPL",
+     "duration_ms": 412.7, "thread": "pipeline-fetch-0", "rows": 5}
+
+the fields beyond the stage and ticker being those set on the span, such as
+the rows fetched. The lines are for loading into e.g. pandas.read_json with
+lines=True, to see where the time of a slow build went.
+
+While disabled, the default, span returns a shared span which does
+nothing, so tracing a stage costs a function call and nothing is formatted,
+see benchmarks/bench_tracing.py.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# The file the events are written to, None while disabled
+_sink = None
+_lock = threading.Lock()
+
+
+class _NoSpan(object):
+    """The span of a disabled tracer."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Span(object):
+    """Times a stage, writing its event when it completes.
+
+    An exception raised in the span is recorded in the event's error field.
+    """
+
+    def __init__(self, stage, ticker, fields):
+        self.event = {"ts": None, "stage": stage, "ticker": ticker}
+        self.event.update(fields)
+        self._start = None
+
+    def __enter__(self):
+        self.event["ts"] = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.event["duration_ms"] = (time.perf_counter() - self._start) * 1000
+        self.event["thread"] = threading.current_thread().name
+        if exc_type is not None:
+            self.event["error"] = exc_type.__name__
+        emit(self.event)
+        return False
+
+    def set(self, **fields):
+        """Adds fields to the span's event, e.g. the rows fetched."""
+        self.event.update(fields)
+
+
+def enabled():
+    return _sink is not None
+
+
+def span(stage, ticker=None, **fields):
+    """Returns a context manager tracing a stage of a ticker's build.
+
+    Args:
+        stage: The stage, e.g. fetch.
+        ticker: The ticker, if the stage is of a single ticker.
+        fields: Further fields of the event, which may also be set on the
+            span before it completes.
+    """
+    if _sink is None:
+        return _NO_SPAN
+    return Span(stage, ticker, fields)
+
+
+def emit(event):
+    """Writes an event, a dict of JSON serializable values, if enabled."""
+    if _sink is None:
+        return
+    line = json.dumps(event, default=str) + "\n"
+    with _lock:
+        # Unless disabled meanwhile
+        if _sink is not None:
+            _sink.write(line)
+
+
+def enable(path):
+    """Starts writing the events to a JSON lines file, appending to it."""
+    global _sink
+    disable()
+    with _lock:
+        _sink = open(path, "a", buffering=1)
+    logger.info("Tracing the build to %s", path)
+
+
+def disable():
+    """Stops writing events, closing the file."""
+    global _sink
+    with _lock:
+        sink, _sink = _sink, None
+    if sink is not None:
+        sink.close()
@@ -0,0 +1,304 @@
+"""Data quality checks of the fetched indicators and the ratios from them.
+
+Dividing by a zero denominator gives an inf, or a nan for 0 / 0, which used
+to be written to the sheets as a big recognizable number and then skewed the
+summary sheet's color scales and sorting. Instead the ratios whose
+denominator is zero are masked as nan, and the checks below are reported in
+an issues table with a row per problem found:
+
+    zero_denominator      a ratio's denominator is zero, the ratio is masked
+    negative_denominator  a ratio's denominator is negative, e.g. debt to a
+                          negative ebitda, the ratio is kept but is suspect
+    missing_period        the calendardate jumps by more than one period
+    duplicate_datekey     a ticker has more than one row for a datekey
+    restated              a ticker has more than one row for a calendardate,
+                          with a different value of an indicator
+
+The checks are vectorized over every row at once, so the same functions
+validate one ticker's frame or a whole panel.
+
+:copyright: (c) 2021 by Robert Rennison
+:license: Apache 2, see LICENCE for more details
+
+"""
+import ast
+import functools
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from .ratios import RATIO_EXPRESSIONS, RatioNamespace, expression_source
+
+logger = logging.getLogger(__name__)
+
+ISSUE_COLUMNS = ["ticker", "datekey", "check", "indicator", "value"]
+
+CHECKS = (
+    "zero_denominator",
+    "negative_denominator",
+    "missing_period",
+    "duplicate_datekey",
+    "restated",
+)
+
+DATE_COLUMNS = ("datekey", "calendardate", "reportperiod", "lastupdated")
+
+# The months between periods, by the last letter of the dimension
+PERIOD_MONTHS = {"Y": 12, "Q": 3, "T": 3}
+
+
+@functools.lru_cache(maxsize=None)
+def denominators(ratio):
+    """Returns the source of each denominator in a ratio's expression."""
+    tree = ast.parse(RATIO_EXPRESSIONS[ratio], mode="eval")
+    return tuple(
+        expression_source(node.right)
+        for node in ast.walk(tree)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _compile(denominator):
+    return compile(denominator, denominator, "eval")
+
+
+def empty_issues():
+    return pd.DataFrame(columns=ISSUE_COLUMNS)
+
+
+def _issues(check, tickers, datekeys, indicator, values):
+    return pd.DataFrame(
+        {
+            "ticker": tickers,
+            "datekey": datekeys,
+            "check": check,
+            "indicator": indicator,
+            "value": np.asarray(values, dtype=np.float64),
+        },
+        columns=ISSUE_COLUMNS,
+    )
+
+
+def ratio_issues(
+    ratios, indicators, calculated, tickers, datekeys, group_starts=None, previous=None
+):
+    """Checks the denominators of ratios.
+
+    Args:
+        ratios: The ratio names to check.
+        indicators: A mapping of indicator codes to Series or arrays.
+        calculated: A mapping holding the calculated ratios which the
+            denominators may refer to.
+        tickers: The ticker of each row.
+        datekeys: The datekey of each row.
+        group_starts: For arrays holding several tickers, the index at which
+            each ticker's rows start.
+        previous: The row pct_change compares each row with, as for
+            ratios.evaluate_ratio.
+    Returns:
+        The issues, and a dict of ratio name to a boolean array of the rows
+        where its denominator is zero.
+    """
+    namespace = RatioNamespace(indicators, calculated, group_starts, previous)
+    tickers = np.asarray(tickers)
+    datekeys = np.asarray(datekeys)
+    found = []
+    zero = {}
+    for ratio in ratios:
+        for denominator in denominators(ratio):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = eval(_compile(denominator), {"__builtins__": {}}, namespace)
+            values = np.asarray(values, dtype=np.float64)
+            is_zero = values == 0
+            is_negative = values < 0
+            if is_zero.any():
+                zero[ratio] = zero.get(ratio, False) | is_zero
+                found.append(
+                    _issues(
+                        "zero_denominator",
+                        tickers[is_zero],
+                        datekeys[is_zero],
+                        ratio,
+                        values[is_zero],
+                    )
+                )
+            if is_negative.any():
+                found.append(
+                    _issues(
+                        "negative_denominator",
+                        tickers[is_negative],
+                        datekeys[is_negative],
+                        ratio,
+                        values[is_negative],
+                    )
+                )
+    return concat_issues(found), zero
+
+
+def period_issues(tickers, datekeys, calendardates, dimension):
+    """Checks for missing periods and duplicate datekeys.
+
+    Args:
+        tickers: The ticker of each row, the rows of a ticker being
+            contiguous and sorted by datekey.
+        datekeys: The datekey of each row.
+        calendardates: The calendardate of each row.
+        dimension: The Sharadar dimension, e.g. MRY, giving the period.
+    """
+    tickers = np.asarray(tickers)
+    datekeys = np.asarray(datekeys, dtype="datetime64[ns]")
+    found = []
+    if len(tickers) < 2:
+        return empty_issues()
+    same_ticker = tickers[1:] == tickers[:-1]
+
+    duplicate = np.concatenate([[False], same_ticker & (datekeys[1:] == datekeys[:-1])])
+    if duplicate.any():
+        found.append(
+            _issues(
+                "duplicate_datekey",
+                tickers[duplicate],
+                datekeys[duplicate],
+                "datekey",
+                np.ones(duplicate.sum()),
+            )
+        )
+
+    months = PERIOD_MONTHS.get((dimension or "")[-1:])
+    if months is not None:
+        month = np.asarray(calendardates, dtype="datetime64[M]").astype(np.int64)
+        periods = np.diff(month) / months
+        gap = np.concatenate([[False], same_ticker & (periods > 1)])
+        if gap.any():
+            found.append(
+                _issues(
+                    "missing_period",
+                    tickers[gap],
+                    datekeys[gap],
+                    "calendardate",
+                    # The number of periods missing before the row
+                    np.ceil(periods[gap[1:]]) - 1,
+                )
+            )
+    return concat_issues(found)
+
+
+def restatement_issues(tickers, datekeys, calendardates, indicators, columns):
+    """Checks for rows of the same ticker and calendardate whose indicators
+    differ, the later rows restating the earlier ones.
+
+    Args:
+        tickers: The ticker of each row.
+        datekeys: The datekey of each row.
+        calendardates: The calendardate of each row.
+        indicators: A mapping of indicator codes to Series or arrays.
+        columns: The indicator columns to compare.
+    Returns:
+        The issues, one per restated indicator, holding the restated value.
+    """
+    tickers = np.asarray(tickers)
+    datekeys = np.asarray(datekeys, dtype="datetime64[ns]")
+    calendardates = np.asarray(calendardates, dtype="datetime64[ns]")
+    order = np.lexsort((datekeys, calendardates, tickers))
+    tickers, datekeys = tickers[order], datekeys[order]
+    calendardates = calendardates[order]
+    same = (tickers[1:] == tickers[:-1]) & (calendardates[1:] == calendardates[:-1])
+    if not same.any():
+        return empty_issues()
+
+    rows = np.flatnonzero(same) + 1
+    found = []
+    for column in columns:
+        values = np.asarray(indicators[column], dtype=np.float64)[order]
+        later, earlier = values[rows], values[rows - 1]
+        changed = (later != earlier) & ~(np.isnan(later) & np.isnan(earlier))
+        if changed.any():
+            found.append(
+                _issues(
+                    "restated",
+                    tickers[rows][changed],
+                    datekeys[rows][changed],
+                    column,
+                    later[changed],
+                )
+            )
+    return concat_issues(found)
+
+
+def validate_frame(sf1_df, calculated, dimension, ratios=None):
+    """Runs every check over a frame of indicators, of one or more tickers.
+
+    Args:
+        sf1_df: A dataframe as returned by get_indicators, or several of them
+            concatenated.
+        calculated: A mapping holding the calculated ratios, unmasked.
+        dimension: The Sharadar dimension.
+        ratios: The ratios to check, by default those in calculated.
+    Returns:
+        The issues, and the zero denominator masks as returned by
+        ratio_issues.
+    """
+    if ratios is None:
+        ratios = [r for r in calculated if r in RATIO_EXPRESSIONS]
+    tickers = sf1_df["ticker"].to_numpy()
+    datekeys = sf1_df["datekey"].to_numpy()
+
+    calendardates = sf1_df["calendardate"].to_numpy()
+
+    issues, zero = ratio_issues(ratios, sf1_df, calculated, tickers, datekeys)
+    found = [issues, period_issues(tickers, datekeys, calendardates, dimension)]
+    numeric = [
+        c
+        for c in sf1_df.columns
+        if c not in DATE_COLUMNS and pd.api.types.is_numeric_dtype(sf1_df[c])
+    ]
+    found.append(
+        restatement_issues(tickers, datekeys, calendardates, sf1_df, numeric)
+    )
+    return concat_issues(found), zero
+
+
+def mask_ratios(calculated, zero):
+    """Sets the ratios with a zero denominator, and any other inf, to nan.
+
+    Args:
+        calculated: A dataframe or a dict of ratio name to array, updated in
+            place.
+        zero: The zero denominator masks, as returned by ratio_issues.
+    """
+    for ratio in list(calculated.keys()):
+        if ratio not in RATIO_EXPRESSIONS:
+            continue
+        values = np.asarray(calculated[ratio], dtype=np.float64)
+        bad = ~np.isfinite(values)
+        if ratio in zero:
+            bad |= zero[ratio]
+        if bad.any():
+            calculated[ratio] = np.where(bad, np.nan, values)
+
+
+def concat_issues(found):
+    """Concatenates issues dataframes."""
+    found = [f for f in found if f is not None and len(f)]
+    if not found:
+        return empty_issues()
+    return pd.concat(found, ignore_index=True)
+
+
+def write_issues(issues_df, path):
+    """Writes issues to a CSV file, for machine consumption."""
+    tmp_path = "%s.tmp" % path
+    issues_df.to_csv(tmp_path, index=False, date_format="%Y-%m-%d")
+    os.replace(tmp_path, path)
+
+
+def log_issues(issues_df):
+    if len(issues_df):
+        counts = issues_df["check"].value_counts()
+        logger.warning(
+            "Found %s",
+            ", ".join("%d %s" % (n, check) for check, n in counts.items()),
+        )
@@ -18,6 +18,11 @@ requirements = [
     "requests>=2.20.0",
 ]
 
+# Faster ratio evaluation over large panels, see kernels.py
+extras_requirements = {
+    "fast": ["numexpr", "numba"],
+}
+
 test_requirements = [
     "pytest",
 ]
@@ -37,6 +42,7 @@ setup(
     entry_points={"console_scripts": ["quandl_fund_xlsx=quandl_fund_xlsx.cli:main"]},
     include_package_data=True,
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="Apache Software License 2.0",
     zip_safe=False,
     keywords="quandl_fund_xlsx quandl finance ratios",
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shared fixtures for the quandl_fund_xlsx tests.
+
+The ``sf1_table`` fixture stands in for the Sharadar SF1 table so that the
+fetch, calculate and write paths can be exercised without a Quandl API key
+or network access.
+"""
+
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+parentddir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+sys.path.append(parentddir)
+
+from quandl_fund_xlsx import fundamentals as fun  # noqa: E402
+
+
+def sf1_columns():
+    """All of the SF1 indicator codes used by SharadarFundamentals."""
+    codes = ["ticker", "dimension", "calendardate", "reportperiod", "lastupdated"]
+    for ind_list in (
+        fun.SharadarFundamentals.I_STMNT_IND,
+        fun.SharadarFundamentals.CF_STMNT_IND,
+        fun.SharadarFundamentals.BAL_STMNT_IND,
+        fun.SharadarFundamentals.METRICS_AND_RATIOS_IND,
+    ):
+        for code, _ in ind_list:
+            if code not in codes:
+                codes.append(code)
+    return codes
+
+
+def make_sf1_frame(ticker, dimension="MRY", periods=6):
+    """Build a deterministic, plausible looking SF1 frame for one ticker."""
+    seed = sum(ord(c) for c in ticker)
+    rng = np.random.RandomState(seed)
+    if dimension in ("MRY", "ARY"):
+        cal_dates = pd.date_range("2014-12-31", periods=periods, freq="A")
+    else:
+        cal_dates = pd.date_range("2014-12-31", periods=periods, freq="Q")
+    data = {}
+    for code in sf1_columns():
+        if code == "ticker":
+            data[code] = [ticker] * periods
+        elif code == "dimension":
+            data[code] = [dimension] * periods
+        elif code in ("calendardate", "reportperiod"):
+            data[code] = cal_dates
+        elif code == "datekey":
+            data[code] = cal_dates + pd.Timedelta(days=45)
+        elif code == "lastupdated":
+            data[code] = cal_dates + pd.Timedelta(days=60)
+        elif code in ("capex", "ncfdiv"):
+            # Sharadar returns these as negative numbers
+            data[code] = -rng.uniform(1e6, 1e8, periods)
+        else:
+            data[code] = rng.uniform(1e6, 1e9, periods)
+    df = pd.DataFrame(data)
+    # Quandl hands back the newest filing first
+    return df.iloc[::-1].reset_index(drop=True)
+
+
+class FakeSF1Table(object):
+    """A callable replacement for quandl.get_table backed by generated frames.
+
+    Tickers listed in ``missing`` return an empty frame, as the API does for
+    unknown tickers; tickers in ``failing`` raise ``RuntimeError``. Each call
+    takes ``delay`` seconds, standing in for the network round trip. Only
+    the columns of a ``qopts`` option are returned, each call's columns
+    being recorded in ``columns``, None for all of them.
+    """
+
+    def __init__(self, periods=6):
+        self.periods = periods
+        self.calls = []
+        self.columns = []
+        self.missing = set()
+        self.failing = set()
+        self.delay = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, datatable_code, ticker=None, dimension=None, **options):
+        columns = options.get("qopts", {}).get("columns")
+        with self._lock:
+            self.calls.append(ticker)
+            self.columns.append(columns)
+        if self.delay:
+            time.sleep(self.delay)
+        if ticker in self.failing:
+            raise RuntimeError("Injected failure for %s" % ticker)
+        if ticker in self.missing:
+            sf1_df = pd.DataFrame(columns=sf1_columns())
+        else:
+            sf1_df = make_sf1_frame(ticker, dimension, self.periods)
+        if columns is not None:
+            sf1_df = sf1_df[[c for c in columns if c in sf1_df.columns]]
+        return sf1_df
+
+
+@pytest.fixture
+def sf1_table(monkeypatch):
+    """Patch quandl.get_table with a local stand-in for SHARADAR/SF1."""
+    monkeypatch.setenv("QUANDL_API_SF0_KEY", "test-key")
+    monkeypatch.setenv("QUANDL_API_SF1_KEY", "test-key")
+    table = FakeSF1Table()
+    monkeypatch.setattr(fun.quandl, "get_table", table)
+    return table
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_analytics
+--------------
+
+Tests for the historical statistics of each indicator.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.analytics import (
+    block_statistics,
+    grouped_statistics,
+    row_statistics,
+)
+from quandl_fund_xlsx.panel import build_panel
+
+
+def expected_statistics(row):
+    row = pd.Series(row, dtype=float)
+    valid = row.dropna()
+    history = row.iloc[:-1].dropna()
+    slope = np.polyfit(valid.index.to_numpy(), valid.to_numpy(), 1)[0]
+    return {
+        "mean": valid.mean(),
+        "std": valid.std(),
+        "min": valid.min(),
+        "max": valid.max(),
+        "zscore": (row.iloc[-1] - history.mean()) / history.std(),
+        "slope": slope,
+    }
+
+
+def test_row_statistics():
+    values = np.array(
+        [
+            [1.0, 2.0, 4.0, 3.0, 6.0],
+            [5.0, np.nan, 4.0, 2.0, 1.5],
+            [np.nan, np.nan, np.nan, np.nan, 2.0],
+        ]
+    )
+    stats = row_statistics(values)
+
+    for i in range(2):
+        for stat, value in expected_statistics(values[i]).items():
+            assert stats[stat][i] == pytest.approx(value), stat
+    # A single value has a mean but no spread, trend or z-score
+    assert stats["mean"][2] == 2.0
+    assert np.isnan(stats["std"][2])
+    assert np.isnan(stats["zscore"][2])
+    assert np.isnan(stats["slope"][2])
+
+
+def test_block_statistics_of_calculated_ratios(sf1_table):
+    fund = fun.load_fundamentals("AAA", "SF0", "MRY", 4)
+    fund.calc_ratios()
+    fund.calc_ratios_df.loc[fund.calc_ratios_df.index[1], "debt_cfo_ratio"] = None
+    block = fund.get_transposed_and_formatted_calculated_ratios()
+
+    stats = block_statistics(block)
+
+    debt_cfo = fund.calc_ratios_df["debt_cfo_ratio"].to_numpy(dtype=float)
+    assert stats.loc["debt_cfo_ratio", "mean"] == pytest.approx(np.nanmean(debt_cfo))
+    assert stats.loc["debt_cfo_ratio", "max"] == np.nanmax(debt_cfo)
+
+
+def test_panel_statistics(sf1_table, tmp_path):
+    sf1_table.missing.add("BBB")
+    panel = build_panel(tmp_path / "panel", ["AAA", "BBB", "CCC"], "SF0", "MRY", 5)
+
+    stats = panel.statistics(["revenue", "debt_cfo_ratio"])
+
+    # Unsupported tickers are not in the panel
+    assert stats.index.tolist() == ["AAA", "CCC"]
+    for ticker in ("AAA", "CCC"):
+        fund = fun.load_fundamentals(ticker, "SF0", "MRY", 5)
+        fund.calc_ratios()
+        ratio = fund.calc_ratios_df["debt_cfo_ratio"].to_numpy(dtype=float)
+        for stat, value in expected_statistics(ratio).items():
+            assert stats.loc[ticker, "debt_cfo_ratio_" + stat] == pytest.approx(value)
+        revenue = fund.all_inds_df["revenue"].to_numpy()
+        assert stats.loc[ticker, "revenue_slope"] == pytest.approx(
+            expected_statistics(revenue)["slope"]
+        )
+
+
+def test_grouped_statistics_uneven_groups():
+    values = np.array([1.0, 2.0, 3.0, 10.0, 20.0])
+    stats = grouped_statistics(values, [0, 3, 3], len(values))
+
+    assert stats["mean"][[0, 2]].tolist() == [2.0, 15.0]
+    assert np.isnan(stats["mean"][1])
+    assert stats["zscore"][0] == pytest.approx(expected_statistics([1, 2, 3])["zscore"])
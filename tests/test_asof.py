@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_asof
+---------
+
+Tests for the point in time lookups of a panel.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_sf1_frame
+from quandl_fund_xlsx.asof import AsOfIndex
+from quandl_fund_xlsx.panel import Panel, PanelWriter
+from quandl_fund_xlsx.ratios import evaluate_ratios, with_dependencies
+
+DATES = pd.to_datetime(
+    [
+        "2014-01-01",
+        "2015-02-14",
+        "2015-02-15",
+        "2016-06-30",
+        "2017-03-01",
+        "2018-07-01",
+        "2030-01-01",
+    ]
+)
+
+
+def write_panel(path):
+    """AAA restates its 2015 filing, BBB's 2016 filing is amended after its
+    2017 one and CCC only files from 2017.
+    """
+    aaa = make_sf1_frame("AAA")
+    restated = aaa[aaa["calendardate"] == "2015-12-31"].copy()
+    restated["datekey"] += pd.Timedelta(days=100)
+    restated["lastupdated"] += pd.Timedelta(days=100)
+    restated["revenue"] = 1.0
+    aaa = pd.concat([aaa, restated])
+
+    bbb = make_sf1_frame("BBB")
+    amended = bbb[bbb["calendardate"] == "2016-12-31"].copy()
+    amended["datekey"] = pd.Timestamp("2018-06-01")
+    amended["lastupdated"] = pd.Timestamp("2018-06-02")
+    amended["revenue"] = 2.0
+    amended["opinc"] *= 2
+    bbb = pd.concat([bbb, amended])
+
+    ccc = make_sf1_frame("CCC")
+    ccc = ccc[ccc["calendardate"] >= "2016-12-31"]
+
+    with PanelWriter(path, "ARY") as writer:
+        for ticker, frame in (("AAA", aaa), ("BBB", bbb), ("CCC", ccc)):
+            writer.add(ticker, frame)
+    return Panel.open(path)
+
+
+def expected_rows(panel, date, strict=False):
+    """Looks each ticker's filing up one row at a time."""
+    rows = {}
+    for ticker in panel.tickers:
+        frame = panel.frame(ticker)
+        frame.index = np.arange(panel.rows(ticker).start, panel.rows(ticker).stop)
+        known = frame["datekey"]
+        if strict:
+            known = np.maximum(known, frame["lastupdated"])
+        frame = frame[known <= date]
+        if len(frame):
+            frame = frame.sort_values(["calendardate", "datekey", "lastupdated"])
+            rows[ticker] = frame.index[-1]
+    return rows
+
+
+GROWTH = ["kjm_delta_oi_fds", "kjm_delta_fcf_fds"]
+
+
+def expected_growth(panel, date):
+    """Calculates the growth ratios over each ticker's latest version of each
+    period known on a date.
+    """
+    growth = {}
+    for ticker in panel.tickers:
+        frame = panel.frame(ticker)
+        frame = frame[frame["datekey"] <= date]
+        if len(frame):
+            frame = frame.sort_values(["calendardate", "datekey", "lastupdated"])
+            frame = frame.drop_duplicates("calendardate", keep="last")
+            ratios = evaluate_ratios(with_dependencies(GROWTH), frame)
+            growth[ticker] = [ratios[ratio].iloc[-1] for ratio in GROWTH]
+    return pd.DataFrame.from_dict(growth, orient="index", columns=GROWTH)
+
+
+def test_asof_matches_row_by_row(tmp_path):
+    panel = write_panel(tmp_path / "panel")
+    index = AsOfIndex(panel)
+
+    for date in DATES:
+        expected = expected_rows(panel, date)
+        asof = index.asof(date, ["revenue", "debt_ebitda_ratio"])
+        assert list(asof.index) == list(expected)
+        rows = list(expected.values())
+        np.testing.assert_array_equal(asof["datekey"], panel.dates()[rows])
+        np.testing.assert_array_equal(asof["revenue"], panel["revenue"][rows])
+        np.testing.assert_array_equal(
+            asof["debt_ebitda_ratio"], panel.calc_ratios()["debt_ebitda_ratio"][rows]
+        )
+
+
+def test_restatements(tmp_path):
+    panel = write_panel(tmp_path / "panel")
+    index = AsOfIndex(panel)
+
+    # Filed 2016-02-14, restated 100 days later
+    assert index.asof("2016-03-01", ["revenue"]).loc["AAA", "revenue"] != 1.0
+    assert index.asof("2016-06-01", ["revenue"]).loc["AAA", "revenue"] == 1.0
+    assert index.asof("2017-03-01", ["revenue"]).loc["AAA", "revenue"] != 1.0
+    # The amendment of an older period doesn't replace the latest period
+    asof = index.asof("2018-07-01", ["revenue"])
+    assert asof.loc["BBB", "calendardate"] == pd.Timestamp("2017-12-31")
+    assert asof.loc["BBB", "revenue"] != 2.0
+    assert (index.asof("2030-01-01", ["revenue"])["revenue"] != 2.0).all()
+
+
+def test_growth_over_the_versions_known(tmp_path):
+    panel = write_panel(tmp_path / "panel")
+    index = AsOfIndex(panel)
+
+    for date in DATES[1:]:
+        pd.testing.assert_frame_equal(
+            index.asof(date, GROWTH)[GROWTH],
+            expected_growth(panel, date),
+            check_names=False,
+        )
+    # AAA's restated 2015 filing is compared with 2014, not its 2015 filing
+    restated = index.asof("2016-06-01", GROWTH).loc["AAA"]
+    assert restated["kjm_delta_oi_fds"] == pytest.approx(
+        expected_growth(panel, "2016-03-01").loc["AAA", "kjm_delta_oi_fds"]
+    )
+    assert restated["kjm_delta_oi_fds"] != 0
+    # As the panel's ratios compare each row with the period before
+    rows = index.rows("2016-06-01")
+    ratios = panel.calc_ratios(with_dependencies(GROWTH))
+    assert ratios["kjm_delta_oi_fds"][rows[0]] == pytest.approx(
+        restated["kjm_delta_oi_fds"]
+    )
+    # BBB's 2017 filing is compared with its 2016 amendment once that is known
+    before = index.asof("2018-05-01", GROWTH).loc["BBB", "kjm_delta_oi_fds"]
+    after = index.asof("2018-07-01", GROWTH).loc["BBB", "kjm_delta_oi_fds"]
+    assert (1 + before) == pytest.approx(2 * (1 + after))
+
+
+def test_strict_waits_for_lastupdated(tmp_path):
+    panel = write_panel(tmp_path / "panel")
+    index = AsOfIndex(panel, strict=True)
+
+    for date in DATES:
+        rows = index.rows(date)
+        expected = expected_rows(panel, date, strict=True)
+        assert rows[rows >= 0].tolist() == list(expected.values())
+    # Filed 2015-02-14 but last updated 15 days later
+    assert "AAA" not in index.asof("2015-02-20").index
+    assert "AAA" in AsOfIndex(panel).asof("2015-02-20").index
+
+
+def test_asof_dates_stacks_asof(tmp_path):
+    panel = write_panel(tmp_path / "panel")
+    index = AsOfIndex(panel)
+
+    stacked = index.asof_dates(DATES)
+
+    expected = pd.concat(
+        [index.asof(date) for date in DATES], keys=DATES, names=["date", "ticker"]
+    )
+    pd.testing.assert_frame_equal(stacked, expected)
+    assert index.rows(DATES).shape == (len(DATES), 3)
+    assert (index.rows("2014-01-01") == -1).all()
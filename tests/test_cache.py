@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cache
+----------
+
+Tests for the in-memory indicator cache and ticker de-duplication.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx import cache as cache_module
+from quandl_fund_xlsx.cache import IndicatorCache
+
+
+def test_cache_coalesces_in_flight_loads():
+    cache = IndicatorCache()
+    release = threading.Event()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        release.wait(5)
+        return "frame"
+
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(cache.get, "key", loader) for _ in range(4)]
+        release.set()
+        assert [f.result() for f in futures] == ["frame"] * 4
+    assert loads == [1]
+    assert cache.get("key", loader) == "frame"
+    assert cache.misses == 1
+
+
+def test_cache_evicts_least_recently_used():
+    frame = pd.DataFrame({"revenue": range(1000)}, dtype=float)
+    size = int(frame.memory_usage(deep=True).sum())
+    cache = IndicatorCache(max_bytes=2 * size)
+
+    cache.get("AAA", frame.copy)
+    cache.get("BBB", frame.copy)
+    cache.get("AAA", frame.copy)  # BBB is now the least recently used
+    cache.get("CCC", frame.copy)
+    assert "AAA" in cache and "CCC" in cache
+    assert "BBB" not in cache
+    assert cache.nbytes <= 2 * size
+    assert cache.evictions == 1
+
+
+def test_cache_expires_values(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = IndicatorCache(ttl=60)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return len(loads)
+
+    assert cache.get("AAA", loader) == 1
+    now[0] += 30
+    assert cache.get("AAA", loader) == 1
+    now[0] += 31
+    assert "AAA" not in cache
+    assert cache.get("AAA", loader) == 2
+    assert cache.expirations == 1
+
+
+def test_normalize_tickers():
+    tickers = ["aapl\n", "\n", "MSFT", " AAPL ", "", "intc", "msft"]
+    assert fun.normalize_tickers(tickers) == ["AAPL", "MSFT", "INTC"]
+
+
+def test_duplicate_tickers_fetched_and_calculated_once(
+    sf1_table, tmp_path, monkeypatch
+):
+    calc_calls = []
+    calc_ratios = fun.Fundamentals_ng.calc_ratios
+
+    def counting_calc_ratios(self):
+        calc_calls.append(1)
+        return calc_ratios(self)
+
+    monkeypatch.setattr(fun.Fundamentals_ng, "calc_ratios", counting_calc_ratios)
+    cache = IndicatorCache()
+    watchlists = ["AAA", "BBB", "aaa", "", "CCC", "BBB"]
+    fun.stock_xlsx(str(tmp_path / "a.xlsx"), watchlists, "SF0", "MRY", 5, cache=cache)
+    assert sf1_table.calls == ["AAA", "BBB", "CCC"]
+    assert len(calc_calls) == 3
+
+    fun.stock_xlsx(
+        str(tmp_path / "b.xlsx"), ["CCC", "AAA"], "SF0", "MRY", 5, cache=cache
+    )
+    assert sf1_table.calls == ["AAA", "BBB", "CCC"]
+    assert len(calc_calls) == 3
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cassette
+-------------
+
+Tests for recording the tables API and replaying it offline.
+"""
+
+import gzip
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+import pandas as pd
+import pytest
+import quandl
+
+from conftest import make_sf1_frame
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.cassette import Recorder, ReplayServer, _ThreadingHTTPServer
+
+STOCKS = ["AAA", "BBB", "CCC"]
+PAGE_ROWS = 4
+
+
+def datatable_json(frame, next_cursor_id):
+    columns = []
+    for name, column in frame.items():
+        if pd.api.types.is_datetime64_any_dtype(column):
+            kind = "Date"
+        elif pd.api.types.is_numeric_dtype(column):
+            kind = "double"
+        else:
+            kind = "String"
+        columns.append({"name": name, "type": kind})
+    data = frame.astype(object).where(frame.notna(), None)
+    for name, column in frame.items():
+        if pd.api.types.is_datetime64_any_dtype(column):
+            data[name] = column.dt.strftime("%Y-%m-%d")
+    return {
+        "datatable": {"data": data.values.tolist(), "columns": columns},
+        "meta": {"next_cursor_id": next_cursor_id},
+    }
+
+
+class TablesHandler(BaseHTTPRequestHandler):
+    """A stand-in for the live SF1 table, paginated with cursors."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        self.server.requests += 1
+        sf1_df = make_sf1_frame(query["ticker"], query["dimension"])
+        page = int(query.get("qopts.cursor_id", 0))
+        rows = sf1_df.iloc[page * PAGE_ROWS : (page + 1) * PAGE_ROWS]
+        more = (page + 1) * PAGE_ROWS < len(sf1_df)
+        body = json.dumps(datatable_json(rows, str(page + 1) if more else None))
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def cassette(tmp_path, monkeypatch):
+    """Records fetching STOCKS from a live stand-in, which is then stopped."""
+    monkeypatch.setenv("QUANDL_API_SF0_KEY", "test-key")
+    monkeypatch.setattr(quandl.ApiConfig, "retry_backoff_factor", 0.01)
+    monkeypatch.setattr(quandl.ApiConfig, "number_of_retries", 20)
+    server = _ThreadingHTTPServer(("127.0.0.1", 0), TablesHandler)
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(
+        quandl.ApiConfig, "api_base", "http://127.0.0.1:%d/api/v3" % server.server_port
+    )
+
+    path = tmp_path / "sf1.cassette.gz"
+    with Recorder(path) as recorder:
+        recorded = fetch()
+    server.shutdown()
+    server.server_close()
+    assert recorder.interactions == server.requests == 3 + 2
+    monkeypatch.setattr(quandl.ApiConfig, "api_base", "http://127.0.0.1:9/api/v3")
+    return path, recorded
+
+
+def fetch(workers=1):
+    frame = fun.fundamentals_frame(
+        STOCKS, "SF0", "MRY", 4, workers=workers, bulk_threshold=None
+    )
+    paginated = quandl.get_table(
+        "SHARADAR/SF1", ticker="AAA", dimension="MRY", paginate=True
+    )
+    return frame, paginated
+
+
+def test_replay_matches_recording(cassette):
+    path, (frame, paginated) = cassette
+    assert len(paginated) == 6
+
+    with ReplayServer(path) as replay:
+        replayed_frame, replayed_paginated = fetch()
+    assert quandl.ApiConfig.api_base == "http://127.0.0.1:9/api/v3"
+    assert (replay.requests, replay.missing, replay.throttled) == (5, 0, 0)
+    pd.testing.assert_frame_equal(replayed_frame, frame)
+    pd.testing.assert_frame_equal(replayed_paginated, paginated)
+
+    with gzip.open(path, "rt") as c_file:
+        assert "test-key" not in c_file.read()
+
+
+def test_replay_throttled_and_retried(cassette):
+    path, (frame, _) = cassette
+
+    with ReplayServer(path, rate=20, burst=1) as replay:
+        replayed_frame, _ = fetch(workers=3)
+    assert replay.throttled > 0
+    assert replay.requests == 5 + replay.throttled
+    pd.testing.assert_frame_equal(replayed_frame, frame)
+
+
+def test_replay_latency(cassette):
+    path, _ = cassette
+
+    def timed(latency):
+        with ReplayServer(path, latency=latency):
+            start = time.perf_counter()
+            fetch(workers=3)
+            return time.perf_counter() - start
+
+    added = timed(0.2) - timed(0.0)
+    # The three stocks are fetched concurrently, then the two pages, rather
+    # than the 1s of five requests in turn
+    assert 0.4 <= added < 0.9
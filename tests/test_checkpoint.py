@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_checkpoint
+---------------
+
+Tests for checkpointing and resuming a stock_xlsx run, using the local
+stand-in for the SF1 table.
+"""
+
+import pathlib
+
+import pytest
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.checkpoint import CheckpointStore
+from quandl_fund_xlsx.profiles import PROFILES
+
+
+def test_resume_only_fetches_remaining_tickers(sf1_table, tmp_path):
+    outfile = tmp_path / "stocks.xlsx"
+    ckpt_dir = tmp_path / "stocks.xlsx.ckpt"
+    stocks = ["AAA", "BBB", "CCC", "DDD"]
+    sf1_table.missing.add("BBB")
+    sf1_table.failing.add("CCC")
+
+    with pytest.raises(RuntimeError):
+        fun.stock_xlsx(
+            str(outfile), stocks, "SF0", "MRY", 5, checkpoint_dir=str(ckpt_dir)
+        )
+    store = CheckpointStore(ckpt_dir, "SF0", "MRY", 5)
+    assert store.completed() == {"AAA", "BBB"}
+
+    sf1_table.failing.clear()
+    sf1_table.calls.clear()
+    fun.stock_xlsx(
+        str(outfile),
+        stocks,
+        "SF0",
+        "MRY",
+        5,
+        checkpoint_dir=str(ckpt_dir),
+        resume=True,
+    )
+    assert sf1_table.calls == ["CCC", "DDD"]
+    assert outfile.exists()
+    # The checkpoints are no longer needed once the workbook is saved
+    assert not ckpt_dir.exists()
+
+
+def test_checkpoint_round_trip(sf1_table, tmp_path):
+    fund = fun.SharadarFundamentals("SF0")
+    fund.get_indicators("AAA", "MRY", 5)
+    fund.calc_ratios()
+
+    store = CheckpointStore(tmp_path / "ckpt", "SF0", "MRY", 5)
+    store.open()
+    store.save("AAA", fund)
+    sf1_df, ratios_df, issues_df = store.load("AAA")
+    assert sf1_df.equals(fund.all_inds_df)
+    assert ratios_df.equals(fund.calc_ratios_df)
+    assert issues_df.equals(fund.issues_df)
+
+
+def test_resume_rejects_different_parameters(tmp_path):
+    CheckpointStore(tmp_path, "SF0", "MRY", 5).open()
+    with pytest.raises(ValueError):
+        CheckpointStore(tmp_path, "SF0", "ARQ", 5).open(resume=True)
+    assert pathlib.Path(tmp_path, CheckpointStore.MANIFEST).exists()
+
+
+def test_resume_rejects_different_profile(sf1_table, tmp_path):
+    outfile = tmp_path / "stocks.xlsx"
+    ckpt_dir = tmp_path / "stocks.xlsx.ckpt"
+    sf1_table.failing.add("BBB")
+    with pytest.raises(RuntimeError):
+        fun.stock_xlsx(
+            str(outfile),
+            ["AAA", "BBB"],
+            "SF0",
+            "MRY",
+            5,
+            checkpoint_dir=str(ckpt_dir),
+            profile=PROFILES["kjm"],
+        )
+
+    sf1_table.failing.clear()
+    with pytest.raises(ValueError, match="Checkpoints"):
+        fun.stock_xlsx(
+            str(outfile),
+            ["AAA", "BBB"],
+            "SF0",
+            "MRY",
+            5,
+            checkpoint_dir=str(ckpt_dir),
+            resume=True,
+        )
+
+
+def test_only_the_store_files_removed(tmp_path):
+    (tmp_path / "notes.txt").write_text("mine")
+    with pytest.raises(ValueError, match="not empty"):
+        CheckpointStore(tmp_path, "SF0", "MRY", 5).open(resume=True)
+    assert (tmp_path / "notes.txt").exists()
+
+    ckpt_dir = tmp_path / "ckpt"
+    store = CheckpointStore(ckpt_dir, "SF0", "MRY", 5)
+    store.open()
+    store.save_not_found("AAA")
+    (ckpt_dir / "notes.txt").write_text("mine")
+    # Starting over only clears the checkpoints
+    store.open()
+    assert store.completed() == set()
+    store.save_not_found("AAA")
+
+    store.remove()
+    assert sorted(p.name for p in ckpt_dir.iterdir()) == ["notes.txt"]
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_compact
+------------
+
+Tests for the compact float32 and categorical form of the indicators.
+"""
+
+import numpy as np
+import pandas as pd
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.compact import (
+    RATIO_RTOL,
+    compact_frame,
+    expand_frame,
+    fits_float32,
+    from_days,
+    memory_usage,
+    to_days,
+)
+from quandl_fund_xlsx.panel import build_panel
+from quandl_fund_xlsx.ratios import RATIO_EXPRESSIONS
+
+STOCKS = ["AAA", "BBB", "CCC"]
+
+
+def test_fits_float32():
+    assert fits_float32([1.5, 0.0, np.nan, np.inf, 123456789.123])
+    assert not fits_float32([123456789.123], rtol=1e-9)
+    assert not fits_float32([1e300])
+    assert not fits_float32([1e-44])
+
+
+def test_days_round_trip():
+    dates = pd.to_datetime(["1999-12-31", None, "2021-03-01"]).to_numpy()
+    days = to_days(dates)
+    assert days.dtype == np.int32
+    np.testing.assert_array_equal(from_days(days), dates)
+
+
+def test_compact_frame(sf1_table):
+    frame = fun.fundamentals_frame(STOCKS, "SF0", "MRY", 5)
+    compact = fun.fundamentals_frame(STOCKS, "SF0", "MRY", 5, compact=True)
+
+    assert isinstance(compact["ticker"].dtype, pd.CategoricalDtype)
+    assert compact["datekey"].dtype == np.int32
+    assert compact["revenue"].dtype == np.float32
+    # The ratios are calculated as object columns of floats and None
+    assert frame["debt_ebitda_ratio"].dtype == object
+    ratios = [c for c in frame.columns if c in RATIO_EXPRESSIONS]
+    assert ratios
+    for ratio in ratios:
+        assert compact[ratio].dtype == np.float32
+    assert memory_usage(compact) < memory_usage(frame)
+
+    expanded = expand_frame(compact_frame(frame))
+    pd.testing.assert_frame_equal(expanded, frame, check_dtype=False, rtol=RATIO_RTOL)
+
+
+def test_compact_panel_ratios_within_tolerance(sf1_table, tmp_path):
+    panel = build_panel(tmp_path / "panel", STOCKS, "SF0", "MRY", 5)
+    compact = build_panel(tmp_path / "compact", STOCKS, "SF0", "MRY", 5, compact=True)
+
+    assert compact["revenue"].dtype == np.float32
+    size = sum(f.stat().st_size for f in (tmp_path / "panel").iterdir())
+    compact_size = sum(f.stat().st_size for f in (tmp_path / "compact").iterdir())
+    assert compact_size < 0.7 * size
+    np.testing.assert_array_equal(compact.dates(), panel.dates())
+
+    ratios = panel.calc_ratios()
+    compact_ratios = compact.calc_ratios()
+    for ratio, values in ratios.items():
+        assert compact_ratios[ratio].dtype == np.float64
+        np.testing.assert_allclose(compact_ratios[ratio], values, rtol=RATIO_RTOL)
+    pd.testing.assert_frame_equal(compact.latest(), panel.latest(), rtol=RATIO_RTOL)
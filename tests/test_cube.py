@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cube
+---------
+
+Tests for pivoting a panel into an indicator x ticker x period cube.
+"""
+
+import numpy as np
+import pandas as pd
+
+from conftest import make_sf1_frame
+from quandl_fund_xlsx.cube import Cube, build_cube
+from quandl_fund_xlsx.panel import Panel, PanelWriter
+
+
+def write_panel(path):
+    """AAA restates its 2015 filing and CCC only files from 2017."""
+    aaa = make_sf1_frame("AAA")
+    restated = aaa[aaa["calendardate"] == "2015-12-31"].copy()
+    restated["datekey"] += pd.Timedelta(days=100)
+    restated["revenue"] = 1.0
+    ccc = make_sf1_frame("CCC")
+    ccc = ccc[ccc["calendardate"] >= "2016-12-31"]
+
+    with PanelWriter(path, "MRY") as writer:
+        writer.add("AAA", pd.concat([aaa, restated]))
+        writer.add("BBB", make_sf1_frame("BBB", periods=3))
+        writer.add("CCC", ccc)
+    return Panel.open(path)
+
+
+def expected_frame(panel, values):
+    rows = []
+    for ticker in panel.tickers:
+        frame = panel.frame(ticker)
+        frame["value"] = values[panel.rows(ticker)]
+        rows.append(frame)
+    frame = pd.concat(rows).sort_values("datekey", kind="stable")
+    return frame.pivot_table(
+        index="ticker", columns="calendardate", values="value", aggfunc="last"
+    )
+
+
+def test_cube_matches_pivot(tmp_path):
+    panel = write_panel(tmp_path / "panel")
+    ratios = panel.calc_ratios()
+
+    cube = build_cube(tmp_path / "cube", panel, ["revenue", "debt_ebitda_ratio"])
+
+    assert cube.values.shape == (2, 3, 6)
+    assert cube.tickers == ["AAA", "BBB", "CCC"]
+    assert isinstance(cube["revenue"], np.memmap)
+    assert cube["revenue"].flags.c_contiguous
+    for indicator, values in (
+        ("revenue", panel.values("revenue")),
+        ("debt_ebitda_ratio", ratios["debt_ebitda_ratio"]),
+    ):
+        expected = expected_frame(panel, values).reindex(
+            index=cube.tickers, columns=cube.periods
+        )
+        pd.testing.assert_frame_equal(
+            cube.frame(indicator), expected, check_names=False, check_freq=False
+        )
+    assert cube.frame("revenue").loc["AAA", "2015-12-31"] == 1.0
+    assert np.isnan(cube.frame("revenue").loc["CCC", "2015-12-31"])
+
+
+def test_cube_growth_over_its_periods(tmp_path):
+    panel = write_panel(tmp_path / "panel")
+
+    cube = build_cube(tmp_path / "cube", panel, ["opinc_ps", "kjm_delta_oi_fds"])
+
+    # AAA's restated 2015 is compared with 2014, not its first 2015 filing
+    opinc_ps = cube.frame("opinc_ps")
+    expected = opinc_ps.pct_change(axis=1).where(opinc_ps.notna())
+    pd.testing.assert_frame_equal(cube.frame("kjm_delta_oi_fds"), expected)
+    assert cube.frame("kjm_delta_oi_fds").loc["AAA", "2015-12-31"] != 0
+
+
+def test_cube_reopened_and_saved(tmp_path):
+    panel = write_panel(tmp_path / "panel")
+    build_cube(tmp_path / "cube", panel)
+
+    cube = Cube.open(tmp_path / "cube")
+    assert cube.indicators[: len(panel.columns)] == panel.columns
+    assert "net_debt_ebitda_ratio" in cube
+
+    cube.save_npz(tmp_path / "cube.npz", ["revenue", "net_debt_ebitda_ratio"])
+    with np.load(tmp_path / "cube.npz") as npz:
+        np.testing.assert_array_equal(npz["revenue"], cube["revenue"])
+        assert list(npz["tickers"]) == cube.tickers
+        assert (pd.DatetimeIndex(npz["periods"]) == cube.periods).all()
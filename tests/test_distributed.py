@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_distributed
+----------------
+
+Tests for sharing a build between worker processes through a directory
+standing in for a shared filesystem.
+"""
+
+import multiprocessing
+import os
+import time
+import zipfile
+
+import pytest
+
+from conftest import make_sf1_frame
+from quandl_fund_xlsx import distributed
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.distributed import SharedStore, assemble, run_worker
+from quandl_fund_xlsx.portfolios import Job
+from quandl_fund_xlsx.resilience import DeadLetters
+
+STOCKS = ["AAA", "BBB", "CCC", "DDD", "EEE", "FFF", "GGG"]
+
+
+def sheet_names(path):
+    with zipfile.ZipFile(path) as xlsx:
+        workbook = xlsx.read("xl/workbook.xml").decode()
+    return [part.split('"')[0] for part in workbook.split('<sheet name="')[1:]]
+
+
+def plan(tmp_path, batch_size=2):
+    jobs = [
+        Job(STOCKS[:5] + ["ZZZ"], str(tmp_path / "a.xlsx"), "MRY", 4),
+        Job(STOCKS[3:], str(tmp_path / "b.xlsx"), "MRY", 4),
+        Job(["AAA", "BBB"], str(tmp_path / "c.xlsx"), "MRQ", 4),
+    ]
+    store = SharedStore(tmp_path / "shared")
+    batches = store.plan(jobs, "SF0", batch_size=batch_size)
+    return store, jobs, batches
+
+
+class LoggedSF1Table(object):
+    """Stands in for SHARADAR/SF1, appending each request to a log file
+    shared by the worker processes.
+    """
+
+    def __init__(self, log):
+        self.log = log
+
+    def __call__(self, datatable_code, ticker=None, dimension=None, **options):
+        with open(self.log, "a") as l_file:
+            l_file.write("%s %s\n" % (ticker, dimension))
+        time.sleep(0.01)
+        if ticker == "ZZZ":
+            return make_sf1_frame(ticker).iloc[:0]
+        return make_sf1_frame(ticker, dimension)
+
+
+def test_plan_batches(tmp_path):
+    store, jobs, batches = plan(tmp_path)
+
+    # 8 MRY tickers in 4 batches and 2 MRQ tickers in 1
+    assert batches == 5
+    assert store.pending() == list(range(5))
+    assert SharedStore(store.path).jobs() == jobs
+
+
+def test_workers_share_batches(sf1_table, tmp_path, monkeypatch):
+    log = tmp_path / "requests.log"
+    monkeypatch.setattr(fun.quandl, "get_table", LoggedSF1Table(log))
+    store, jobs, batches = plan(tmp_path)
+
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(store.path,),
+            kwargs={"bulk_threshold": None, "poll_seconds": 0.05},
+        )
+        for _ in range(3)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    assert store.pending() == []
+    requests = log.read_text().split("\n")[:-1]
+    assert len(requests) == len(set(requests)) == 8 + 2
+
+    written = assemble(store.path, render_workers=2)
+    assert list(written.values()) == [5, 4, 2]
+    assert sheet_names(jobs[0].output) == ["Summary"] + STOCKS[:5] + ["Issues"]
+    assert sheet_names(jobs[2].output) == ["Summary", "AAA", "BBB", "Issues"]
+
+
+def test_expired_lease_taken_over(sf1_table, tmp_path):
+    store, jobs, batches = plan(tmp_path)
+    assert store.claim(0, "dead-worker")
+    store.save("MRY", 4, "AAA", None)
+    assert not store.claim(0, "live-worker")
+    expired = time.time() - 600
+    os.utime(store.path / "leases" / "0", (expired, expired))
+
+    assert run_worker(store.path, bulk_threshold=None, lease_seconds=300) == batches
+
+    # AAA, saved by the dead worker, isn't fetched again
+    assert sf1_table.calls.count("AAA") == 1
+    assert "AAA" not in store.results("MRY", 4)
+    assert not list((store.path / "leases").iterdir())
+
+
+def test_assemble_waits_for_every_batch(sf1_table, tmp_path):
+    store, _, batches = plan(tmp_path)
+    store.claim(1, "worker")
+    with pytest.raises(ValueError, match="%d of the %d" % (batches, batches)):
+        assemble(store.path)
+
+
+def test_failed_tickers_saved_and_reported(sf1_table, tmp_path, monkeypatch):
+    store, jobs, batches = plan(tmp_path)
+    sf1_table.failing.add("BBB")
+    sf1_table.missing.add("ZZZ")
+    exported = []
+
+    def bulk_export(stocks, dimension):
+        # Each batch is exported, the 8 MRY tickers planned reaching the
+        # threshold however few each batch holds
+        exported.append(list(stocks))
+        for stock in stocks:
+            if stock not in ("BBB", "ZZZ"):
+                yield stock, make_sf1_frame(stock, dimension)
+
+    def calc_fund_ratios(stock, fund, cache=None):
+        if stock == "EEE":
+            raise ZeroDivisionError("float division by zero")
+        return real_calc_fund_ratios(stock, fund, cache)
+
+    real_calc_fund_ratios = fun.calc_fund_ratios
+    monkeypatch.setattr(fun, "bulk_export", bulk_export)
+    monkeypatch.setattr(distributed, "calc_fund_ratios", calc_fund_ratios)
+
+    assert run_worker(store.path, bulk_threshold=8, poll_seconds=0.05) == batches
+
+    assert exported == [STOCKS[:2], STOCKS[2:4], [STOCKS[4], "ZZZ"], STOCKS[5:]]
+    assert store.failures() == {
+        "BBB": ("fetch", "RuntimeError: Injected failure for BBB"),
+        "EEE": ("compute", "ZeroDivisionError: float division by zero"),
+    }
+    assert (store.path / "results" / "MRQ-4" / "BBB.failed").exists()
+
+    dead_letters = DeadLetters()
+    written = assemble(store.path, render_workers=1, dead_letters=dead_letters)
+    assert dead_letters.tickers() == ["BBB", "EEE"]
+    assert list(written.values()) == [3, 3, 1]
+    assert sheet_names(jobs[0].output) == ["Summary", "AAA", "CCC", "DDD", "Issues"]
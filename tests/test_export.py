@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_export
+-----------
+
+Tests for the SF1 bulk export, against a local stand-in for the tables API.
+"""
+
+import io
+import json
+import threading
+import urllib.parse
+import zipfile
+from http.server import BaseHTTPRequestHandler
+
+import pandas as pd
+import pytest
+import quandl
+
+from conftest import make_sf1_frame
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.cache import IndicatorCache
+from quandl_fund_xlsx.cassette import _ThreadingHTTPServer
+from quandl_fund_xlsx.export import bulk_export, read_export
+from quandl_fund_xlsx.panel import build_panel
+
+
+def export_zip(frames):
+    csv = pd.concat(frames, ignore_index=True).to_csv(index=False)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        archive.writestr("SHARADAR_SF1.csv", csv)
+    return buf.getvalue()
+
+
+class ExportHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        server = self.server
+        if url.path == "/export.zip":
+            return self._reply(server.zip_data, "application/zip")
+
+        query = urllib.parse.parse_qs(url.query)
+        server.requests.append(query)
+        tickers = query["ticker[]"]
+        frames = [
+            make_sf1_frame(t, query["dimension"][0])
+            for t in sorted(tickers)
+            if t not in server.missing
+        ]
+        server.zip_data = export_zip(frames)
+        # The first request of an export finds it still being created
+        if len(server.requests) > 1:
+            file_info = {"status": "fresh", "link": server.url + "/export.zip"}
+        else:
+            file_info = {"status": "creating", "link": None}
+        body = json.dumps({"datatable_bulk_download": {"file": file_info}})
+        self._reply(body.encode(), "application/json")
+
+    def _reply(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def export_server(sf1_table, monkeypatch):
+    server = _ThreadingHTTPServer(("127.0.0.1", 0), ExportHandler)
+    server.url = "http://127.0.0.1:%d" % server.server_address[1]
+    server.requests = []
+    server.missing = set()
+    monkeypatch.setattr(quandl.ApiConfig, "api_base", server.url)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_bulk_export_yields_each_ticker(export_server):
+    frames = dict(bulk_export(["BBB", "AAA", "CCC"], "MRY", poll_interval=0))
+
+    assert sorted(frames) == ["AAA", "BBB", "CCC"]
+    expected = make_sf1_frame("AAA")
+    pd.testing.assert_frame_equal(
+        frames["AAA"][expected.columns], expected, check_dtype=False
+    )
+    assert export_server.requests[0]["qopts.export"] == ["true"]
+
+
+def test_read_export_unsorted_rows():
+    frames = [make_sf1_frame(t) for t in ("BBB", "AAA", "BBB")]
+    zip_file = io.BytesIO(export_zip(frames))
+
+    exported = dict(read_export(zip_file, chunksize=4))
+    assert sorted(exported) == ["AAA", "BBB"]
+    assert len(exported["BBB"]) == 12
+
+
+def test_stock_xlsx_prefetches_with_bulk_export(export_server, sf1_table, tmp_path):
+    export_server.missing.add("CCC")
+    stocks = ["AAA", "BBB", "CCC"]
+
+    cache = IndicatorCache()
+    fun.stock_xlsx(
+        tmp_path / "bulk.xlsx", stocks, "SF0", "MRY", 4, cache=cache, bulk_threshold=3
+    )
+
+    # Only the ticker missing from the export is fetched on its own
+    assert sf1_table.calls == ["CCC"]
+    direct = fun.SharadarFundamentals("SF0").get_indicators("AAA", "MRY", 4)
+    exported = cache.get(("AAA", "MRY", 4, "SF0"), None)[direct.columns]
+    pd.testing.assert_frame_equal(
+        exported.reset_index(drop=True),
+        direct.reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_build_panel_from_bulk_export(export_server, sf1_table, tmp_path):
+    export_server.missing.add("BBB")
+    panel = build_panel(
+        tmp_path / "panel", ["AAA", "BBB"], "SF0", "MRY", 3, bulk_threshold=2
+    )
+
+    assert sf1_table.calls == ["BBB"]
+    assert panel.tickers == ["AAA", "BBB"]
+    assert len(panel) == 6
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_incremental
+----------------
+
+Tests for reusing the previous build of the tickers which haven't changed.
+"""
+
+import zipfile
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.incremental import BuildCache
+
+STOCKS = ["AAA", "BBB", "CCC"]
+
+
+def sheets(path):
+    with zipfile.ZipFile(path) as xlsx:
+        return {
+            name: xlsx.read(name)
+            for name in xlsx.namelist()
+            if name.startswith("xl/worksheets/")
+        }
+
+
+def build(tmp_path, name, **kwargs):
+    outfile = tmp_path / name
+    build_cache = BuildCache(tmp_path / "build", "SF0", "MRY", 4)
+    fun.stock_xlsx(outfile, STOCKS, "SF0", "MRY", 4, build_cache=build_cache, **kwargs)
+    return outfile, build_cache
+
+
+def test_unchanged_tickers_reused(sf1_table, tmp_path, monkeypatch):
+    first, build_cache = build(tmp_path, "first.xlsx")
+    assert (build_cache.hits, build_cache.misses) == (0, 3)
+
+    calculated = []
+    calc_ratios = fun.SharadarFundamentals.calc_ratios
+    evaluated = []
+    evaluate_ratios = fun.evaluate_ratios
+
+    def record_calc_ratios(fund):
+        calculated.append(fund.all_inds_df["ticker"].iloc[0])
+        return calc_ratios(fund)
+
+    def record_evaluate_ratios(ratios, indicators, group_starts=None):
+        evaluated.append(indicators["ticker"].iloc[0])
+        return evaluate_ratios(ratios, indicators, group_starts)
+
+    monkeypatch.setattr(fun.SharadarFundamentals, "calc_ratios", record_calc_ratios)
+    monkeypatch.setattr(fun, "evaluate_ratios", record_evaluate_ratios)
+
+    second, build_cache = build(tmp_path, "second.xlsx")
+    assert (build_cache.hits, build_cache.misses) == (3, 0)
+    assert calculated == []
+    # Nor are the ratios evaluated to find the issues again
+    assert evaluated == []
+    assert sheets(second) == sheets(first)
+
+    # BBB files restated figures
+    def get_table(datatable_code, ticker=None, dimension=None, **options):
+        sf1_df = sf1_table(datatable_code, ticker, dimension, **options)
+        if ticker == "BBB":
+            sf1_df.loc[0, "revenue"] *= 1.1
+        return sf1_df
+
+    monkeypatch.setattr(fun.quandl, "get_table", get_table)
+    third, build_cache = build(tmp_path, "third.xlsx")
+    assert (build_cache.hits, build_cache.misses) == (2, 1)
+    assert calculated == ["BBB"]
+    assert sheets(third) != sheets(first)
+
+
+def test_build_cache_keyed_by_parameters(sf1_table, tmp_path):
+    sf1_df = fun.load_fundamentals("AAA", "SF0", "MRY", 4).all_inds_df
+    content_hash = BuildCache(tmp_path, "SF0", "MRY", 4).content_hash(sf1_df)
+
+    assert BuildCache(tmp_path, "SF0", "MRY", 4).content_hash(sf1_df) == content_hash
+    assert BuildCache(tmp_path, "SF1", "MRY", 4).content_hash(sf1_df) != content_hash
+    assert BuildCache(tmp_path, "SF0", "MRY", 5).content_hash(sf1_df) != content_hash
+    changed = sf1_df.iloc[1:]
+    assert BuildCache(tmp_path, "SF0", "MRY", 4).content_hash(changed) != content_hash
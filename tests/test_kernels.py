@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_kernels
+------------
+
+Tests for the single pass ratio backends.
+"""
+
+import numpy as np
+import pytest
+
+from quandl_fund_xlsx import kernels
+from quandl_fund_xlsx.kernels import (
+    available_backends,
+    evaluate_ratios_compiled,
+    inline_expression,
+    select_backend,
+)
+from quandl_fund_xlsx.panel import build_panel
+from quandl_fund_xlsx.ratios import RATIO_EXPRESSIONS, evaluate_ratios
+
+STOCKS = ["AAA", "BBB", "CCC"]
+
+
+def random_indicators(rows):
+    rng = np.random.RandomState(7)
+    indicators = {}
+    for ratio in RATIO_EXPRESSIONS:
+        for name in kernels.expression_inputs(RATIO_EXPRESSIONS[ratio]):
+            if name not in RATIO_EXPRESSIONS and name != "pct_change":
+                indicators[name] = rng.uniform(-1e9, 1e9, rows)
+    indicators["ebitda"][:3] = 0.0
+    indicators["debt"][1] = 0.0
+    indicators["ncfo"][5] = np.nan
+    return indicators
+
+
+def test_inline_expression():
+    assert inline_expression("price_rough_ffo_ps_ratio") == (
+        "price / ((netinc + depamor) / shareswa)"
+    )
+    assert inline_expression("debt_cfo_ratio") == "debt / ncfo"
+    assert inline_expression("kjm_delta_oi_fds") is None
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_backends_match_numpy(backend, monkeypatch):
+    # Several blocks for the numpy backend
+    monkeypatch.setattr(kernels, "BLOCK_ROWS", 64)
+    indicators = random_indicators(1000)
+    starts = np.arange(0, 1000, 10)
+    ratios = list(RATIO_EXPRESSIONS)
+
+    expected = evaluate_ratios(ratios, indicators, starts)
+    results = evaluate_ratios_compiled(ratios, indicators, starts, backend=backend)
+
+    assert list(results) == ratios
+    for ratio in ratios:
+        np.testing.assert_allclose(results[ratio], expected[ratio], rtol=1e-12)
+
+
+def test_numba_kernel_source(monkeypatch):
+    # The kernel's source run as plain Python, in place of numba.njit
+    class FakeNumba(object):
+        @staticmethod
+        def njit(**options):
+            return lambda function: function
+
+    monkeypatch.setattr(kernels, "numba", FakeNumba)
+    monkeypatch.setattr(kernels, "_numba_kernels", {})
+    indicators = random_indicators(20)
+    ratio = "net_debt_ebitda_minus_capex_ratio"
+    expected = evaluate_ratios([ratio], indicators)[ratio]
+
+    result = kernels.evaluate_kernel(ratio, indicators, "numba")
+
+    np.testing.assert_allclose(result, expected, rtol=1e-12)
+
+
+def test_select_backend():
+    assert select_backend() == available_backends()[0]
+    assert select_backend("numpy") == "numpy"
+    with pytest.raises(ValueError):
+        select_backend("fortran")
+
+
+def test_missing_backend(monkeypatch):
+    monkeypatch.setattr(kernels, "numba", None)
+    assert "numba" not in available_backends()
+    with pytest.raises(ValueError):
+        select_backend("numba")
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_panel_backends(sf1_table, tmp_path, backend):
+    panel = build_panel(tmp_path / "panel", STOCKS, "SF0", "MRY", 5)
+    expected = panel.calc_ratios(backend="numpy")
+    results = panel.calc_ratios(backend=backend)
+    for ratio, values in expected.items():
+        np.testing.assert_allclose(results[ratio], values, rtol=1e-12)
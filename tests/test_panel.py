@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_panel
+----------
+
+Tests for the memory-mapped panel store and the vectorized ratio
+calculations over it.
+"""
+
+import numpy as np
+import pandas as pd
+
+from conftest import make_sf1_frame
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.panel import Panel, build_panel
+from quandl_fund_xlsx.ratios import (
+    RATIO_EXPRESSIONS,
+    chain_pct_change,
+    evaluate_ratios,
+    group_pct_change,
+    with_dependencies,
+)
+
+STOCKS = ["AAA", "BBB", "CCC"]
+
+
+def test_panel_matches_per_ticker_calculations(sf1_table, tmp_path):
+    panel = build_panel(tmp_path / "panel", STOCKS, "SF0", "MRY", 5)
+    assert isinstance(panel["revenue"], np.memmap)
+    assert panel.tickers == STOCKS
+    assert len(panel) == 15
+
+    ratios = panel.calc_ratios()
+    for stock in STOCKS:
+        fund = fun.SharadarFundamentals("SF0")
+        fund.get_indicators(stock, "MRY", 5)
+        expected = fund.calc_ratios()
+        rows = panel.rows(stock)
+        for ratio in fund.calc_ratios_dict:
+            np.testing.assert_allclose(
+                ratios[ratio][rows],
+                expected[ratio].to_numpy(dtype=float, na_value=np.nan),
+                rtol=1e-12,
+            )
+        np.testing.assert_array_equal(
+            panel.dates()[rows], fund.all_inds_df["datekey"].to_numpy()
+        )
+
+
+def test_expressions_match_series_arithmetic():
+    # The ratios were calculated with pandas Series arithmetic per ticker
+    # before being defined as expressions
+    inds = make_sf1_frame("AAA", periods=8).iloc[::-1].reset_index(drop=True)
+    inds.loc[2, "ncfo"] = 0
+    inds.loc[3, "equity"] = np.nan
+    inds.loc[4, "intexp"] = 0
+    expected = {
+        "debt_cfo_ratio": inds["debt"] / inds["ncfo"],
+        "net_debt_ebitda_minus_capex_ratio": (inds["debt"] - inds["cashnequsd"])
+        / (inds["ebitda"] + inds["capex"]),
+        "ebit_interest_coverage": inds["ebit"] / inds["intexp"],
+        "income_dividend_payout_ratio": -inds["ncfdiv"] / inds["netinc"],
+        "price_rough_ffo_ps_ratio": inds["price"]
+        / ((inds["netinc"] + inds["depamor"]) / inds["shareswa"]),
+        "kjm_roce_sub_cash": inds["opinc"]
+        / (
+            inds["assets"] - inds["cashnequsd"] - inds["payables"] - inds["deferredrev"]
+        ),
+        "kjm_delta_oi_fds": (inds["opinc"] / inds["shareswa"]).pct_change(),
+        "kjm_delta_bv_fds": inds["equity"].pct_change(),
+        "kjm_delta_tbv_fds": (inds["equity"] - inds["intangibles"]).pct_change(),
+        "excess_cash_margin_ratio": (inds["ncfo"] - inds["opinc"])
+        * 100
+        / inds["revenue"],
+    }
+
+    results = evaluate_ratios(with_dependencies(list(RATIO_EXPRESSIONS)), inds)
+    for ratio, values in expected.items():
+        pd.testing.assert_series_equal(
+            pd.Series(results[ratio], index=inds.index),
+            values,
+            check_names=False,
+            rtol=1e-12,
+        )
+
+
+def test_panel_latest_matches_summary(sf1_table, tmp_path):
+    build_panel(tmp_path / "panel", STOCKS, "SF0", "MRY", 5)
+    latest = Panel.open(tmp_path / "panel").latest()
+
+    excel = fun.Excel(str(tmp_path / "stocks.xlsx"))
+    for stock in STOCKS:
+        fund = fun.SharadarFundamentals("SF0")
+        fund.get_indicators(stock, "MRY", 5)
+        fund.calc_ratios()
+        for indicator, value in excel.summarized_indicators(fund, stock):
+            assert latest.loc[stock, indicator] == value
+
+
+def test_group_pct_change_matches_pandas():
+    values = np.array([1.0, np.nan, 2.0, 4.0, np.nan, 3.0, 6.0, np.nan])
+    starts = np.array([0, 4])
+    result = group_pct_change(values, starts)
+    for start, stop in ((0, 4), (4, 8)):
+        expected = pd.Series(values[start:stop]).pct_change().to_numpy()
+        np.testing.assert_array_equal(result[start:stop], expected)
+
+
+def test_chain_pct_change_follows_previous():
+    # 2 is a restatement of 1, which 3 follows, and 4 of 0, which 5 follows
+    values = np.array([1.0, np.nan, 2.0, 4.0, 8.0, np.nan])
+    previous = np.array([-1, 0, 0, 2, -1, 4])
+    result = chain_pct_change(values, previous)
+    np.testing.assert_array_equal(result, [np.nan, 0.0, 1.0, 1.0, np.nan, 0.0])
+    # The row before each row within its group is group_pct_change
+    values = np.array([1.0, np.nan, 2.0, 4.0, np.nan, 3.0, 6.0, np.nan])
+    previous = np.array([-1, 0, 1, 2, -1, 4, 5, 6])
+    np.testing.assert_array_equal(
+        chain_pct_change(values, previous),
+        group_pct_change(values, np.array([0, 4])),
+    )
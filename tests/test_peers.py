@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_peers
+----------
+
+Tests for the sector and industry peer group statistics.
+"""
+
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx import peers
+
+METADATA = pd.DataFrame(
+    {
+        "ticker": ["AAA", "BBB", "CCC", "DDD"],
+        "name": ["Aaa Inc", "Bbb Reit", "Ccc Corp", "Ddd Reit"],
+        "sector": ["Technology", "Real Estate", "Technology", "Real Estate"],
+        "industry": ["Semiconductors", "REIT", "Software", "REIT"],
+    }
+)
+
+
+def test_peer_statistics():
+    latest = pd.DataFrame(
+        {"roic": [0.1, 0.3, 0.2, 0.5, np.inf], "margin": [1, 2, 3, None, 999999999]},
+        index=["AAA", "BBB", "CCC", "DDD", "EEE"],
+    )
+    groups = pd.Series(["x", "x", "x", "y"], index=["AAA", "BBB", "CCC", "DDD"])
+
+    stats = peers.peer_statistics(latest, groups)
+
+    assert stats["group"].tolist() == ["x", "x", "x", "y", "Unknown"]
+    assert stats["roic_median"].tolist()[:4] == [0.2, 0.2, 0.2, 0.5]
+    assert stats["roic_pctile"].tolist()[:3] == pytest.approx([1 / 3, 1, 2 / 3])
+    x = np.array([0.1, 0.3, 0.2])
+    assert stats.loc["BBB", "roic_zscore"] == pytest.approx(
+        (0.3 - x.mean()) / x.std(ddof=1)
+    )
+    # inf and missing values are left out of the statistics
+    assert np.isnan(stats.loc["EEE", "roic"])
+    assert np.isnan(stats.loc["DDD", "margin_pctile"])
+    # The former inf sentinel of calc_ratios is a value like any other
+    assert stats.loc["EEE", "margin"] == 999999999
+
+
+def test_ticker_metadata_cached(tmp_path, monkeypatch):
+    calls = []
+
+    def get_table(datatable_code, ticker=None, **options):
+        calls.append((datatable_code, list(ticker)))
+        return METADATA[METADATA["ticker"].isin(ticker)]
+
+    monkeypatch.setattr(peers.quandl, "get_table", get_table)
+    cache_path = tmp_path / "tickers.csv"
+
+    metadata = peers.load_ticker_metadata(["BBB", "AAA", "ZZZ"], cache_path)
+    assert metadata["sector"].tolist() == ["Real Estate", "Technology", ""]
+    metadata = peers.load_ticker_metadata(["AAA", "ZZZ", "CCC"], cache_path)
+    assert metadata["industry"].tolist() == ["Semiconductors", "", "Software"]
+    assert calls == [
+        ("SHARADAR/TICKERS", ["BBB", "AAA", "ZZZ"]),
+        ("SHARADAR/TICKERS", ["CCC"]),
+    ]
+
+    groups = peers.peer_groups(metadata, "sector")
+    assert groups.tolist() == ["Technology", "Unknown", "Technology"]
+    with pytest.raises(ValueError):
+        peers.peer_groups(metadata, "exchange")
+
+
+def test_stock_xlsx_peer_groups(sf1_table, tmp_path, monkeypatch):
+    summaries = []
+    write_summary_sheet = fun.Excel.write_summary_sheet
+
+    def record_summary(excel, summarized_ind_dict, peer_groups=None):
+        write_summary_sheet(excel, summarized_ind_dict, peer_groups)
+        summaries.extend(excel.summary_rows)
+
+    monkeypatch.setattr(fun.Excel, "write_summary_sheet", record_summary)
+
+    groups = peers.peer_groups(METADATA.set_index("ticker"), "sector")
+    outfile = tmp_path / "peers.xlsx"
+    fun.stock_xlsx(
+        outfile, ["AAA", "BBB", "CCC", "DDD"], "SF0", "MRY", 4, peer_groups=groups
+    )
+
+    summary = {ticker: dict(values) for ticker, values in summaries}
+    roic = {ticker: values["roic"] for ticker, values in summary.items()}
+    higher = "AAA" if roic["AAA"] > roic["CCC"] else "CCC"
+    assert summary[higher]["roic_pctile"] == 1.0
+    assert summary["AAA"]["roic_pctile"] + summary["CCC"]["roic_pctile"] == 1.5
+
+    with zipfile.ZipFile(outfile) as xlsx:
+        assert 'name="Peers"' in xlsx.read("xl/workbook.xml").decode()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_pipeline
+-------------
+
+Tests for the fetch, compute and write pipeline.
+"""
+
+import random
+import threading
+import time
+
+import pytest
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.pipeline import run_pipeline
+
+
+def test_pipeline_writes_in_order_with_bounded_in_flight():
+    lock = threading.Lock()
+    in_flight = [0, 0]  # current, maximum
+    written = []
+
+    def fetch(item):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(random.uniform(0, 0.005))
+        return item * 2
+
+    def compute(item, fetched):
+        time.sleep(random.uniform(0, 0.005))
+        return fetched + 1
+
+    def write(item, computed):
+        written.append((item, computed))
+        with lock:
+            in_flight[0] -= 1
+
+    run_pipeline(
+        range(200),
+        fetch,
+        compute,
+        write,
+        fetch_workers=8,
+        compute_workers=3,
+        max_in_flight=10,
+    )
+    assert written == [(i, i * 2 + 1) for i in range(200)]
+    assert in_flight[1] <= 10
+
+
+def test_pipeline_reraises_in_item_order():
+    written = []
+
+    def fetch(item):
+        if item == 5:
+            raise KeyError(item)
+        return item
+
+    with pytest.raises(KeyError):
+        run_pipeline(
+            range(50),
+            fetch,
+            lambda item, fetched: fetched,
+            lambda item, computed: written.append(item),
+            fetch_workers=4,
+        )
+    assert written == [0, 1, 2, 3, 4]
+
+
+def test_stock_xlsx_with_workers(sf1_table, tmp_path, monkeypatch):
+    summary = []
+    add_summary_values = fun.Excel.add_summary_values
+
+    def recording_add_summary_values(self, ticker, sum_ind_l):
+        summary.append(ticker)
+        add_summary_values(self, ticker, sum_ind_l)
+
+    monkeypatch.setattr(fun.Excel, "add_summary_values", recording_add_summary_values)
+    sf1_table.missing.add("CCC")
+    stocks = ["AAA", "BBB", "CCC", "DDD", "EEE", "FFF"]
+    fun.stock_xlsx(
+        str(tmp_path / "stocks.xlsx"), stocks, "SF0", "MRY", 5, workers=4
+    )
+    assert sorted(sf1_table.calls) == stocks
+    assert summary == ["AAA", "BBB", "DDD", "EEE", "FFF"]
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_portfolios
+---------------
+
+Tests for building the workbooks of a manifest from one shared pass.
+"""
+
+import collections
+import zipfile
+
+import pytest
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.portfolios import Job, read_manifest, run_manifest
+from quandl_fund_xlsx.resilience import DeadLetters
+
+
+def workbook(path):
+    with zipfile.ZipFile(path) as xlsx:
+        # core.xml holds the creation time
+        return {
+            name: xlsx.read(name)
+            for name in xlsx.namelist()
+            if name != "docProps/core.xml"
+        }
+
+
+def write_manifest(tmp_path, rows):
+    lines = ["tickers,output,dimension,years"]
+    for name, tickers, dimension, years in rows:
+        (tmp_path / ("%s.txt" % name)).write_text("\n".join(tickers) + "\n")
+        lines.append("%s.txt,%s.xlsx,%s,%s" % (name, name, dimension, years))
+    path = tmp_path / "manifest.csv"
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+def test_read_manifest(tmp_path):
+    path = write_manifest(
+        tmp_path,
+        [("income", ["aaa", "BBB ", "", "AAA"], "", ""), ("growth", ["CCC"], "ARQ", 8)],
+    )
+
+    jobs = read_manifest(path, "MRY", 5)
+
+    assert jobs == [
+        Job(["AAA", "BBB"], str(tmp_path / "income.xlsx"), "MRY", 5),
+        Job(["CCC"], str(tmp_path / "growth.xlsx"), "ARQ", 8),
+    ]
+
+
+def test_read_manifest_rejects_repeated_outputs(tmp_path):
+    path = write_manifest(tmp_path, [("income", ["AAA"], "MRY", 5)] * 2)
+    with pytest.raises(ValueError, match="more than once"):
+        read_manifest(path)
+
+
+@pytest.mark.parametrize("render_workers", [1, 2])
+def test_shared_tickers_fetched_once(sf1_table, tmp_path, render_workers):
+    sf1_table.missing.add("ZZZ")
+    jobs = [
+        Job(["AAA", "BBB"], str(tmp_path / "a.xlsx"), "MRY", 4),
+        Job(["BBB", "CCC", "ZZZ"], str(tmp_path / "b.xlsx"), "MRY", 4),
+        Job(["AAA"], str(tmp_path / "c.xlsx"), "MRQ", 4),
+        Job(["ZZZ"], str(tmp_path / "d.xlsx"), "MRY", 4),
+    ]
+
+    written = run_manifest(
+        jobs, "SF0", workers=2, render_workers=render_workers, bulk_threshold=None
+    )
+
+    assert written == collections.OrderedDict(
+        [
+            (jobs[0].output, 2),
+            (jobs[1].output, 2),
+            (jobs[2].output, 1),
+            (jobs[3].output, 0),
+        ]
+    )
+    assert sorted(sf1_table.calls) == ["AAA", "AAA", "BBB", "CCC", "ZZZ"]
+    assert not (tmp_path / "d.xlsx").exists()
+
+    # Each workbook is as stock_xlsx writes it
+    for job in jobs[:3]:
+        expected = tmp_path / "expected.xlsx"
+        fun.stock_xlsx(
+            str(expected),
+            job.tickers,
+            "SF0",
+            job.dimension,
+            job.years,
+            bulk_threshold=None,
+        )
+        expected = workbook(expected)
+        shared = workbook(job.output)
+        assert shared.keys() == expected.keys()
+        for name in expected:
+            assert shared[name] == expected[name], (job.output, name)
+
+
+@pytest.mark.parametrize("render_workers", [1, 2])
+def test_failed_tickers_left_out(sf1_table, tmp_path, monkeypatch, render_workers):
+    sf1_table.failing.add("BBB")
+    write_df = fun.Excel.write_df
+
+    def failing_write_df(excel, dframe, row, col, sheetname, *args, **kwargs):
+        if sheetname == "CCC" and row > 0:
+            raise ValueError("Malformed frame")
+        return write_df(excel, dframe, row, col, sheetname, *args, **kwargs)
+
+    monkeypatch.setattr(fun.Excel, "write_df", failing_write_df)
+    jobs = [
+        Job(["AAA", "BBB"], str(tmp_path / "a.xlsx"), "MRY", 4),
+        Job(["CCC", "DDD"], str(tmp_path / "b.xlsx"), "MRY", 4),
+    ]
+    dead_letters = DeadLetters()
+
+    written = run_manifest(
+        jobs,
+        "SF0",
+        render_workers=render_workers,
+        bulk_threshold=None,
+        dead_letters=dead_letters,
+    )
+
+    assert list(written.values()) == [1, 1]
+    assert dead_letters.failures == {
+        "BBB": ("fetch", "RuntimeError: Injected failure for BBB"),
+        "CCC": ("write", "ValueError: Malformed frame"),
+    }
+    with pytest.raises(RuntimeError):
+        run_manifest(jobs, "SF0", render_workers=render_workers, bulk_threshold=None)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_prices
+-----------
+
+Tests for the valuation ratios joined from daily prices.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_sf1_frame
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.prices import asof_valuations, current_valuations, read_prices
+
+
+def make_prices(tickers, start="2014-01-01", end="2020-12-31"):
+    frames = []
+    for i, ticker in enumerate(tickers):
+        dates = pd.bdate_range(start, end)
+        frames.append(
+            pd.DataFrame(
+                {
+                    "ticker": ticker,
+                    "date": dates,
+                    "close": 10.0 * (i + 1) + np.arange(len(dates)) / 100.0,
+                }
+            )
+        )
+    return pd.concat(frames, ignore_index=True)
+
+
+@pytest.fixture
+def price_file(tmp_path):
+    path = tmp_path / "prices.csv"
+    # Shuffled, as the rows of a price file need not be sorted
+    make_prices(["AAA", "BBB"]).sample(frac=1, random_state=1).to_csv(
+        path, index=False
+    )
+    return path
+
+
+def test_asof_valuations_match_lookups(price_file):
+    prices = read_prices(price_file)
+    sf1_df = pd.concat([make_sf1_frame("BBB"), make_sf1_frame("AAA")])
+    sf1_df = sf1_df.reset_index(drop=True)
+
+    valuations = asof_valuations(sf1_df, prices)
+
+    assert valuations.index.equals(sf1_df.index)
+    for i, row in sf1_df.iterrows():
+        ticker_prices = prices[
+            (prices["ticker"] == row["ticker"]) & (prices["date"] <= row["datekey"])
+        ]
+        price = ticker_prices.sort_values("date")["price"].iloc[-1]
+        rough_ffo_ps = (row["netinc"] + row["depamor"]) / row["shareswa"]
+        assert valuations.loc[i, "price_asof"] == price
+        assert valuations.loc[i, "price_rough_ffo_ps_ratio_asof"] == pytest.approx(
+            price / rough_ffo_ps
+        )
+        # Without daily ev the filing's ev moves with the market capitalization
+        ev = row["ev"] + (price - row["price"]) * row["shareswa"]
+        assert valuations.loc[i, "ev_opinc_ratio_asof"] == pytest.approx(
+            ev / row["opinc"]
+        )
+
+
+def test_current_valuations(price_file):
+    prices = read_prices(price_file)
+    sf1_df = pd.concat([make_sf1_frame("AAA"), make_sf1_frame("CCC")])
+
+    current = current_valuations(sf1_df, prices)
+
+    assert current.index.tolist() == ["AAA"]
+    latest = make_sf1_frame("AAA").iloc[0]  # newest first
+    price = prices[prices["ticker"] == "AAA"].sort_values("date")["price"].iloc[-1]
+    rough_ffo_ps = (latest["netinc"] + latest["depamor"]) / latest["shareswa"]
+    assert current.loc["AAA", "date"] == pd.Timestamp("2020-12-31")
+    assert current.loc["AAA", "price_rough_ffo_ps_ratio_current"] == pytest.approx(
+        price / rough_ffo_ps
+    )
+
+
+def test_stock_xlsx_with_prices(sf1_table, price_file, tmp_path, monkeypatch):
+    summaries = []
+    write_summary_sheet = fun.Excel.write_summary_sheet
+
+    def record_summary(excel, summarized_ind_dict, peer_groups=None):
+        summaries.extend(excel.summary_rows)
+        write_summary_sheet(excel, summarized_ind_dict, peer_groups)
+
+    monkeypatch.setattr(fun.Excel, "write_summary_sheet", record_summary)
+
+    prices = read_prices(price_file)
+    fun.stock_xlsx(
+        tmp_path / "prices.xlsx", ["AAA", "CCC"], "SF0", "MRY", 4, prices=prices
+    )
+
+    summary = {ticker: dict(values) for ticker, values in summaries}
+    current = current_valuations(make_sf1_frame("AAA"), prices)
+    assert summary["AAA"]["ev_opinc_ratio_current"] == pytest.approx(
+        current.loc["AAA", "ev_opinc_ratio_current"]
+    )
+    # CCC has no prices
+    assert summary["CCC"]["ev_opinc_ratio_current"] is None
+
+    frame = fun.fundamentals_frame(["AAA", "CCC"], "SF0", "MRY", 4, prices=prices)
+    assert frame["price_asof"].notna().tolist() == [True] * 4 + [False] * 4
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_profiles
+-------------
+
+Tests for the profiles of the blocks and ratios a build needs.
+"""
+
+import json
+import zipfile
+
+import pandas as pd
+import pytest
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.profiles import PROFILES, Profile, get_profile
+from quandl_fund_xlsx.ratios import with_dependencies
+
+
+def shared_strings(path):
+    with zipfile.ZipFile(path) as xlsx:
+        return xlsx.read("xl/sharedStrings.xml").decode()
+
+
+def test_full_profile_fetches_every_column(sf1_table):
+    fund = fun.load_fundamentals("AAA", "SF0", "MRY", 5)
+    fun.calc_fund_ratios("AAA", fund)
+
+    assert sf1_table.columns == [None]
+    assert [len(df) for df, _, _ in fun.stock_blocks(fund)] == [19, 6, 23, 14, 44]
+
+
+def test_profile_prunes_fetch_and_ratios(sf1_table):
+    profile = PROFILES["kjm"]
+    full = fun.load_fundamentals("AAA", "SF0", "MRY", 5)
+    fun.calc_fund_ratios("AAA", full)
+
+    fund = fun.load_fundamentals("AAA", "SF0", "MRY", 5, profile=profile)
+    fun.calc_fund_ratios("AAA", fund)
+
+    columns = sf1_table.columns[-1]
+    assert set(columns) == {
+        "ticker",
+        "dimension",
+        "calendardate",
+        "datekey",
+        "reportperiod",
+        "lastupdated",
+        "assets",
+        "cashnequsd",
+        "payables",
+        "deferredrev",
+        "opinc",
+        "fcf",
+        "shareswa",
+        "equity",
+        "intangibles",
+    }
+    assert set(fund.all_inds_df.columns) == set(columns)
+    assert set(fund.calc_ratios_df.columns) == {"datekey"} | set(
+        with_dependencies(profile.ratios)
+    )
+    pd.testing.assert_frame_equal(
+        fund.calc_ratios_df, full.calc_ratios_df[fund.calc_ratios_df.columns]
+    )
+
+    blocks = fun.stock_blocks(fund)
+    assert len(blocks) == 1
+    block_df = blocks[0][0]
+    assert list(block_df.index) == profile.ratios
+
+
+def test_summarized_ratios_calculated_but_not_shown(sf1_table):
+    profile = Profile(
+        "income",
+        blocks=["income"],
+        ratios=[],
+        summarize=[("kjm_roce_sub_cash", "asc"), ("workingcapital", "asc")],
+    )
+    fund = fun.load_fundamentals("AAA", "SF0", "MRY", 5, profile=profile)
+    fun.calc_fund_ratios("AAA", fund)
+
+    assert "workingcapital" in fund.all_inds_df.columns
+    assert list(fund.calc_ratios_df.columns) == [
+        "datekey",
+        "kjm_roce_sub_cash",
+        "kjm_capital_employed_sub_cash",
+    ]
+    assert [len(df) for df, _, _ in fun.stock_blocks(fund)] == [19]
+    assert [i for i, _ in fun.Excel.summarized_indicators(fund, "AAA")] == [
+        "kjm_roce_sub_cash",
+        "workingcapital",
+    ]
+
+
+def test_stock_xlsx_with_profile(sf1_table, tmp_path):
+    outfile = str(tmp_path / "reit.xlsx")
+
+    fun.stock_xlsx(
+        outfile,
+        ["AAA", "BBB"],
+        "SF0",
+        "MRY",
+        5,
+        screen="debt_cfo_ratio > 0",
+        profile=get_profile("reit"),
+    )
+
+    assert all(columns is not None for columns in sf1_table.columns)
+    strings = shared_strings(outfile)
+    assert "Sharadar Income MRY" in strings
+    assert "Sharadar Balance MRY" not in strings
+    assert "rough_ffo_dividend_payout_ratio" in strings
+    assert "kjm_roce_sub_cash" not in strings
+
+
+def test_profiles_file(tmp_path):
+    path = tmp_path / "profiles.json"
+    path.write_text(
+        json.dumps(
+            {
+                "dividends": {
+                    "blocks": ["cash_flow", "calculated"],
+                    "ratios": ["dividends_cfo_ratio"],
+                    "summarize": [["dividends_cfo_ratio", "desc"]],
+                },
+                "kjm": {"blocks": ["income"]},
+            }
+        )
+    )
+
+    profile = get_profile("dividends", path)
+    assert profile.blocks == ("cash_flow", "calculated")
+    assert profile.summarize == [("dividends_cfo_ratio", "desc")]
+    assert get_profile("kjm", path).ratios is None
+    assert get_profile("credit", path) is PROFILES["credit"]
+    with pytest.raises(ValueError, match="Unknown profile"):
+        get_profile("growth", path)
+
+
+@pytest.mark.parametrize(
+    "kwargs, message",
+    [
+        ({"blocks": ["prices"]}, "Unknown block"),
+        ({"ratios": ["roce"]}, "Unknown ratio"),
+        ({"summarize": [("roic", "up")]}, "asc or desc"),
+    ],
+)
+def test_invalid_profiles(kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        Profile("bad", **kwargs)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_resilience
+---------------
+
+Tests for isolating the tickers which fail and the circuit breaker on the
+fetch path.
+"""
+
+import sqlite3
+import threading
+import time
+import zipfile
+
+import pytest
+from quandl.errors.quandl_error import LimitExceededError, NotFoundError
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.resilience import CircuitBreaker, CircuitOpenError, DeadLetters
+
+
+def fail():
+    raise LimitExceededError("Too many requests")
+
+
+def test_failed_tickers_dead_lettered(sf1_table, tmp_path, monkeypatch):
+    stocks = ["AAA", "BBB", "CCC", "DDD", "EEE"]
+    sf1_table.failing.add("BBB")
+    sf1_table.missing.add("DDD")
+    real_get_table = fun.quandl.get_table
+
+    def get_table(datatable_code, ticker=None, dimension=None, **options):
+        sf1_df = real_get_table(datatable_code, ticker, dimension, **options)
+        if ticker == "EEE":
+            # A malformed response
+            sf1_df = sf1_df.drop(columns="revenue")
+        return sf1_df
+
+    monkeypatch.setattr(fun.quandl, "get_table", get_table)
+    dead_letters = DeadLetters()
+
+    fun.stock_xlsx(
+        str(tmp_path / "stocks.xlsx"),
+        stocks,
+        "SF0",
+        "MRY",
+        5,
+        workers=2,
+        dead_letters=dead_letters,
+    )
+
+    assert (tmp_path / "stocks.xlsx").exists()
+    assert dead_letters.tickers() == ["BBB", "EEE"]
+    assert dead_letters.failures["BBB"] == (
+        "fetch",
+        "RuntimeError: Injected failure for BBB",
+    )
+    dead_letters.write(tmp_path / "stocks.xlsx.failed")
+    with open(tmp_path / "stocks.xlsx.failed") as d_file:
+        assert fun.normalize_tickers(d_file) == ["BBB", "EEE"]
+
+
+def sheet_names(path):
+    with zipfile.ZipFile(path) as xlsx:
+        workbook = xlsx.read("xl/workbook.xml").decode()
+    return [part.split('"')[0] for part in workbook.split('<sheet name="')[1:]]
+
+
+def test_failed_write_dead_lettered(sf1_table, tmp_path, monkeypatch):
+    write_df = fun.Excel.write_df
+    summarized = []
+    add_summary_values = fun.Excel.add_summary_values
+
+    def failing_write_df(excel, dframe, row, col, sheetname, *args, **kwargs):
+        # Fails half way through BBB's sheet
+        if sheetname == "BBB" and row > 0:
+            raise ValueError("Malformed frame")
+        return write_df(excel, dframe, row, col, sheetname, *args, **kwargs)
+
+    def record_summary(excel, ticker, sum_ind_l):
+        summarized.append(ticker)
+        add_summary_values(excel, ticker, sum_ind_l)
+
+    monkeypatch.setattr(fun.Excel, "write_df", failing_write_df)
+    monkeypatch.setattr(fun.Excel, "add_summary_values", record_summary)
+    dead_letters = DeadLetters()
+
+    fun.stock_xlsx(
+        str(tmp_path / "stocks.xlsx"),
+        ["AAA", "BBB", "CCC"],
+        "SF0",
+        "MRY",
+        5,
+        dead_letters=dead_letters,
+    )
+
+    assert dead_letters.failures == {"BBB": ("write", "ValueError: Malformed frame")}
+    assert sheet_names(tmp_path / "stocks.xlsx") == ["Summary", "AAA", "CCC", "Issues"]
+    assert summarized == ["AAA", "CCC"]
+
+
+def test_failed_sql_add_leaves_no_sheet(sf1_table, tmp_path):
+    class FailingStore(object):
+        def __init__(self):
+            self.added = []
+
+        def add_fund(self, fund):
+            ticker = fund.all_inds_df["ticker"].iloc[0]
+            if ticker == "BBB":
+                raise sqlite3.OperationalError("database is locked")
+            self.added.append(ticker)
+
+    sql_store = FailingStore()
+    dead_letters = DeadLetters()
+
+    fun.stock_xlsx(
+        str(tmp_path / "stocks.xlsx"),
+        ["AAA", "BBB", "CCC"],
+        "SF0",
+        "MRY",
+        5,
+        sql_store=sql_store,
+        dead_letters=dead_letters,
+    )
+
+    assert dead_letters.tickers() == ["BBB"]
+    assert sql_store.added == ["AAA", "CCC"]
+    assert sheet_names(tmp_path / "stocks.xlsx") == ["Summary", "AAA", "CCC", "Issues"]
+
+
+def test_no_failures_remove_stale_file(tmp_path):
+    path = tmp_path / "stocks.xlsx.failed"
+    path.write_text("BBB  # fetch RuntimeError: earlier\n")
+    DeadLetters().write(path)
+    assert not path.exists()
+
+
+def test_failures_end_the_build_by_default(sf1_table, tmp_path):
+    sf1_table.failing.add("BBB")
+    with pytest.raises(RuntimeError):
+        fun.stock_xlsx(str(tmp_path / "stocks.xlsx"), ["AAA", "BBB"], "SF0", "MRY", 5)
+
+
+def test_failed_bulk_export_falls_back(sf1_table, tmp_path, monkeypatch):
+    def bulk_export(stocks, dimension):
+        raise TimeoutError("The export wasn't ready")
+        yield
+
+    monkeypatch.setattr(fun, "bulk_export", bulk_export)
+    dead_letters = DeadLetters()
+
+    fun.stock_xlsx(
+        str(tmp_path / "stocks.xlsx"),
+        ["AAA", "BBB"],
+        "SF0",
+        "MRY",
+        5,
+        bulk_threshold=1,
+        dead_letters=dead_letters,
+    )
+
+    assert sf1_table.calls == ["AAA", "BBB"]
+    assert len(dead_letters) == 0
+
+
+def test_breaker_pauses_then_closes():
+    breaker = CircuitBreaker(window=4, min_requests=4, cooldown=0.2)
+    for _ in range(2):
+        breaker.call(lambda: None)
+    for _ in range(2):
+        with pytest.raises(LimitExceededError):
+            breaker.call(fail)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    start = time.monotonic()
+    assert breaker.call(lambda: 1) == 1
+    assert time.monotonic() - start >= 0.2
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_ignores_unsupported_tickers():
+    breaker = CircuitBreaker(window=4, min_requests=4)
+
+    def not_found():
+        raise NotFoundError("Not found")
+
+    for _ in range(8):
+        with pytest.raises(NotFoundError):
+            breaker.call(not_found)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_single_trial_then_gives_up():
+    breaker = CircuitBreaker(
+        window=2, min_requests=2, cooldown=0.05, max_cooldown=0.1, max_trials=2
+    )
+    for _ in range(2):
+        with pytest.raises(LimitExceededError):
+            breaker.call(fail)
+
+    # While the trial request is in flight the other requests wait
+    calls = []
+    started = threading.Event()
+
+    def slow_fail():
+        calls.append("trial")
+        started.set()
+        time.sleep(0.1)
+        fail()
+
+    def request():
+        started.wait()
+        try:
+            breaker.call(lambda: calls.append("waited"))
+        except CircuitOpenError:
+            calls.append("refused")
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    with pytest.raises(LimitExceededError):
+        breaker.call(slow_fail)
+    # The waiting request is the next trial
+    thread.join()
+    assert calls == ["trial", "waited"]
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    # Opened again, then two failed trials
+    for _ in range(4):
+        with pytest.raises(LimitExceededError):
+            breaker.call(fail)
+    assert breaker.failed_trials == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: None)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_screen
+-----------
+
+Tests for screening stocks before their sheets are written.
+"""
+
+import pytest
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.screen import (
+    check_screen,
+    latest_values,
+    screen_names,
+    screen_stocks,
+)
+
+STOCKS = ["AAA", "BBB", "CCC", "DDD"]
+
+
+def load_funds(stocks):
+    funds = []
+    for stock in stocks:
+        fund = fun.load_fundamentals(stock, "SF0", "MRY", 4)
+        fund.calc_ratios()
+        funds.append((stock, fund))
+    return funds
+
+
+def test_screen_latest_values(sf1_table):
+    funds = load_funds(STOCKS)
+    latest = latest_values(funds)
+
+    assert latest.index.tolist() == STOCKS
+    assert latest.loc["BBB", "revenue"] == funds[1][1].all_inds_df["revenue"].iloc[-1]
+
+    median = latest["operating_margin"].median()
+    expected = [
+        stock
+        for stock, fund in funds
+        if fund.calc_ratios_df["operating_margin"].iloc[-1] > median
+        and fund.all_inds_df["revenue"].iloc[-1] > 0
+    ]
+    survivors = screen_stocks(latest, "operating_margin > %r and revenue > 0" % median)
+    assert survivors == expected
+    assert 0 < len(survivors) < len(STOCKS)
+
+
+def test_invalid_screens(sf1_table):
+    with pytest.raises(ValueError):
+        check_screen("operating_margin >")
+    latest = latest_values(load_funds(["AAA"]))
+    with pytest.raises(ValueError):
+        screen_stocks(latest, "no_such_ratio > 1")
+    with pytest.raises(ValueError):
+        screen_stocks(latest, "operating_margin + 1")
+
+
+def test_unknown_names_rejected_before_fetching(sf1_table, tmp_path):
+    assert screen_names("abs(roic) > 0.1 and roic < opinc_ps") == ["roic", "opinc_ps"]
+    check_screen("abs(roic) > 0.1 and marketcap > 1e9 and operating_margin > 0")
+
+    with pytest.raises(ValueError) as exc_info:
+        fun.stock_xlsx(
+            tmp_path / "screened.xlsx",
+            STOCKS,
+            "SF0",
+            "MRY",
+            4,
+            screen="revenue > 0 and no_such_ratio > 1 and opmargin < 2",
+        )
+    assert str(exc_info.value).endswith("ratios no_such_ratio, opmargin")
+    assert sf1_table.calls == []
+
+
+def test_sheets_only_for_survivors(sf1_table, tmp_path, monkeypatch):
+    written = []
+    summarized = []
+    write_stock_sheet = fun.write_stock_sheet
+    add_summary_values = fun.Excel.add_summary_values
+
+    def record_sheet(excel, stock, blocks, dimension):
+        written.append(stock)
+        write_stock_sheet(excel, stock, blocks, dimension)
+
+    def record_summary(excel, stock, sum_ind_l):
+        summarized.append(stock)
+        add_summary_values(excel, stock, sum_ind_l)
+
+    monkeypatch.setattr(fun, "write_stock_sheet", record_sheet)
+    monkeypatch.setattr(fun.Excel, "add_summary_values", record_summary)
+
+    latest = latest_values(load_funds(STOCKS))
+    screen = "ebitda > %r" % latest["ebitda"].median()
+    expected = screen_stocks(latest, screen)
+
+    fun.stock_xlsx(
+        tmp_path / "screened.xlsx", STOCKS, "SF0", "MRY", 4, workers=2, screen=screen
+    )
+    assert written == expected
+    assert summarized == STOCKS
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_server
+-----------
+
+Tests for the workbook service, using the local stand-in for the SF1 table.
+"""
+
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from quandl.connection import Connection
+
+from quandl_fund_xlsx.server import WorkbookServer, share_quandl_session
+
+
+@pytest.fixture
+def workbook_server(sf1_table):
+    server = WorkbookServer(("127.0.0.1", 0), "SF0", workers=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_requests_share_fetches(workbook_server, sf1_table):
+    sf1_table.delay = 0.2
+    urls = [
+        workbook_server.url + "/workbook?tickers=AAA,BBB&periods=4",
+        workbook_server.url + "/workbook?tickers=BBB,CCC&periods=4",
+    ]
+    with ThreadPoolExecutor(2) as pool:
+        bodies = list(pool.map(lambda url: urllib.request.urlopen(url).read(), urls))
+
+    for body in bodies:
+        assert body[:2] == b"PK"  # xlsx files are zip archives
+    assert sorted(sf1_table.calls) == ["AAA", "BBB", "CCC"]
+
+
+def test_post_ticker_list(workbook_server, sf1_table):
+    request = urllib.request.Request(
+        workbook_server.url + "/workbook?dimension=ARY",
+        data=b"AAA\n\nBBB\n",
+        method="POST",
+    )
+    assert urllib.request.urlopen(request).read()[:2] == b"PK"
+    assert sorted(sf1_table.calls) == ["AAA", "BBB"]
+
+
+def test_bad_request(workbook_server):
+    with pytest.raises(urllib.error.HTTPError) as excinfo:
+        urllib.request.urlopen(
+            workbook_server.url + "/workbook?tickers=AAA&dimension=X"
+        )
+    assert excinfo.value.code == 400
+
+
+def test_shared_session_restored():
+    get_session = Connection.get_session
+    with share_quandl_session(pool_size=2) as session:
+        assert Connection.get_session() is session
+    assert Connection.get_session == get_session
+    assert Connection.get_session() is not session
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_sqlstore
+-------------
+
+Tests for the SQLite store of indicators and calculated ratios.
+"""
+
+import pytest
+
+from conftest import make_sf1_frame
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.sqlstore import SQLStore
+
+
+@pytest.fixture
+def sql_store(sf1_table, tmp_path):
+    with SQLStore(tmp_path / "fundamentals.db") as store:
+        fun.stock_xlsx(
+            tmp_path / "stocks.xlsx",
+            ["AAA", "BBB", "CCC"],
+            "SF0",
+            "MRY",
+            4,
+            sql_store=store,
+        )
+        yield store
+
+
+def test_rows_keyed_by_ticker_dimension_datekey(sql_store):
+    assert sql_store.tickers() == ["AAA", "BBB", "CCC"]
+    counts = sql_store.query(
+        "SELECT ticker, COUNT(*) AS n FROM fundamentals GROUP BY ticker"
+    )
+    assert counts["n"].tolist() == [4, 4, 4]
+
+    # Adding a ticker again replaces its rows, dropping those not added
+    sf1_df = make_sf1_frame("AAA").head(2)
+    sql_store.add(sf1_df)
+    assert sql_store.query("SELECT COUNT(*) AS n FROM fundamentals")["n"][0] == 10
+    aaa = sql_store.query(
+        "SELECT datekey FROM fundamentals WHERE ticker = 'AAA' ORDER BY datekey"
+    )
+    assert aaa["datekey"].tolist() == sorted(
+        sf1_df["datekey"].dt.strftime("%Y-%m-%d")
+    )
+
+
+def test_screen_latest_rows(sql_store, sf1_table):
+    fund = fun.SharadarFundamentals("SF0")
+    fund.get_indicators("BBB", "MRY", 4)
+    fund.calc_ratios()
+    latest = fund.calc_ratios_df["debt_ebitda_ratio"].iloc[-1]
+
+    screened = sql_store.screen(
+        "debt_ebitda_ratio = ?", ["debt_ebitda_ratio"], "MRY", params=[latest]
+    )
+    assert screened["ticker"].tolist() == ["BBB"]
+    assert screened["datekey"][0] == str(fund.all_inds_df["datekey"].iloc[-1].date())
+    assert sql_store.screen("1 = 1", dimension="ARQ").empty
+
+
+def test_query_with_window_functions(sql_store):
+    rising = sql_store.query(
+        """
+        SELECT ticker FROM (
+            SELECT ticker, datekey, kjm_roce_with_cash,
+                LAG(kjm_roce_with_cash) OVER (
+                    PARTITION BY ticker ORDER BY datekey
+                ) AS previous,
+                ROW_NUMBER() OVER (
+                    PARTITION BY ticker ORDER BY datekey DESC
+                ) AS age
+            FROM fundamentals
+        ) WHERE age = 1 AND kjm_roce_with_cash > previous
+        ORDER BY ticker
+        """
+    )
+    expected = []
+    for ticker in ("AAA", "BBB", "CCC"):
+        fund = fun.SharadarFundamentals("SF0")
+        fund.get_indicators(ticker, "MRY", 4)
+        fund.calc_ratios()
+        roce = fund.calc_ratios_df["kjm_roce_with_cash"]
+        if roce.iloc[-1] > roce.iloc[-2]:
+            expected.append(ticker)
+    assert rising["ticker"].tolist() == expected
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_tracing
+------------
+
+Tests for the structured trace events of a build.
+"""
+
+import json
+import logging
+
+import pytest
+
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx import tracing
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / "build.jsonl"
+    tracing.enable(path)
+    yield path
+    tracing.disable()
+
+
+def read_events(path):
+    with open(path) as t_file:
+        return [json.loads(line) for line in t_file]
+
+
+def test_disabled_span_does_nothing(tmp_path):
+    assert not tracing.enabled()
+    with tracing.span("fetch", "AAA", rows=5) as span:
+        span.set(rows=6)
+    assert span is tracing.span("ratios")
+    tracing.emit({"stage": "fetch"})
+
+
+def test_spans_written_as_json_lines(trace_file):
+    assert tracing.enabled()
+    with tracing.span("fetch", "AAA") as span:
+        span.set(rows=5)
+    with pytest.raises(KeyError):
+        with tracing.span("ratios", "AAA"):
+            raise KeyError("revenue")
+    tracing.disable()
+
+    fetch, ratios = read_events(trace_file)
+    assert fetch["stage"] == "fetch"
+    assert fetch["ticker"] == "AAA"
+    assert fetch["rows"] == 5
+    assert fetch["duration_ms"] >= 0
+    assert "error" not in fetch
+    assert ratios["error"] == "KeyError"
+
+    # Written no more once disabled
+    with tracing.span("fetch", "BBB"):
+        pass
+    assert len(read_events(trace_file)) == 2
+
+
+def test_build_traced(sf1_table, tmp_path, trace_file):
+    stocks = ["AAA", "BBB", "CCC"]
+    sf1_table.missing.add("CCC")
+
+    fun.stock_xlsx(str(tmp_path / "out.xlsx"), stocks, "SF0", "MRY", 5, workers=2)
+    tracing.disable()
+
+    events = read_events(trace_file)
+    stages = {(event["stage"], event["ticker"]) for event in events}
+    for stock in ("AAA", "BBB"):
+        for stage in ("fetch", "ratios", "render", "write"):
+            assert (stage, stock) in stages
+    assert ("fetch", "CCC") in stages
+    assert ("ratios", "CCC") not in stages
+    rows = {e["ticker"]: e["rows"] for e in events if e["stage"] == "fetch"}
+    assert rows == {"AAA": 6, "BBB": 6, "CCC": 0}
+
+
+def test_debug_frames_only_formatted_when_logged(sf1_table, monkeypatch):
+    formatted = []
+    real_head = fun.pd.DataFrame.head
+
+    def head(self, *args, **kwargs):
+        formatted.append(True)
+        return real_head(self, *args, **kwargs)
+
+    monkeypatch.setattr(fun.pd.DataFrame, "head", head)
+    monkeypatch.setattr(fun.logger, "level", logging.INFO)
+    fund = fun.SharadarFundamentals("SF0")
+    fund.get_indicators("AAA", "MRY", 5)
+    assert not formatted
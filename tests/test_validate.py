@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_validate
+-------------
+
+Tests for the data quality checks run before the ratios are written.
+"""
+
+import ast
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from conftest import make_sf1_frame
+from quandl_fund_xlsx import fundamentals as fun
+from quandl_fund_xlsx.panel import build_panel
+from quandl_fund_xlsx.ratios import RATIO_EXPRESSIONS, expression_source
+from quandl_fund_xlsx.validate import denominators
+
+STOCKS = ["AAA", "BBB", "CCC"]
+
+
+def sorted_frame(ticker, **kwargs):
+    return make_sf1_frame(ticker, **kwargs).iloc[::-1].reset_index(drop=True)
+
+
+def checks(issues, check):
+    found = issues[issues["check"] == check]
+    return sorted(zip(found["indicator"], found["datekey"].dt.year))
+
+
+def test_denominators():
+    assert denominators("debt_ebitda_ratio") == ("ebitda",)
+    assert denominators("price_rough_ffo_ps_ratio") == (
+        "rough_ffo / shareswa",
+        "shareswa",
+    )
+    assert denominators("rough_ffo") == ()
+
+
+def test_expression_source_round_trips():
+    for expression in list(RATIO_EXPRESSIONS.values()) + [
+        "a - (b - c)",
+        "(a ** b) ** c",
+        "-(a + b) * 2.5",
+    ]:
+        tree = ast.parse(expression, mode="eval")
+        source = expression_source(tree)
+        assert ast.dump(ast.parse(source, mode="eval")) == ast.dump(tree)
+    assert expression_source(ast.parse("a - (b - c)", mode="eval")) == "a - (b - c)"
+
+
+def test_zero_denominators_masked(sf1_table):
+    sf1_df = sorted_frame("AAA")
+    sf1_df.loc[1, "ebitda"] = 0.0
+    sf1_df.loc[2, "ncfo"] = -sf1_df.loc[2, "ncfo"]
+    fund = fun.SharadarFundamentals("SF0")
+    fund.set_indicators(sf1_df, "MRY", 6)
+
+    calc_ratios_df = fund.calc_ratios()
+
+    assert calc_ratios_df.loc[1, "debt_ebitda_ratio"] is None
+    assert calc_ratios_df.loc[1, "net_debt_ebitda_ratio"] is None
+    assert calc_ratios_df.loc[0, "debt_ebitda_ratio"] is not None
+    assert not (calc_ratios_df == 999999999).any().any()
+
+    year = sf1_df.loc[1, "datekey"].year
+    zero = checks(fund.issues_df, "zero_denominator")
+    assert ("debt_ebitda_ratio", year) in zero
+    assert ("free_cash_flow_conversion_ratio", year) in zero
+    assert all(y == year for _, y in zero)
+    negative = checks(fund.issues_df, "negative_denominator")
+    assert ("debt_cfo_ratio", sf1_df.loc[2, "datekey"].year) in negative
+    assert all(ratio != "debt_ebitda_ratio" for ratio, _ in negative)
+
+
+def test_period_issues(sf1_table):
+    sf1_df = sorted_frame("AAA")
+    sf1_df = sf1_df.drop(index=2)
+    restated = sf1_df.loc[[4]].copy()
+    restated["datekey"] += pd.Timedelta(days=30)
+    restated["revenue"] *= 1.05
+    duplicate = sf1_df.loc[[5]].copy()
+    sf1_df = pd.concat([sf1_df, restated, duplicate])
+    sf1_df = sf1_df.sort_values("datekey", kind="stable").reset_index(drop=True)
+    fund = fun.SharadarFundamentals("SF0")
+    fund.set_indicators(sf1_df, "MRY", 6)
+
+    issues = fund.validate()
+
+    assert checks(issues, "missing_period") == [("calendardate", 2018)]
+    missing = issues[issues["check"] == "missing_period"]
+    assert missing["value"].tolist() == [1.0]
+    assert checks(issues, "duplicate_datekey") == [("datekey", 2020)]
+    assert checks(issues, "restated") == [("revenue", 2019)]
+
+
+def test_panel_validate_matches_per_stock(sf1_table, tmp_path, monkeypatch):
+    def get_table(datatable_code, ticker=None, dimension=None, **options):
+        sf1_df = sf1_table(datatable_code, ticker, dimension, **options)
+        if ticker == "BBB":
+            sf1_df.loc[1, "ebitda"] = 0.0
+        return sf1_df
+
+    monkeypatch.setattr(fun.quandl, "get_table", get_table)
+    panel = build_panel(tmp_path / "panel", STOCKS, "SF0", "MRY", 5)
+
+    issues = panel.validate()
+    expected = []
+    for stock in STOCKS:
+        fund = fun.load_fundamentals(stock, "SF0", "MRY", 5)
+        fund.calc_ratios()
+        expected.append(fund.issues_df)
+    expected = pd.concat(expected, ignore_index=True)
+
+    def key(frame):
+        return sorted(
+            zip(frame["ticker"], frame["datekey"], frame["check"], frame["indicator"])
+        )
+
+    assert key(issues) == key(expected)
+    assert "BBB" in set(issues.loc[issues["check"] == "zero_denominator", "ticker"])
+    ratios = panel.calc_ratios()
+    assert np.isnan(ratios["debt_ebitda_ratio"][panel.rows("BBB")]).sum() == 1
+    assert np.isfinite(ratios["debt_ebitda_ratio"][panel.rows("AAA")]).all()
+
+
+def test_stock_xlsx_writes_issues(sf1_table, tmp_path):
+    issues_file = tmp_path / "issues.csv"
+    fun.stock_xlsx(
+        str(tmp_path / "stocks.xlsx"), STOCKS, "SF0", "MRY", 4, issues_file=issues_file
+    )
+
+    issues = pd.read_csv(issues_file)
+    assert list(issues.columns) == ["ticker", "datekey", "check", "indicator", "value"]
+    assert set(issues["ticker"]) <= set(STOCKS)
+    assert (issues["check"] == "negative_denominator").any()
+    with zipfile.ZipFile(tmp_path / "stocks.xlsx") as xlsx:
+        assert b'name="Issues"' in xlsx.read("xl/workbook.xml")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_write_cells
+----------------
+
+Tests that writing the sheet blocks directly with xlsxwriter gives the same
+workbook as writing them with DataFrame.to_excel.
+"""
+
+import zipfile
+
+import numpy as np
+
+from conftest import make_sf1_frame
+from quandl_fund_xlsx import fundamentals as fun
+
+
+def write_workbook(path, blocks, use_pandas):
+    excel = fun.Excel(str(path), use_pandas=use_pandas)
+    for sheet in ("AAA", "BBB"):
+        fun.write_stock_sheet(excel, sheet, blocks, "MRY")
+    excel.save()
+    with zipfile.ZipFile(path) as xlsx:
+        # core.xml holds the creation time
+        return {
+            name: xlsx.read(name)
+            for name in xlsx.namelist()
+            if name != "docProps/core.xml"
+        }
+
+
+def test_direct_cells_match_to_excel(sf1_table, tmp_path):
+    sf1_df = make_sf1_frame("AAA").iloc[::-1].reset_index(drop=True)
+    sf1_df.loc[1, "evebitda"] = np.inf
+    sf1_df.loc[2, "pe"] = -np.inf
+    sf1_df.loc[3, "revenue"] = np.nan
+    fund = fun.SharadarFundamentals("SF0")
+    fund.set_indicators(sf1_df, "MRY", 6)
+    fund.calc_ratios()
+    blocks = fun.stock_blocks(fund)
+
+    direct = write_workbook(tmp_path / "direct.xlsx", blocks, use_pandas=False)
+    pandas = write_workbook(tmp_path / "pandas.xlsx", blocks, use_pandas=True)
+
+    assert direct.keys() == pandas.keys()
+    for name in pandas:
+        assert direct[name] == pandas[name], name
+    assert b">inf<" in direct["xl/sharedStrings.xml"]
+
+
+def test_text_values_fall_back_to_to_excel(sf1_table, tmp_path):
+    fund = fun.load_fundamentals("AAA", "SF0", "MRY", 4)
+    fund.calc_ratios()
+    block = fund.get_transposed_and_formatted_calculated_ratios()
+    block.iloc[0, 3] = "n/a"
+
+    excel = fun.Excel(str(tmp_path / "stocks.xlsx"))
+    assert not excel.write_cells(block, 1, 0, "AAA")
+    assert excel.workbook.get_worksheet_by_name("AAA") is None
+    excel.write_df(block, 0, 0, "AAA", "MRY")
+    excel.save()
+    with zipfile.ZipFile(tmp_path / "stocks.xlsx") as xlsx:
+        assert b"n/a" in xlsx.read("xl/sharedStrings.xml")
+
+
+def test_direct_cells_then_to_excel_on_one_sheet(sf1_table, tmp_path):
+    fund = fun.load_fundamentals("AAA", "SF0", "MRY", 4)
+    fund.calc_ratios()
+    blocks = fun.stock_blocks(fund)
+    # The last block falls back to to_excel
+    block, use_header, blank_rows_after = blocks[-1]
+    block = block.copy()
+    block.iloc[0, 3] = "n/a"
+    blocks[-1] = (block, use_header, blank_rows_after)
+
+    excel = fun.Excel(str(tmp_path / "sheets.xlsx"))
+    assert excel.write_cells(blocks[0][0], 1, 0, "AAA")
+    assert "AAA" in excel.writer.sheets
+
+    direct = write_workbook(tmp_path / "direct.xlsx", blocks, use_pandas=False)
+    pandas = write_workbook(tmp_path / "pandas.xlsx", blocks, use_pandas=True)
+    assert direct == pandas